@@ -5,40 +5,2313 @@ A modern, cross-platform setup script for macOS, Windows, and Linux
 """
 
 import os
+import re
 import sys
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
 import platform
 import subprocess
+import threading
 import json
+import random
+import signal
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Optional
-
-try:
-    from rich.console import Console
-    from rich.panel import Panel
-    from rich.progress import Progress, SpinnerColumn, TextColumn
-    from rich.prompt import Confirm, Prompt
-    from rich.table import Table
-    from rich import print as rprint
-except ImportError:
-    print("❌ Rich library not found. Installing...")
-    subprocess.run([sys.executable, "-m", "pip", "install", "rich"], check=True)
-    from rich.console import Console
-    from rich.panel import Panel
-    from rich.progress import Progress, SpinnerColumn, TextColumn
-    from rich.prompt import Confirm, Prompt
-    from rich.table import Table
-    from rich import print as rprint
-
-console = Console()
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
 
 
-class AtriumOS:
+class PlainConsole:
+    """Output backend without third-party imports
+
+    Used with --plain, when stdout is not a terminal, or when rich is not
+    installed. Rich markup is stripped so messages read the same in logs.
+    """
+
+    MARKUP = re.compile(r"\[/?[a-zA-Z#][\w .#-]*\]|\[/\]")
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lock = threading.Lock()
+
+    def strip(self, text: str) -> str:
+        return self.MARKUP.sub("", text)
+
+    def print(self, *objects, markup: bool = True, **kwargs):
+        text = " ".join(str(obj) for obj in objects)
+        if markup:
+            text = self.strip(text)
+        with self._lock:
+            self.stream.write(text + "\n")
+            self.stream.flush()
+
+    def panel(self, body: str, title: Optional[str] = None, style: str = "cyan"):
+        if title:
+            self.print(f"== {title} ==")
+        self.print(body.lstrip("\n").rstrip())
+
+    def table(self, rows: List[Tuple[str, ...]], columns: Optional[List[str]] = None,
+              title: Optional[str] = None, style: str = "cyan"):
+        rows = [tuple(self.strip(str(cell)) for cell in row) for row in rows]
+        if columns:
+            rows.insert(0, tuple(columns))
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))] if rows else []
+        if title:
+            self.print(f"== {title} ==")
+        for row in rows:
+            self.print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+    def confirm(self, question: str, default: bool = True) -> bool:
+        choices = "[Y/n]" if default else "[y/N]"
+        answer = input(f"{self.strip(question)} {choices} ").strip().lower()
+        return default if not answer else answer in ("y", "yes")
+
+    def prompt(self, question: str) -> str:
+        return input(f"{self.strip(question)}: ").strip()
+
+    @contextmanager
+    def status(self, description: str):
+        """Announce a command and yield a callback that echoes its output lines"""
+        self.print(f"→ {description}...")
+        yield lambda line: self.print(f"  {line}", markup=False)
+
+    background = status
+
+    @contextmanager
+    def dashboard(self, steps: List[str], done: Optional[List[str]] = None):
+        """Log step state changes as single lines; there is nothing to redraw"""
+        self._started = time.perf_counter()
+        yield
+
+    def step_update(self, name: str, state: str):
+        """Log that a step started, finished, failed or was skipped"""
+        elapsed = time.perf_counter() - getattr(self, "_started", time.perf_counter())
+        self.print(f"[{elapsed:7.2f}s] {name}: {state}")
+
+    @contextmanager
+    def suspended(self):
+        yield
+
+
+class JsonConsole(PlainConsole):
+    """Output backend writing one JSON object per line, for CI logs and other tools"""
+
+    def _emit(self, event: str, **fields):
+        record = {"time": round(time.time(), 3), "event": event}
+        record.update(fields)
+        with self._lock:
+            self.stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.stream.flush()
+
+    def print(self, *objects, markup: bool = True, **kwargs):
+        text = " ".join(str(obj) for obj in objects)
+        self._emit("message", text=self.strip(text) if markup else text)
+
+    def panel(self, body: str, title: Optional[str] = None, style: str = "cyan"):
+        self._emit("panel", title=title, text=self.strip(str(body)).strip())
+
+    def table(self, rows: List[Tuple[str, ...]], columns: Optional[List[str]] = None,
+              title: Optional[str] = None, style: str = "cyan"):
+        self._emit("table", title=title, columns=columns,
+                   rows=[[self.strip(str(cell)) for cell in row] for row in rows])
+
+    @contextmanager
+    def status(self, description: str):
+        """Log a command and yield a callback that logs its output lines"""
+        self._emit("command", description=description)
+        yield lambda line: self._emit("output", description=description, line=line)
+
+    background = status
+
+    def step_update(self, name: str, state: str):
+        self._emit("step", step=name, state=state,
+                   elapsed=round(time.perf_counter() - getattr(self, "_started", time.perf_counter()), 3))
+
+
+class RichConsole:
+    """Interactive terminal backend built on rich, imported on first use"""
+
+    def __init__(self, refresh_rate: float = 4):
+        from rich.console import Console
+        self._console = Console()
+        self.refresh_rate = refresh_rate
+        self._dashboard = None  # type: Optional[Dashboard]
+        self._live = None
+
+    def print(self, *objects, **kwargs):
+        self._console.print(*objects, **kwargs)
+
+    def panel(self, body, title: Optional[str] = None, style: str = "cyan"):
+        from rich.panel import Panel
+        if title:
+            self._console.print(Panel(body, title=f"[bold {style}]{title}[/bold {style}]", border_style=style))
+        else:
+            self._console.print(Panel(body, border_style=style, padding=(1, 2)))
+
+    def table(self, rows: List[Tuple[str, ...]], columns: Optional[List[str]] = None,
+              title: Optional[str] = None, style: str = "cyan"):
+        from rich.table import Table
+        table = Table(show_header=bool(columns), box=None, padding=(0, 2))
+        for column in columns or []:
+            table.add_column(column)
+        for row in rows:
+            table.add_row(*row)
+        self.panel(table, title=title, style=style)
+
+    def confirm(self, question: str, default: bool = True) -> bool:
+        from rich.prompt import Confirm
+        return Confirm.ask(question, default=default, console=self._console)
+
+    def prompt(self, question: str) -> str:
+        from rich.prompt import Prompt
+        return Prompt.ask(question, console=self._console)
+
+    @contextmanager
+    def status(self, description: str):
+        """Show a spinner and yield a callback that shows the latest output line next to it
+
+        Inside a dashboard the command shows up in its step's row instead.
+        """
+        if self._dashboard is not None:
+            with self._dashboard.command(description) as show:
+                yield show
+            return
+        if threading.current_thread() is not threading.main_thread():
+            with self.background(description) as show:
+                yield show
+            return
+        
+        from rich.markup import escape
+        from rich.progress import Progress, SpinnerColumn, TextColumn
+        with Progress(
+            SpinnerColumn(),
+            TextColumn("[progress.description]{task.description}"),
+            console=self._console,
+        ) as progress:
+            task = progress.add_task(description=description, total=None)
+            yield lambda line: progress.update(task, description=f"{description} [dim]{escape(line[:80])}[/dim]")
+
+    @contextmanager
+    def background(self, description: str):
+        """Announce a command started off the main thread, where no live display can run"""
+        if self._dashboard is not None:
+            with self._dashboard.command(description) as show:
+                yield show
+            return
+        self._console.print(f"[cyan]→[/cyan] {description}...")
+        yield lambda line: None
+
+    @contextmanager
+    def dashboard(self, steps: List[str], done: Optional[List[str]] = None):
+        """Show every step of the session in one live table until the block ends"""
+        from rich.live import Live
+        self._dashboard = Dashboard(steps, done)
+        try:
+            with Live(self._dashboard, console=self._console, refresh_per_second=self.refresh_rate) as live:
+                self._live = live
+                yield
+        finally:
+            self._dashboard = None
+            self._live = None
+
+    def step_update(self, name: str, state: str):
+        if self._dashboard is not None:
+            self._dashboard.update(name, state)
+
+    @contextmanager
+    def suspended(self):
+        """Hand the terminal to an interactive command, then bring the dashboard back"""
+        if self._live is None:
+            yield
+            return
+        self._live.stop()
+        try:
+            yield
+        finally:
+            self._live.start()
+
+
+class Dashboard:
+    """Rows of a session-wide live display: one per step, with its state and latest output
+
+    Updates only change fields; the table is built when rich refreshes the
+    display, so its cost depends on the refresh rate, not on how much the
+    steps print.
+    """
+
+    ICONS = {
+        "queued": "[dim]·[/dim]",
+        "running": None,
+        "done": "[green]✓[/green]",
+        "up to date": "[green]✓[/green]",
+        "failed": "[red]✗[/red]",
+        "skipped": "[yellow]⚠[/yellow]",
+    }
+
+    def __init__(self, steps: List[str], done: Optional[List[str]] = None):
+        self.rows = {name: {"state": "queued", "detail": "", "start": None, "end": None} for name in steps}
+        for name in done or []:
+            self.rows[name] = {"state": "up to date", "detail": "", "start": None, "end": None}
+        self._local = threading.local()
+
+    def update(self, name: str, state: str):
+        row = self.rows.setdefault(name, {"state": state, "detail": "", "start": None, "end": None})
+        row["state"] = state
+        if state == "running":
+            row["start"] = time.perf_counter()
+            self._local.step = name
+        elif row["start"] is not None:
+            row["end"] = time.perf_counter()
+
+    @contextmanager
+    def command(self, description: str):
+        """Show a command and its latest output line in the row of the step on this thread"""
+        row = self.rows.get(getattr(self._local, "step", None))
+        if row is None:
+            yield lambda line: None
+            return
+        row["detail"] = description
+        
+        def show(line: str):
+            row["detail"] = f"{description}: {line[:80]}"
+        yield show
+        row["detail"] = ""
+
+    def __rich__(self):
+        from rich.markup import escape
+        from rich.spinner import Spinner
+        from rich.table import Table
+        table = Table(show_header=False, box=None, padding=(0, 1))
+        now = time.perf_counter()
+        for name, row in self.rows.items():
+            icon = self.ICONS.get(row["state"]) or Spinner("dots", style="cyan")
+            elapsed = ""
+            if row["start"] is not None:
+                elapsed = f"{(row['end'] or now) - row['start']:.1f}s"
+            state = row["state"] if row["state"] != "running" else "[cyan]running[/cyan]"
+            table.add_row(icon, f"[bold]{name}[/bold]", state, elapsed, f"[dim]{escape(row['detail'])}[/dim]")
+        return table
+
+
+class ConsoleProxy:
+    """Module-wide console that picks its backend on first use
+
+    rich is only imported when output goes to an interactive terminal, so
+    --help, --plain and CI runs never pay for it.
+    """
+
+    def __init__(self):
+        self.plain = False
+        self.log_format = "plain"
+        self.refresh_rate = 4.0
+        self._backend = None
+
+    def use_plain(self, plain: bool = True):
+        self.plain = plain
+        self._backend = None
+
+    def configure(self, plain: bool = False, log_format: str = "plain", refresh_rate: float = 4.0):
+        """Choose the backend: rich on a terminal, else plain text or JSON lines"""
+        self.plain = plain or log_format == "json"
+        self.log_format = log_format
+        self.refresh_rate = refresh_rate
+        self._backend = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            if not self.plain and sys.stdout.isatty():
+                try:
+                    self._backend = RichConsole(self.refresh_rate)
+                except ImportError:
+                    self._backend = PlainConsole()
+                    self._backend.print("ℹ Install rich for the full interface: pip install rich")
+            elif self.log_format == "json":
+                self._backend = JsonConsole()
+            else:
+                self._backend = PlainConsole()
+        return self._backend
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+
+console = ConsoleProxy()
+
+HOMEBREW_INSTALL_URL = "https://raw.githubusercontent.com/Homebrew/install/HEAD/install.sh"
+GH_KEYRING_URL = "https://cli.github.com/packages/githubcli-archive-keyring.gpg"
+GH_RPM_REPO_URL = "https://cli.github.com/packages/rpm/gh-cli.repo"
+OH_MY_POSH_RELEASE_URL = "https://github.com/JanDeDobbeleer/oh-my-posh/releases/latest/download/posh-linux-{arch}"
+
+# platform.machine() -> architecture suffix of release binaries
+RELEASE_ARCHITECTURES = {
+    "x86_64": "amd64",
+    "amd64": "amd64",
+    "aarch64": "arm64",
+    "arm64": "arm64",
+    "armv7l": "arm",
+}
+
+
+@dataclass
+class Step:
+    """A setup step and the names of the steps it depends on"""
+    name: str
+    action: Callable[[], Optional[bool]]
+    requires: Tuple[str, ...] = ()
+    interactive: bool = False
+    prompts: Tuple[str, ...] = ()
+    # Steps that only have to finish first, whether they succeeded or not
+    after: Tuple[str, ...] = ()
+
+
+class StepScheduler:
+    """Run a step graph on a bounded worker pool
+
+    A step starts as soon as everything it requires has finished, so the total
+    run time follows the critical path instead of the sum of all steps.
+    Interactive steps need the terminal and run on the main thread once the
+    pool is idle. Dependencies on steps that are not part of the graph (for
+    example Homebrew on Linux) are treated as satisfied.
+    """
+
+    def __init__(self, steps: List[Step], max_workers: int = 4):
+        self.steps = {step.name: step for step in steps}
+        self.max_workers = max(1, max_workers)
+        self._check_cycles()
+
+    def _check_cycles(self):
+        """Refuse to run a graph whose dependencies loop back on themselves"""
+        visiting, done = set(), set()
+
+        def visit(name, path):
+            if name in done or name not in self.steps:
+                return
+            if name in visiting:
+                raise ValueError(f"Step dependency cycle: {' -> '.join(path + [name])}")
+            visiting.add(name)
+            for dep in self.steps[name].requires + self.steps[name].after:
+                visit(dep, path + [name])
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.steps:
+            visit(name, [])
+
+    def _requires(self, step: Step) -> List[str]:
+        return [dep for dep in step.requires if dep in self.steps]
+
+    def _waits_for(self, step: Step) -> List[str]:
+        return [dep for dep in step.requires + step.after if dep in self.steps]
+
+    def run(self) -> Dict[str, bool]:
+        """Run every step and return whether each one succeeded"""
+        results: Dict[str, bool] = {}
+        pending = dict(self.steps)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                for name, step in list(pending.items()):
+                    if not all(dep in results for dep in self._waits_for(step)):
+                        continue
+                    failed = [dep for dep in self._requires(step) if not results[dep]]
+                    if failed:
+                        del pending[name]
+                        results[name] = False
+                        console.print(f"[yellow]⚠[/yellow] Skipping {name} (requires {', '.join(failed)})")
+                        console.step_update(name, "skipped")
+                    elif not step.interactive:
+                        del pending[name]
+                        running[pool.submit(step.action)] = name
+
+                if not running:
+                    ready = [
+                        step for step in pending.values()
+                        if all(dep in results for dep in self._waits_for(step))
+                    ]
+                    if not ready:
+                        break
+                    step = ready[0]
+                    del pending[step.name]
+                    results[step.name] = self._finish(step.name, step.action)
+                    continue
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    results[name] = self._finish(name, future.result)
+
+        return results
+
+    def _finish(self, name: str, action: Callable[[], Optional[bool]]) -> bool:
+        """Collect a step's outcome; only an explicit False or an error is a failure"""
+        try:
+            return action() is not False
+        except Exception as e:
+            console.print(f"[red]✗[/red] {name} - Error: {str(e)}")
+            return False
+
+
+class PackagePlan:
+    """Every package the run installs, grouped by package manager
+
+    Steps declare the packages they need; install_packages then issues one
+    transaction per manager and records the outcome of each package so the
+    declaring step can report on its own packages.
+    """
+
+    MANAGERS = ("brew", "brew-cask", "apt", "dnf", "pacman", "winget")
+
     def __init__(self):
+        self._entries: Dict[str, List[Tuple[str, str, str]]] = {manager: [] for manager in self.MANAGERS}
+        self.results: Dict[str, bool] = {}
+
+    def add(self, manager: str, package: str, description: str, step: str):
+        """Declare a package for a manager on behalf of a step"""
+        if manager not in self._entries:
+            raise ValueError(f"Unknown package manager: {manager}")
+        if package not in self.packages(manager):
+            self._entries[manager].append((package, description, step))
+
+    def packages(self, manager: str) -> List[str]:
+        """Package names queued for a manager, in declaration order"""
+        return [package for package, _, _ in self._entries[manager]]
+
+    def description(self, package: str) -> str:
+        """Human readable name of a declared package"""
+        for entries in self._entries.values():
+            for name, description, _ in entries:
+                if name == package:
+                    return description
+        return package
+
+    def record(self, packages: List[str], failed: Set[str]):
+        """Store the outcome of a transaction for each of its packages"""
+        for package in packages:
+            self.results[package] = package not in failed
+
+    def succeeded(self, step: str) -> bool:
+        """Whether every package declared by a step was installed"""
+        return all(
+            self.results.get(package, False)
+            for entries in self._entries.values()
+            for package, _, owner in entries
+            if owner == step
+        )
+
+    def to_json(self) -> Dict[str, List[List[str]]]:
+        """Declared packages as manager -> [package, description, step] lists"""
+        return {manager: [list(entry) for entry in entries] for manager, entries in self._entries.items() if entries}
+
+    def load(self, entries: Dict[str, List[List[str]]]):
+        """Declare the packages of a serialized plan"""
+        for manager, packages in entries.items():
+            for package, description, step in packages:
+                self.add(manager, package, description, step)
+
+    def owners(self) -> Set[str]:
+        """Steps that declared at least one package"""
+        return {step for entries in self._entries.values() for _, _, step in entries}
+
+    def __bool__(self) -> bool:
+        return any(self._entries.values())
+
+
+def parse_brew_failures(output: str, packages: List[str], returncode: int) -> Set[str]:
+    """Find the packages of a batched `brew install` that failed"""
+    failed = set()
+    for line in output.splitlines():
+        if not line.startswith("Error:"):
+            continue
+        for package in packages:
+            name = package.rsplit("/", 1)[-1]
+            if re.search(rf"(?<![\w-]){re.escape(name)}(?![\w-])", line):
+                failed.add(package)
+    if returncode != 0 and not failed:
+        # brew failed without naming a package, so nothing can be trusted
+        return set(packages)
+    return failed
+
+
+def find_rejected_packages(output: str, packages: List[str], returncode: int,
+                           patterns: List["re.Pattern"]) -> Set[str]:
+    """Packages named by a manager's "unknown package" errors
+
+    Such managers abort the whole transaction when any package is unknown, so
+    the caller retries the remaining packages without the ones found here.
+    """
+    failed = set()
+    for line in output.splitlines():
+        for pattern in patterns:
+            match = pattern.search(line)
+            if match:
+                failed |= set(match.group(1).split()) & set(packages)
+    if returncode != 0 and not failed:
+        return set(packages)
+    return failed
+
+
+APT_FAILURE_PATTERNS = [
+    re.compile(r"Unable to locate package (\S+)"),
+    re.compile(r"Package '?([^'\s]+)'? has no installation candidate"),
+    re.compile(r"Couldn't find any package by (?:glob|regex) '([^']+)'"),
+]
+
+DNF_FAILURE_PATTERNS = [
+    re.compile(r"No match for argument: (\S+)"),
+    re.compile(r"Unable to find a match: (.+)"),
+]
+
+PACMAN_FAILURE_PATTERNS = [
+    re.compile(r"target not found: (\S+)"),
+]
+
+
+def parse_apt_failures(output: str, packages: List[str], returncode: int) -> Set[str]:
+    """Find the packages of a batched `apt-get install` that failed"""
+    return find_rejected_packages(output, packages, returncode, APT_FAILURE_PATTERNS)
+
+
+def parse_dnf_failures(output: str, packages: List[str], returncode: int) -> Set[str]:
+    """Find the packages of a batched `dnf install` that failed"""
+    return find_rejected_packages(output, packages, returncode, DNF_FAILURE_PATTERNS)
+
+
+def parse_pacman_failures(output: str, packages: List[str], returncode: int) -> Set[str]:
+    """Find the packages of a batched `pacman -S` that failed"""
+    return find_rejected_packages(output, packages, returncode, PACMAN_FAILURE_PATTERNS)
+
+
+def parse_winget_failures(output: str, packages: List[str], returncode: int) -> Set[str]:
+    """Find the packages of a `winget import` that failed
+
+    winget reports each package as a block that starts by naming the package
+    id, so every status line is attributed to the last id seen.
+    """
+    succeeded, failed = set(), set()
+    current = None
+    for line in output.splitlines():
+        lowered = line.lower()
+        for package in packages:
+            if package.lower() in lowered:
+                current = package
+        if current is None:
+            continue
+        if "successfully installed" in lowered or "already installed" in lowered:
+            succeeded.add(current)
+        elif "not found" in lowered or "failed" in lowered:
+            failed.add(current)
+    if returncode != 0:
+        return set(packages) - succeeded
+    return failed
+
+
+# Distribution id (from ID or ID_LIKE in os-release) -> package manager
+LINUX_PACKAGE_MANAGERS = {
+    "debian": "apt",
+    "ubuntu": "apt",
+    "fedora": "dnf",
+    "rhel": "dnf",
+    "centos": "dnf",
+    "arch": "pacman",
+}
+
+# Where each manager keeps its downloaded package index
+PACKAGE_INDEX_PATHS = {
+    "apt": Path("/var/lib/apt/lists"),
+    # dnf 4 rewrites its solv files here whenever it refreshes repository metadata
+    "dnf": Path("/var/cache/dnf"),
+    "pacman": Path("/var/lib/pacman/sync"),
+}
+
+GH_APT_KEYRING = Path("/usr/share/keyrings/githubcli-archive-keyring.gpg")
+GH_APT_SOURCE = Path("/etc/apt/sources.list.d/github-cli.list")
+GH_DNF_REPO = Path("/etc/yum.repos.d/gh-cli.repo")
+
+
+def read_os_release(paths: Tuple[Path, ...] = (Path("/etc/os-release"), Path("/usr/lib/os-release"))) -> Dict[str, str]:
+    """Fields of the os-release file, empty when there is none"""
+    for path in paths:
+        try:
+            text = path.read_text()
+        except OSError:
+            continue
+        fields = {}
+        for line in text.splitlines():
+            key, sep, value = line.partition("=")
+            if sep and not key.startswith("#"):
+                fields[key.strip()] = value.strip().strip("\"'")
+        return fields
+    return {}
+
+
+def package_index_age(manager: str) -> Optional[float]:
+    """Seconds since a manager's package index was last refreshed, None when unknown"""
+    path = PACKAGE_INDEX_PATHS.get(manager)
+    newest = 0.0
+    try:
+        entries = list(os.scandir(path)) if path else []
+    except OSError:
+        entries = []
+    for entry in entries:
+        try:
+            if entry.name != "lock" and entry.is_file():
+                newest = max(newest, entry.stat().st_mtime)
+        except OSError:
+            continue
+    return time.time() - newest if newest else None
+
+
+class Tracer:
+    """Timings of steps and subprocesses for the summary table and Chrome traces
+
+    Spans nest per thread: a subprocess span opened while a step span is open
+    on the same thread belongs to that step, and counters such as downloaded
+    bytes are added to every open span of the thread.
+    """
+
+    def __init__(self):
+        self.events: List[dict] = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self) -> List[dict]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name: str, category: str, **args):
+        """Time a block; the yielded dict collects extra fields for the event"""
+        event = {"name": name, "cat": category, "args": dict(args)}
+        stack = self._stack()
+        if stack:
+            event["args"].setdefault("parent", stack[-1]["name"])
+        stack.append(event)
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield event["args"]
+        finally:
+            stack.pop()
+            event["ts"] = (start - self._origin) * 1e6
+            event["dur"] = (time.perf_counter() - start) * 1e6
+            event["args"]["cpu_ms"] = event["args"].get("cpu_ms", 0) + (time.thread_time() - cpu_start) * 1000
+            event["tid"] = threading.get_ident()
+            event["thread"] = threading.current_thread().name
+            if stack:
+                # A step's CPU time includes the commands it ran
+                stack[-1]["args"]["cpu_ms"] = stack[-1]["args"].get("cpu_ms", 0) + event["args"].get("child_cpu_ms", 0)
+            with self._lock:
+                self.events.append(event)
+
+    def count(self, key: str, value: int):
+        """Add to a counter on every span open on this thread"""
+        for event in self._stack():
+            event["args"][key] = event["args"].get(key, 0) + value
+
+    def chrome_trace(self) -> dict:
+        """Events in the Chrome trace-event format (chrome://tracing, Perfetto)"""
+        pid = os.getpid()
+        trace, threads = [], {}
+        for event in sorted(self.events, key=lambda event: event["ts"]):
+            threads.setdefault(event["tid"], event["thread"])
+            trace.append({
+                "name": event["name"],
+                "cat": event["cat"],
+                "ph": "X",
+                "ts": round(event["ts"], 1),
+                "dur": round(event["dur"], 1),
+                "pid": pid,
+                "tid": event["tid"],
+                "args": event["args"],
+            })
+        for tid, name in threads.items():
+            trace.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}})
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def write(self, path: Path):
+        """Write the Chrome trace to a file"""
+        path.write_text(json.dumps(self.chrome_trace(), indent=1))
+
+    def summary_rows(self) -> List[Tuple[str, ...]]:
+        """One row per step, slowest first"""
+        steps = [event for event in self.events if event["cat"] == "step"]
+        commands = [event for event in self.events if event["cat"] == "command"]
+        rows = []
+        for event in sorted(steps, key=lambda event: -event["dur"]):
+            own = [command for command in commands if command["args"].get("parent") == event["name"]]
+            failed = sum(1 for command in own if command["args"].get("exit_code"))
+            downloaded = event["args"].get("bytes_downloaded", 0)
+            rows.append((
+                event["name"],
+                f"{event['dur'] / 1e6:.2f}s",
+                f"{event['args'].get('cpu_ms', 0) / 1000:.2f}s",
+                f"{downloaded / 1024:.0f} KiB" if downloaded else "-",
+                f"{len(own)}" + (f" ({failed} failed)" if failed else ""),
+            ))
+        return rows
+
+
+def wait_with_usage(process: subprocess.Popen) -> Tuple[int, Optional[float], Optional[int]]:
+    """Wait for a process and return (exit code, CPU seconds, peak RSS in KiB)
+
+    os.wait4 reports the resources of exactly this child, which stays correct
+    while other threads run their own commands. Windows falls back to wait().
+    """
+    if not hasattr(os, "wait4"):
+        return process.wait(), None, None
+    _, status, usage = os.wait4(process.pid, 0)
+    if os.WIFSIGNALED(status):
+        returncode = -os.WTERMSIG(status)
+    else:
+        returncode = os.WEXITSTATUS(status)
+    process.returncode = returncode
+    max_rss = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    return returncode, usage.ru_utime + usage.ru_stime, max_rss
+
+
+class DownloadError(Exception):
+    """A download failed or is not available offline"""
+
+
+class _ResourceChanged(Exception):
+    """The server ignored a range request because the resource changed"""
+
+
+class DownloadCache:
+    """Content-addressed cache for installer downloads
+
+    Blobs are stored once under `blobs/<sha256>` no matter how many URLs
+    point at them. Each URL gets its own small index file with the blob hash,
+    the ETag / Last-Modified validators and the last time it was used, so
+    several machines can share one cache directory without a global lock.
+
+    Downloads stream into `partial/` and are only moved into the blob store
+    once complete and verified. When the server supports range requests,
+    large files are fetched as several ranges in parallel, a dropped
+    connection resumes where it stopped, and an interrupted download is
+    picked up by the next run.
+    """
+
+    USER_AGENT = "atriumos/1.0"
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, root: Path, max_bytes: int = 512 * 1024 * 1024, max_age: float = 3600,
+                 offline: bool = False, timeout: float = 30, tracer: Optional[Tracer] = None,
+                 connections: int = 4, split_size: int = 8 * 1024 * 1024, attempts: int = 5,
+                 cancelled: Optional[threading.Event] = None):
+        self.root = Path(root)
+        self.tracer = tracer
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.offline = offline
+        self.timeout = timeout
+        self.connections = connections
+        self.split_size = split_size
+        self.attempts = attempts
+        # Set when the run is interrupted; transfers stop at the next block and keep their partial file
+        self.cancelled = cancelled or threading.Event()
+        self.bytes_downloaded = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _index_path(self, url: str) -> Path:
+        return self.root / "index" / f"{self._key(url)}.json"
+
+    def _blob_path(self, sha256: str) -> Path:
+        return self.root / "blobs" / sha256
+
+    def _write_atomic(self, path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def _load_entry(self, url: str, sha256: Optional[str] = None) -> Optional[dict]:
+        """Index entry of a URL, None when its blob is gone or does not have the wanted hash"""
+        try:
+            entry = json.loads(self._index_path(url).read_text())
+        except (OSError, ValueError):
+            return None
+        if not self._blob_path(entry.get("sha256", "")).is_file():
+            return None
+        if sha256 and entry["sha256"] != sha256:
+            return None
+        return entry
+
+    def _save_entry(self, url: str, entry: dict):
+        self._write_atomic(self._index_path(url), json.dumps(entry, sort_keys=True).encode("utf-8"))
+
+    def _touch(self, url: str, entry: dict, validated: bool = False) -> Path:
+        entry["last_used"] = time.time()
+        if validated:
+            entry["validated"] = entry["last_used"]
+        self._save_entry(url, entry)
+        return self._blob_path(entry["sha256"])
+
+    def lookup(self, url: str) -> Optional[Path]:
+        """Path of the cached content for a URL, without touching the network"""
+        entry = self._load_entry(url)
+        return self._blob_path(entry["sha256"]) if entry else None
+
+    def put(self, url: str, data: bytes, etag: Optional[str] = None,
+            last_modified: Optional[str] = None) -> Path:
+        """Store content for a URL and return its blob path"""
+        sha256 = hashlib.sha256(data).hexdigest()
+        blob = self._blob_path(sha256)
+        if not blob.is_file():
+            self._write_atomic(blob, data)
+        return self._add(url, sha256, len(data), etag, last_modified)
+
+    def _add(self, url: str, sha256: str, size: int, etag: Optional[str], last_modified: Optional[str]) -> Path:
+        entry = {
+            "url": url,
+            "sha256": sha256,
+            "size": size,
+            "etag": etag,
+            "last_modified": last_modified,
+        }
+        blob = self._touch(url, entry, validated=True)
+        self.evict()
+        return blob
+
+    def fetch(self, url: str, sha256: Optional[str] = None) -> Path:
+        """Return a local path with the content of a URL
+
+        A known content hash is served straight from the blob store. Cached
+        URLs younger than max_age are served without a request, older ones are
+        revalidated with If-None-Match / If-Modified-Since. In offline mode
+        anything not cached is an error. With a hash, downloaded content that
+        does not match it is rejected.
+        """
+        if sha256 and self._blob_path(sha256).is_file():
+            entry = self._load_entry(url)
+            if not entry or entry["sha256"] != sha256:
+                size = self._blob_path(sha256).stat().st_size
+                entry = {"url": url, "sha256": sha256, "size": size, "etag": None, "last_modified": None}
+            return self._touch(url, entry)
+        
+        # Content cached under an older pinned hash is outdated whatever its age
+        entry = self._load_entry(url, sha256)
+        if entry and (self.offline or time.time() - entry.get("validated", 0) < self.max_age):
+            return self._touch(url, entry)
+        if self.offline:
+            wanted = f" with sha256 {sha256}" if sha256 else ""
+            raise DownloadError(f"{url}{wanted} is not in the download cache (offline mode)")
+        
+        # One process at a time per URL: fleet targets and machines sharing --cache-dir download it once
+        with self._url_lock(url):
+            # Another process may have downloaded it while this one waited
+            entry = self._load_entry(url, sha256)
+            if entry and time.time() - entry.get("validated", 0) < self.max_age:
+                return self._touch(url, entry)
+            
+            # Imported here since urllib pulls in http.client, email and ssl
+            import http.client
+            import urllib.error
+            before = self.bytes_downloaded
+            try:
+                download = self._download(url, entry)
+            except urllib.error.HTTPError as e:
+                raise DownloadError(f"{url}: HTTP {e.code}")
+            except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+                if entry:
+                    # Stale content beats no content when the network is down
+                    return self._touch(url, entry)
+                raise DownloadError(f"{url}: {e}")
+            finally:
+                if self.tracer:
+                    self.tracer.count("bytes_downloaded", self.bytes_downloaded - before)
+            if download is None:
+                return self._touch(url, entry, validated=True)
+            
+            path, meta = download
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(block)
+            if sha256 and digest.hexdigest() != sha256:
+                self._discard(url)
+                raise DownloadError(f"{url}: checksum mismatch")
+            
+            blob = self._blob_path(digest.hexdigest())
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(path, blob)
+            self._discard(url)
+            return self._add(url, digest.hexdigest(), blob.stat().st_size, meta["etag"], meta["last_modified"])
+
+    @contextmanager
+    def _url_lock(self, url: str):
+        """Hold an exclusive lock on a URL's partial download, across processes where supported"""
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+        path = self.root / "partial" / f"{self._key(url)}.lock"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _partial_paths(self, url: str) -> Tuple[Path, Path]:
+        data = self.root / "partial" / self._key(url)
+        return data, data.with_suffix(".json")
+
+    def _discard(self, url: str):
+        for path in self._partial_paths(url):
+            if path.exists():
+                path.unlink()
+
+    def _open(self, url: str, headers: Dict[str, str]):
+        import urllib.request
+        request = urllib.request.Request(url, headers={"User-Agent": self.USER_AGENT, **headers})
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def _download(self, url: str, entry: Optional[dict], split: bool = True) -> Optional[Tuple[Path, dict]]:
+        """Download a URL into its partial file, None when the cached entry is still current
+
+        The first response carries the size and whether ranges are supported.
+        It also supplies the first range, so splitting costs no extra request.
+        When the server does not honour its ranges after all, the download
+        starts over once as a single stream.
+        """
+        data_path, meta_path = self._partial_paths(url)
+        data_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            meta = json.loads(meta_path.read_text())
+        except (OSError, ValueError):
+            meta = None
+        
+        first = None
+        if meta is None or not meta["ranges"] or not data_path.exists():
+            import urllib.error
+            headers = {}
+            if entry and entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry and entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+            try:
+                first = self._open(url, headers)
+            except urllib.error.HTTPError as e:
+                if e.code == 304 and entry:
+                    return None
+                raise
+            length = first.headers.get("Content-Length")
+            size = int(length) if length and length.isdigit() else None
+            ranges = split and size is not None and first.headers.get("Accept-Ranges", "").lower() == "bytes"
+            count = max(1, min(self.connections, size // self.split_size)) if ranges and size else 1
+            bounds = [size * i // count if size else 0 for i in range(count)] + [size]
+            meta = {
+                "etag": first.headers.get("ETag"),
+                "last_modified": first.headers.get("Last-Modified"),
+                "size": size,
+                "ranges": ranges,
+                # [start, end, bytes done] of each range
+                "parts": [[bounds[i], bounds[i + 1], 0] for i in range(count)],
+            }
+            with open(data_path, "wb") as f:
+                if size:
+                    f.truncate(size)
+        
+        try:
+            if len(meta["parts"]) == 1:
+                self._download_part(url, data_path, meta, meta["parts"][0], first)
+            else:
+                with ThreadPoolExecutor(max_workers=len(meta["parts"]) - 1) as pool:
+                    futures = [pool.submit(self._download_part, url, data_path, meta, part)
+                               for part in meta["parts"][1:]]
+                    self._download_part(url, data_path, meta, meta["parts"][0], first)
+                    for future in futures:
+                        future.result()
+        except _ResourceChanged:
+            # The file changed on the server since the partial download started, or it ignores ranges
+            meta = None
+        finally:
+            if first is not None:
+                first.close()
+            if meta is not None:
+                self._write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+        
+        if meta is None:
+            self._discard(url)
+            if not split:
+                raise DownloadError(f"{url}: the file kept changing on the server while downloading")
+            return self._download(url, entry, split=False)
+        return data_path, meta
+
+    def _download_part(self, url: str, data_path: Path, meta: dict, part: List[Optional[int]], response=None):
+        """Fill one range of the partial file, resuming after dropped connections"""
+        import http.client
+        import urllib.error
+        start, end, _ = part
+        validator = meta["etag"] or meta["last_modified"]
+        for attempt in range(self.attempts):
+            if end is not None and part[2] >= end - start:
+                return
+            try:
+                if response is None:
+                    if meta["ranges"]:
+                        headers = {"Range": f"bytes={start + part[2]}-{end - 1}"}
+                        if validator:
+                            headers["If-Range"] = validator
+                        response = self._open(url, headers)
+                        if response.status != 206:
+                            response.close()
+                            raise _ResourceChanged()
+                    else:
+                        # Without range support a broken download starts over, from the same file
+                        part[2] = 0
+                        response = self._open(url, {})
+                        if (response.headers.get("ETag"), response.headers.get("Last-Modified")) \
+                                != (meta["etag"], meta["last_modified"]):
+                            response.close()
+                            raise _ResourceChanged()
+                with open(data_path, "r+b") as f:
+                    f.seek(start + part[2])
+                    while end is None or part[2] < end - start:
+                        if self.cancelled.is_set():
+                            raise CommandCancelled(f"Downloading {url} was stopped, the run was interrupted")
+                        want = self.READ_SIZE if end is None else min(self.READ_SIZE, end - start - part[2])
+                        block = response.read(want)
+                        if not block:
+                            break
+                        f.write(block)
+                        part[2] += len(block)
+                        with self._lock:
+                            self.bytes_downloaded += len(block)
+                if end is None:
+                    return
+                if part[2] < end - start:
+                    raise http.client.IncompleteRead(b"", end - start - part[2])
+            except urllib.error.HTTPError:
+                raise
+            except (urllib.error.URLError, http.client.HTTPException, OSError):
+                if attempt + 1 == self.attempts:
+                    raise
+                if self.cancelled.wait(0.5 * 2 ** attempt):
+                    raise CommandCancelled(f"Downloading {url} was stopped, the run was interrupted")
+            finally:
+                if response is not None:
+                    response.close()
+                response = None
+
+    def evict(self):
+        """Drop the least recently used URLs until the blobs fit in max_bytes"""
+        with self._lock:
+            entries = []
+            for index in (self.root / "index").glob("*.json"):
+                try:
+                    entries.append((index, json.loads(index.read_text())))
+                except (OSError, ValueError):
+                    continue
+            
+            sizes = {entry["sha256"]: entry.get("size", 0) for _, entry in entries}
+            total = sum(sizes.values())
+            if total <= self.max_bytes:
+                return
+            
+            entries.sort(key=lambda item: item[1].get("last_used", 0))
+            users: Dict[str, int] = {}
+            for _, entry in entries:
+                users[entry["sha256"]] = users.get(entry["sha256"], 0) + 1
+            
+            for index, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                # Another process sharing the cache may be evicting the same files
+                try:
+                    index.unlink()
+                except FileNotFoundError:
+                    pass
+                users[entry["sha256"]] -= 1
+                if users[entry["sha256"]] == 0:
+                    # Last URL using this blob is gone, so its bytes are freed
+                    try:
+                        self._blob_path(entry["sha256"]).unlink()
+                    except FileNotFoundError:
+                        pass
+                    total -= sizes[entry["sha256"]]
+
+
+class ToolInventory:
+    """Tools this run cares about, resolved with one in-process PATH scan
+
+    Versions are collected concurrently and cached in a JSON file per binary
+    path and mtime, so a rescan only runs the tools that changed on disk.
+    """
+
+    # Tool name -> arguments that make it print its version
+    TOOLS = {
+        "brew": ["--version"],
+        "gh": ["--version"],
+        "oh-my-posh": ["--version"],
+        "git": ["--version"],
+        "apt": ["--version"],
+        "dnf": ["--version"],
+        "pacman": ["--version"],
+        "winget": ["--version"],
+        "python3": ["--version"],
+        "go": ["version"],
+        "node": ["--version"],
+        "ruby": ["--version"],
+        "java": ["-version"],
+        "julia": ["--version"],
+    }
+
+    VERSION_PATTERN = re.compile(r"\d+(?:\.\d+)+")
+
+    def __init__(self, cache_path: Optional[Path] = None, search_path: Optional[str] = None):
+        self.cache_path = cache_path
+        self.search_path = search_path
+        self.tools: Dict[str, dict] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def scan(self) -> Dict[str, Tuple[str, int]]:
+        """Find every known tool on PATH as name -> (path, mtime_ns)"""
+        search_path = self.search_path if self.search_path is not None else os.environ.get("PATH", "")
+        suffixes = [""]
+        if platform.system() == "Windows":
+            suffixes += [ext.lower() for ext in os.environ.get("PATHEXT", ".EXE;.CMD;.BAT").split(";") if ext]
+        wanted = {name + suffix: name for name in self.TOOLS for suffix in suffixes}
+        
+        found: Dict[str, Tuple[str, int]] = {}
+        for directory in search_path.split(os.pathsep):
+            if not directory:
+                continue
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                name = wanted.get(entry.name.lower() if suffixes[1:] else entry.name)
+                if name is None or name in found:
+                    continue
+                try:
+                    if entry.is_file() and os.access(entry.path, os.X_OK):
+                        found[name] = (entry.path, entry.stat().st_mtime_ns)
+                except OSError:
+                    continue
+        return found
+
+    def _probe_version(self, name: str, path: str) -> Optional[str]:
+        try:
+            result = subprocess.run([path] + self.TOOLS[name], capture_output=True, text=True, timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        match = self.VERSION_PATTERN.search(result.stdout + result.stderr)
+        return match.group(0) if match else None
+
+    def _read_cache(self) -> Dict[str, dict]:
+        if self.cache_path is None:
+            return {}
+        try:
+            return json.loads(self.cache_path.read_text()).get("tools", {})
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self):
+        if self.cache_path is None:
+            return
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            self.cache_path.write_text(json.dumps({"tools": self.tools}, indent=2, sort_keys=True))
+        except OSError:
+            pass
+
+    def refresh(self):
+        """Rescan PATH and probe the versions of new or changed binaries"""
+        with self._lock:
+            found = self.scan()
+            cached = self._read_cache()
+            tools, stale = {}, []
+            for name, (path, mtime) in found.items():
+                entry = cached.get(name)
+                if entry and entry.get("path") == path and entry.get("mtime") == mtime:
+                    tools[name] = entry
+                else:
+                    tools[name] = {"path": path, "mtime": mtime, "version": None}
+                    stale.append(name)
+            
+            if stale:
+                with ThreadPoolExecutor(max_workers=len(stale)) as pool:
+                    versions = pool.map(lambda name: self._probe_version(name, tools[name]["path"]), stale)
+                    for name, version in zip(stale, versions):
+                        tools[name]["version"] = version
+            
+            self.tools = tools
+            self._loaded = True
+            if stale or set(cached) != set(tools):
+                self._write_cache()
+
+    def load(self, tools: Dict[str, dict]):
+        """Use tools detected earlier, e.g. by `atriumos plan`, instead of scanning"""
+        with self._lock:
+            self.tools = dict(tools)
+            self._loaded = True
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.refresh()
+
+    def has(self, name: str) -> bool:
+        """Whether a tool is on PATH"""
+        self._ensure_loaded()
+        return name in self.tools
+
+    def version(self, name: str) -> Optional[str]:
+        """Version of a tool, None when it is missing or did not report one"""
+        self._ensure_loaded()
+        return self.tools.get(name, {}).get("version")
+
+    def path(self, name: str) -> Optional[str]:
+        """Absolute path of a tool, None when it is missing"""
+        self._ensure_loaded()
+        return self.tools.get(name, {}).get("path")
+
+
+def parse_git_status(output: str) -> dict:
+    """Branch, upstream and change counts from `git status --porcelain=v2 --branch`"""
+    status = {"head": None, "branch": None, "upstream": None, "ahead": 0, "behind": 0,
+              "changed": 0, "untracked": 0, "conflicts": 0}
+    for line in output.splitlines():
+        if line.startswith("# branch.oid "):
+            oid = line.split()[2]
+            status["head"] = None if oid == "(initial)" else oid
+        elif line.startswith("# branch.head "):
+            head = line.split()[2]
+            status["branch"] = None if head == "(detached)" else head
+        elif line.startswith("# branch.upstream "):
+            status["upstream"] = line.split()[2]
+        elif line.startswith("# branch.ab "):
+            _, _, ahead, behind = line.split()
+            status["ahead"], status["behind"] = int(ahead), -int(behind)
+        elif line.startswith(("1 ", "2 ")):
+            status["changed"] += 1
+        elif line.startswith("u "):
+            status["conflicts"] += 1
+        elif line.startswith("? "):
+            status["untracked"] += 1
+    return status
+
+
+class RepoIndex:
+    """Status of every checkout in a directory, kept between runs
+
+    Each repository gets a stat fingerprint: the newest mtime among the git
+    files that change with commits, fetches and staging and among the worktree
+    directories, plus the mtimes and sizes of the worktree files. Only
+    repositories whose fingerprint moved are asked for `git status`, in
+    parallel. Directories that are normally ignored (node_modules,
+    virtualenvs, build output) are not walked; `refresh` rescans everything.
+    """
+
+    GIT_FILES = ("HEAD", "index", "packed-refs", "FETCH_HEAD", "ORIG_HEAD", "MERGE_HEAD")
+    SKIP_DIRS = {".git", "node_modules", ".venv", "venv", "__pycache__", "target", "build", "dist", ".tox"}
+
+    def __init__(self, path: Path, root: Path, jobs: int = 8):
+        self.path = path
+        self.root = root
+        self.jobs = jobs
+        try:
+            self.repos: Dict[str, dict] = json.loads(path.read_text()).get("repos", {})
+        except (OSError, ValueError):
+            self.repos = {}
+
+    def checkouts(self) -> Dict[str, Path]:
+        """Repositories directly inside the root, by directory name"""
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return {}
+        return {
+            entry.name: Path(entry.path) for entry in entries
+            if entry.is_dir() and not entry.name.startswith(".") and os.path.exists(os.path.join(entry.path, ".git"))
+        }
+
+    @classmethod
+    def fingerprint(cls, repo: Path) -> str:
+        """Stat summary of a checkout's git metadata, worktree directories and files"""
+        git_dir = repo / ".git"
+        newest = 0
+        # Editing a file in place only touches the file itself
+        files = mtimes = sizes = 0
+        for name in cls.GIT_FILES:
+            newest = max(newest, file_mtime(git_dir / name) or 0)
+        
+        # Ref updates replace files, which touches the directories under refs/
+        stack = [str(git_dir / "refs"), str(repo)]
+        while stack:
+            directory = stack.pop()
+            try:
+                newest = max(newest, os.stat(directory).st_mtime_ns)
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in cls.SKIP_DIRS:
+                            stack.append(entry.path)
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                files += 1
+                mtimes += stat.st_mtime_ns
+                sizes += stat.st_size
+        return f"{newest}:{files}:{mtimes}:{sizes}"
+
+    @staticmethod
+    def query(repo: Path) -> dict:
+        """Ask git for a checkout's status"""
+        # --no-optional-locks keeps git from rewriting the index, which would move the fingerprint
+        try:
+            result = subprocess.run(["git", "--no-optional-locks", "-C", str(repo), "status",
+                                     "--porcelain=v2", "--branch"], capture_output=True, text=True,
+                                    timeout=PROBE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            return {"error": f"git status took longer than {PROBE_TIMEOUT}s"}
+        if result.returncode != 0:
+            return {"error": result.stderr.strip() or f"git status exited with {result.returncode}"}
+        return parse_git_status(result.stdout)
+
+    def scan(self, refresh: bool = False) -> Dict[str, dict]:
+        """Status of every checkout, querying git only where something changed"""
+        checkouts = self.checkouts()
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as pool:
+            names = list(checkouts)
+            fingerprints = dict(zip(names, pool.map(lambda name: self.fingerprint(checkouts[name]), names)))
+            stale = [
+                name for name in names
+                if refresh or self.repos.get(name, {}).get("fingerprint") != fingerprints[name]
+            ]
+            statuses = dict(zip(stale, pool.map(lambda name: self.query(checkouts[name]), stale)))
+        
+        repos = {}
+        for name in names:
+            if name in statuses:
+                repos[name] = {**statuses[name], "fingerprint": fingerprints[name], "scanned": time.time()}
+            else:
+                repos[name] = self.repos[name]
+        
+        if stale or set(repos) != set(self.repos):
+            self.repos = repos
+            self._save()
+        self.repos = repos
+        return repos
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps({"root": str(self.root), "repos": self.repos}, indent=2, sort_keys=True))
+        os.replace(tmp, self.path)
+
+
+class StateJournal:
+    """Fingerprints of completed steps, kept between runs
+
+    A fingerprint is a hash of everything a step's outcome depends on (its
+    inputs, tool versions, target file mtimes). When the fingerprint taken
+    before a run matches the one recorded after the last successful run, the
+    step has nothing to do. Answers to a step's prompts are kept with it so
+    a skipped or repeated step does not ask again.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            state = json.loads(path.read_text())
+        except (OSError, ValueError):
+            state = {}
+        self.steps: Dict[str, dict] = state.get("steps", {})
+        # Files and directories atriumOS installed into the home directory, for bake
+        self.files: Dict[str, str] = state.get("files", {})
+
+    @staticmethod
+    def fingerprint(inputs: dict) -> str:
+        """Stable hash of a step's inputs"""
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def matches(self, step: str, inputs: dict) -> bool:
+        """Whether a step completed before with exactly these inputs"""
+        entry = self.steps.get(step)
+        return entry is not None and entry.get("fingerprint") == self.fingerprint(inputs)
+
+    def answers(self, step: str) -> Dict[str, object]:
+        """Prompt answers recorded with a step"""
+        return dict(self.steps.get(step, {}).get("answers", {}))
+
+    def record(self, step: str, inputs: dict, answers: Optional[Dict[str, object]] = None):
+        """Remember that a step completed with these inputs"""
+        with self._lock:
+            self.steps[step] = {
+                "fingerprint": self.fingerprint(inputs),
+                "inputs": inputs,
+                "answers": answers or {},
+                "completed": time.time(),
+            }
+            self._save()
+
+    def forget(self, step: str):
+        """Drop a step so the next run does it again"""
+        with self._lock:
+            if self.steps.pop(step, None) is not None:
+                self._save()
+
+    def add_file(self, path: Path, owner: str):
+        """Remember a file or directory a step installed into the home directory"""
+        with self._lock:
+            self.files[str(path)] = owner
+            self._save()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps({"steps": self.steps, "files": self.files}, indent=2, sort_keys=True))
+        os.replace(tmp, self.path)
+
+
+class Snapshot:
+    """Compressed, content-deduplicated archive of what atriumOS put into a home directory
+
+    The archive holds `manifest.json` followed by `blobs/<sha256>`, one per
+    distinct file content. Text files that mention the home directory are
+    stored with a placeholder, so a snapshot can be restored into another
+    home. Restoring hashes what is already there and only writes the files
+    that differ.
+    """
+
+    VERSION = 1
+    HOME_PLACEHOLDER = "@ATRIUMOS_HOME@"
+    # Text files bigger than this are never rewritten for the home directory
+    TEMPLATE_LIMIT = 1024 * 1024
+
+    def __init__(self, home: Path):
+        self.home = Path(home)
+
+    @staticmethod
+    def _tar_mode(path: Path, write: bool) -> str:
+        if not write:
+            return "r|*"
+        suffix = path.name.rsplit(".", 1)[-1]
+        return {"xz": "w|xz", "bz2": "w|bz2", "tar": "w|"}.get(suffix, "w|gz")
+
+    def _relative(self, path: Path) -> str:
+        return path.relative_to(self.home).as_posix()
+
+    def _template(self, path: Path) -> Optional[bytes]:
+        """File content with the home directory replaced, None when it is not such a text file"""
+        if path.stat().st_size > self.TEMPLATE_LIMIT:
+            return None
+        data = path.read_bytes()
+        home = str(self.home).encode("utf-8")
+        if b"\0" in data or home not in data:
+            return None
+        return data.replace(home, self.HOME_PLACEHOLDER.encode("utf-8"))
+
+    @staticmethod
+    def _hash_file(path: Path) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _walk(self, path: Path):
+        """The path and, for directories, everything below it"""
+        yield path
+        if path.is_dir() and not path.is_symlink():
+            for child in sorted(path.iterdir()):
+                yield from self._walk(child)
+
+    def bake(self, output: Path, paths: List[Path], directories: List[Path],
+             rc_blocks: Dict[str, Dict[str, str]]) -> dict:
+        """Write files and directory trees, empty directories and rc-file blocks into an archive"""
+        import io
+        import tarfile
+        
+        entries = [{"path": self._relative(path), "type": "dir"} for path in directories if path.is_dir()]
+        blobs = {}  # type: Dict[str, Union[Path, bytes]]
+        for root in paths:
+            if not root.exists() and not root.is_symlink():
+                continue
+            for path in self._walk(root):
+                relative = self._relative(path)
+                if path.is_symlink():
+                    target = os.readlink(path)
+                    entries.append({"path": relative, "type": "symlink",
+                                    "target": target.replace(str(self.home), self.HOME_PLACEHOLDER)})
+                elif path.is_dir():
+                    entries.append({"path": relative, "type": "dir"})
+                elif path.is_file():
+                    template = self._template(path)
+                    sha256 = hashlib.sha256(template).hexdigest() if template is not None else self._hash_file(path)
+                    blobs.setdefault(sha256, template if template is not None else path)
+                    stat = path.stat()
+                    entries.append({"path": relative, "type": "file", "sha256": sha256, "template": template is not None,
+                                    "mode": stat.st_mode & 0o7777, "mtime_ns": stat.st_mtime_ns})
+        
+        rc_blocks = {name: {block: body.replace(str(self.home), self.HOME_PLACEHOLDER) for block, body in blocks.items()}
+                     for name, blocks in rc_blocks.items()}
+        manifest = {
+            "version": self.VERSION,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "entries": entries,
+            "rc_blocks": rc_blocks,
+        }
+        
+        output.parent.mkdir(parents=True, exist_ok=True)
+        tmp = output.with_name(output.name + ".tmp")
+        with tarfile.open(str(tmp), self._tar_mode(output, write=True)) as archive:
+            data = json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8")
+            info = tarfile.TarInfo("manifest.json")
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+            for sha256, content in blobs.items():
+                info = tarfile.TarInfo(f"blobs/{sha256}")
+                if isinstance(content, bytes):
+                    info.size = len(content)
+                    archive.addfile(info, io.BytesIO(content))
+                else:
+                    info.size = content.stat().st_size
+                    with open(content, "rb") as f:
+                        archive.addfile(info, f)
+        os.replace(tmp, output)
+        return {"entries": len(entries), "blobs": len(blobs), "bytes": output.stat().st_size}
+
+    def _current_hash(self, path: Path, template: bool) -> Optional[str]:
+        """Hash of a restored file as it would be stored, None when it is missing"""
+        if not path.is_file() or path.is_symlink():
+            return None
+        if template:
+            data = path.read_bytes().replace(str(self.home).encode("utf-8"), self.HOME_PLACEHOLDER.encode("utf-8"))
+            return hashlib.sha256(data).hexdigest()
+        return self._hash_file(path)
+
+    def _inside_home(self, path: Path) -> bool:
+        home = self.home.resolve()
+        return path == home or home in path.parents
+
+    def _destination(self, name: str, links: str = "refuse") -> Path:
+        """Where a manifest path lands in the home directory, refusing anything outside it
+
+        A destination that already is a symlink must lead into home too
+        ("refuse"), is resolved for files written through their link such as
+        rc files ("follow"), or is left alone when the entry replaces the link
+        itself ("replace").
+        """
+        path = self.home / name
+        # The parent is resolved so a symlink restored earlier cannot lead out of home either
+        parent = path.parent.resolve()
+        if path.name in ("", ".", "..") or not self._inside_home(parent):
+            raise ValueError(f"unsafe snapshot path {name}")
+        path = parent / path.name
+        if links != "replace" and path.is_symlink():
+            target = path.resolve()
+            if not self._inside_home(target):
+                raise ValueError(f"unsafe snapshot path {name}: it links to {target}")
+            if links == "follow":
+                return target
+        return path
+
+    @staticmethod
+    def _write_file(path: Path, data: bytes, mode: int):
+        """Replace a file atomically through a fresh temporary file that no existing link can redirect"""
+        fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.chmod(tmp, mode)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def restore(self, archive_path: Path) -> dict:
+        """Replay an archive into the home directory, writing only files whose hash differs"""
+        import tarfile
+        
+        stats = {"written": 0, "unchanged": 0, "directories": 0, "links": 0, "rc_blocks": 0}
+        with tarfile.open(str(archive_path), self._tar_mode(archive_path, write=False)) as archive:
+            member = archive.next()
+            if member is None or member.name != "manifest.json":
+                raise ValueError(f"{archive_path} is not an atriumOS snapshot")
+            manifest = json.loads(archive.extractfile(member).read().decode("utf-8"))
+            if manifest.get("version") != self.VERSION:
+                raise ValueError(f"Unsupported snapshot version {manifest.get('version')}")
+            
+            # Check every destination before writing anything, and again when writing it,
+            # as a symlink restored in between can change where a path leads
+            for entry in manifest["entries"]:
+                self._destination(entry["path"], "replace" if entry["type"] == "symlink" else "refuse")
+            for name in manifest["rc_blocks"]:
+                self._destination(name, "follow")
+            
+            wanted = {}  # type: Dict[str, List[dict]]
+            for entry in manifest["entries"]:
+                path = self._destination(entry["path"], "replace" if entry["type"] == "symlink" else "refuse")
+                if entry["type"] == "dir":
+                    path.mkdir(parents=True, exist_ok=True)
+                    stats["directories"] += 1
+                elif entry["type"] == "symlink":
+                    target = entry["target"].replace(self.HOME_PLACEHOLDER, str(self.home))
+                    if not (path.is_symlink() and os.readlink(path) == target):
+                        path.parent.mkdir(parents=True, exist_ok=True)
+                        if path.is_symlink() or path.exists():
+                            path.unlink()
+                        os.symlink(target, path)
+                        stats["links"] += 1
+                elif self._current_hash(path, entry["template"]) == entry["sha256"]:
+                    stats["unchanged"] += 1
+                else:
+                    wanted.setdefault(entry["sha256"], []).append(entry)
+            
+            # Blobs come in archive order, so a compressed stream is read once
+            for member in archive:
+                sha256 = member.name.rsplit("/", 1)[-1]
+                if sha256 not in wanted:
+                    continue
+                data = archive.extractfile(member).read()
+                if hashlib.sha256(data).hexdigest() != sha256:
+                    raise ValueError(f"{archive_path}: blob {sha256} is corrupt")
+                for entry in wanted.pop(sha256):
+                    path = self._destination(entry["path"])
+                    content = data
+                    if entry["template"]:
+                        content = data.replace(self.HOME_PLACEHOLDER.encode("utf-8"), str(self.home).encode("utf-8"))
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    self._write_file(path, content, entry["mode"])
+                    os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+                    stats["written"] += 1
+            if wanted:
+                raise ValueError(f"{archive_path} is missing {len(wanted)} blob(s)")
+        
+        for name, blocks in manifest["rc_blocks"].items():
+            # rc files are often links into a dotfiles checkout, so they are written through the link
+            rc_file = self._destination(name, "follow")
+            content = rc_file.read_text() if rc_file.exists() else ""
+            updated = content
+            for block, body in blocks.items():
+                updated = upsert_managed_block(updated, block, body.replace(self.HOME_PLACEHOLDER, str(self.home)))
+            if updated != content:
+                mode = rc_file.stat().st_mode & 0o7777 if rc_file.exists() else 0o644
+                self._write_file(rc_file, updated.encode("utf-8"), mode)
+                stats["rc_blocks"] += len(blocks)
+        return stats
+
+
+def managed_block(name: str, body: str) -> str:
+    """Wrap rc-file lines in markers so atriumOS can find and update them later"""
+    return f"# >>> atriumOS {name} >>>\n{body.rstrip()}\n# <<< atriumOS {name} <<<\n"
+
+
+def find_managed_block(text: str, name: str) -> Optional["re.Match"]:
+    """Locate a managed block in rc-file text"""
+    pattern = rf"# >>> atriumOS {re.escape(name)} >>>\n.*?# <<< atriumOS {re.escape(name)} <<<\n?"
+    return re.search(pattern, text, re.DOTALL)
+
+
+def managed_blocks(text: str) -> Dict[str, str]:
+    """Bodies of all managed blocks in rc-file text, by name"""
+    return {
+        match.group(1): match.group(2)
+        for match in re.finditer(r"^# >>> atriumOS (.+) >>>\n(.*?)^# <<< atriumOS \1 <<<$", text, re.DOTALL | re.MULTILINE)
+    }
+
+
+def upsert_managed_block(text: str, name: str, body: str) -> str:
+    """Replace a managed block in rc-file text, or append it"""
+    block = managed_block(name, body)
+    match = find_managed_block(text, name)
+    if match:
+        return text[:match.start()] + block + text[match.end():]
+    if text and not text.endswith("\n"):
+        text += "\n"
+    return text + ("\n" if text else "") + block
+
+
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+GO_DURATION = {"ns": 1e-6, "us": 1e-3, "µs": 1e-3, "ms": 1.0, "s": 1000.0, "m": 60000.0}
+
+
+def parse_omp_debug(output: str) -> Tuple[Dict[str, float], Optional[float]]:
+    """Per-segment milliseconds and the total run duration from `oh-my-posh debug`"""
+    segments = {}  # type: Dict[str, float]
+    total = None
+    for line in ANSI_ESCAPE.sub("", output).splitlines():
+        match = re.match(r"\s*\|?\s*([\w.-]+)\s*\((?:true|false)\)\s*[-|]\s*(\d+(?:\.\d+)?)\s*ms", line)
+        if match:
+            name = match.group(1).lower()
+            segments[name] = segments.get(name, 0.0) + float(match.group(2))
+            continue
+        match = re.match(r"\s*Run duration:\s*(.+)", line)
+        if match:
+            # Go duration strings such as 41.2ms, 1.05s or 1m2.5s
+            parts = re.findall(r"(\d+(?:\.\d+)?)(ns|us|µs|ms|s|m)", match.group(1))
+            if parts:
+                total = sum(float(value) * GO_DURATION[unit] for value, unit in parts)
+    return segments, total
+
+
+@contextmanager
+def host_lock(name: str, waiting: str):
+    """Hold a lock shared by every atriumos process of this user on this machine
+
+    Fleet targets on one host run at the same time, but they share its
+    package manager, which only takes one transaction at a time.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    path = Path(tempfile.gettempdir()) / f"atriumos-{os.getuid()}-{name}.lock"
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            console.print(f"[cyan]ℹ[/cyan] {waiting}")
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def file_mtime(path: Path) -> Optional[int]:
+    """Modification time of a file in nanoseconds, None when it is missing"""
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+@dataclass
+class CommandResult:
+    """Outcome of a streamed command, with a bounded view of its output"""
+    returncode: int
+    tail: List[str]
+    matches: List[str]
+    log_path: Optional[Path] = None
+    attempts: int = 1
+    timed_out: bool = False
+
+    @property
+    def output(self) -> str:
+        """Kept lines followed by the tail, for parsers and error reports"""
+        return "\n".join(self.matches + self.tail)
+
+
+class CommandCancelled(Exception):
+    """Raised for commands that would start after the run was interrupted"""
+
+
+# Output of package managers and installers that usually means "try again later"
+TRANSIENT_FAILURES = re.compile(
+    r"Could not get lock|Unable to acquire|another process|unable to lock database|database is locked|"
+    r"Temporary failure|Could not resolve|Connection (timed out|reset|refused)|Failed to fetch|"
+    r"Failed to download|Curl error|timed out|Hash Sum mismatch|\b50[234]\b",
+    re.IGNORECASE,
+)
+
+# Seconds a quick query such as `git status` or `dpkg --print-architecture` may take
+PROBE_TIMEOUT = 60
+
+
+@dataclass
+class RetryPolicy:
+    """How long a class of commands may run and how failed attempts are retried"""
+    attempts: int = 1
+    # Seconds per attempt, None for no limit
+    timeout: Optional[float] = None
+    backoff: float = 2.0
+    max_backoff: float = 60.0
+    # Share of each pause that is randomized, so parallel retries do not line up
+    jitter: float = 0.5
+    # Only failures whose output matches are retried; None retries every failure
+    transient: Optional["re.Pattern"] = None
+
+    def delay(self, attempt: int) -> float:
+        """Pause after a failed attempt: exponential backoff with jitter"""
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+    def should_retry(self, result: CommandResult) -> bool:
+        """Whether a failed attempt is worth repeating"""
+        return result.timed_out or self.transient is None or bool(self.transient.search(result.output))
+
+
+# Retry policy of each command class; --timeout and --attempts override them
+RETRY_POLICIES = {
+    "default": RetryPolicy(attempts=1, timeout=600),
+    # Package transactions: a held lock or a flaky mirror is worth waiting out, a missing package is not
+    "package": RetryPolicy(attempts=3, timeout=1800, backoff=5, transient=TRANSIENT_FAILURES),
+    # Installer scripts such as Homebrew's are long and not always safe to rerun halfway
+    "installer": RetryPolicy(attempts=2, timeout=1800, backoff=10, transient=TRANSIENT_FAILURES),
+    # git fetches and clones, where network trouble is the usual failure
+    "network": RetryPolicy(attempts=3, timeout=900, backoff=2),
+    # A whole atriumos run on a fleet target; its own commands have their limits, this catches a hung target
+    "target": RetryPolicy(attempts=1, timeout=7200),
+}
+
+
+# Popen's process_group argument is new in Python 3.11
+POPEN_PROCESS_GROUP = sys.version_info >= (3, 11)
+# Moves itself into a new process group, then becomes the command
+PROCESS_GROUP_LAUNCHER = "import os, sys; os.setpgid(0, 0); os.execvp(sys.argv[1], sys.argv[1:])"
+
+
+def in_process_group(args: Union[str, List[str]], shell: bool,
+                     env: Optional[Dict[str, str]] = None) -> Tuple[Union[str, List[str]], bool, dict]:
+    """Popen arguments, shell flag and options that start a command in its own process group
+
+    The group lets a timeout or Ctrl-C stop the command together with
+    everything it started. On POSIX it stays in our session, so sudo still
+    finds the credentials cached for this terminal; that rules out
+    start_new_session. Before Python 3.11 the only other way is preexec_fn,
+    which is unsafe with threads running, so the command is started through
+    a small Python launcher that calls setpgid and execs it instead.
+    """
+    if os.name == "nt":
+        return args, shell, {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    if POPEN_PROCESS_GROUP:
+        return args, shell, {"process_group": 0}
+    if shell:
+        args = ["/bin/sh", "-c", args]
+    elif os.sep not in args[0] and shutil.which(args[0], path=(env or os.environ).get("PATH")) is None:
+        # The launcher would only fail after starting, so report a missing command the way Popen does
+        raise FileNotFoundError(2, f"No such file or directory: {args[0]!r}", args[0])
+    return [sys.executable, "-I", "-c", PROCESS_GROUP_LAUNCHER] + list(args), False, {}
+
+
+def kill_process_group(process: subprocess.Popen, grace: float = 5.0):
+    """Terminate a command and its children, killing them if they outlive the grace period"""
+    # returncode rather than poll(), which could reap the child under the waiting thread
+    if process.returncode is not None:
+        return
+    if os.name == "nt":
+        subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], capture_output=True)
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        # The launcher has not made its group yet, so it has no children either
+        try:
+            process.terminate()
+        except OSError:
+            pass
+        return
+    except OSError:
+        return
+
+    def force():
+        # Only while the group is alive, so an id the system reused after it ended is never hit
+        deadline = time.monotonic() + grace
+        while time.monotonic() < deadline:
+            try:
+                os.killpg(process.pid, 0)
+            except OSError:
+                return
+            time.sleep(0.1)
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+    # Not waiting here: the thread running the command reaps it
+    threading.Thread(target=force, daemon=True).start()
+
+
+def parse_overrides(values: List[str], cast: Callable[[str], object]) -> Dict[str, object]:
+    """Turn ['600', 'package=1800'] into {'*': 600, 'package': 1800}"""
+    overrides = {}
+    for value in values or []:
+        name, _, number = value.rpartition("=")
+        try:
+            overrides[name or "*"] = cast(number)
+        except ValueError:
+            raise ValueError(f"Invalid value: {value}")
+    return overrides
+
+
+def iter_output_lines(stream, max_line: int = 8192):
+    """Yield decoded lines from a binary pipe as they arrive
+
+    Carriage returns end a line too, so progress bars show up live, and
+    overlong lines are cut so a single line can never grow without bound.
+    """
+    pending = b""
+    while True:
+        chunk = stream.read1(65536) if hasattr(stream, "read1") else stream.read(65536)
+        if not chunk:
+            break
+        pending += chunk
+        parts = re.split(rb"\r\n|\r|\n", pending)
+        pending = parts.pop()
+        while len(pending) > max_line:
+            parts.append(pending[:max_line])
+            pending = pending[max_line:]
+        for part in parts:
+            yield part.decode("utf-8", errors="replace")
+    if pending:
+        yield pending.decode("utf-8", errors="replace")
+
+
+@dataclass
+class RepoSpec:
+    """A repository to clone into ~/Repos"""
+    url: str
+    name: str
+    # Related repositories (forks, mirrors) share objects through one store
+    family: str
+
+
+def repo_path_parts(url: str) -> Tuple[str, str]:
+    """Owner and name from a git URL or path, e.g. ('ehlvg', 'atrium')"""
+    path = re.sub(r"^[\w+.-]+://[^/]*/|^[^/@]+@[^:]+:", "", url.rstrip("/"))
+    parts = [part for part in re.split(r"[/:]", path) if part]
+    name = re.sub(r"\.git$", "", parts[-1]) if parts else url
+    owner = parts[-2] if len(parts) > 1 else ""
+    return owner, name
+
+
+def load_repo_manifest(path: Path) -> List[RepoSpec]:
+    """Read a repo manifest
+
+    Either JSON, a list of URLs or of {"url", "name", "family"} objects, or
+    plain text with one URL per line and # comments.
+    """
+    text = path.read_text()
+    try:
+        entries = json.loads(text)
+    except ValueError:
+        entries = [line.split("#", 1)[0].strip() for line in text.splitlines()]
+        entries = [entry for entry in entries if entry]
+    
+    specs = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"url": entry}
+        _, name = repo_path_parts(entry["url"])
+        specs.append(RepoSpec(entry["url"], entry.get("name", name), entry.get("family", name)))
+    return unique_repo_names(specs)
+
+
+def unique_repo_names(specs: List[RepoSpec]) -> List[RepoSpec]:
+    """Prefix clashing checkout names (a fork and its upstream) with the owner"""
+    counts = {}  # type: Dict[str, int]
+    for spec in specs:
+        counts[spec.name] = counts.get(spec.name, 0) + 1
+    for spec in specs:
+        owner, _ = repo_path_parts(spec.url)
+        if counts[spec.name] > 1 and owner:
+            spec.name = f"{owner}-{spec.name}"
+    return specs
+
+
+@dataclass
+class Toolchain:
+    """A language runtime of the prompt theme that atriumOS can install
+
+    Runtimes with relocatable release archives are unpacked into
+    ~/.local/share/atriumos/toolchains/<name>/<version>. Templates are
+    filled from the version and from the entry of `platforms` for this OS
+    and machine. Runtimes without such archives come from the system
+    package manager instead and cannot be pinned.
+    """
+    name: str
+    version: str = ""
+    url: str = ""
+    # Checksum file: a bare sha256 or "<sha256>  <file name>" lines; may refer to {url}
+    checksums: str = ""
+    binaries: Tuple[str, ...] = ()
+    platforms: Optional[Dict[str, Dict[str, str]]] = None
+    bin_dir: str = "bin"
+    packages: Optional[Dict[str, str]] = None
+
+    def release(self, system: str, machine: str, version: str) -> Optional[Dict[str, str]]:
+        """URL, checksum URL and binary directory of a version, None when there is no build"""
+        fields = (self.platforms or {}).get(f"{system}-{TOOLCHAIN_MACHINES.get(machine.lower(), machine)}")
+        if not self.url or fields is None:
+            return None
+        base, _, build = version.partition("+")
+        fields = {
+            "bin_dir": self.bin_dir,
+            **fields,
+            "version": version,
+            "quoted": version.replace("+", "%2B"),
+            "underscored": version.replace("+", "_"),
+            "build": build,
+            "major": base.split(".")[0],
+            "minor": ".".join(base.split(".")[:2]),
+        }
+        url = self.url.format(**fields)
+        return {"url": url, "checksums": self.checksums.format(url=url, **fields), "bin_dir": fields["bin_dir"]}
+
+
+TOOLCHAIN_MACHINES = {"x86_64": "x86_64", "amd64": "x86_64", "aarch64": "aarch64", "arm64": "aarch64"}
+
+# Marker written next to an unpacked toolchain, so re-runs never have to run it to learn its version
+TOOLCHAIN_MARKER = ".atriumos-toolchain.json"
+
+TOOLCHAINS = {
+    "python": Toolchain(
+        "python", "3.12.4+20240713",
+        url="https://github.com/astral-sh/python-build-standalone/releases/download/{build}/"
+            "cpython-{quoted}-{triple}-install_only.tar.gz",
+        checksums="https://github.com/astral-sh/python-build-standalone/releases/download/{build}/SHA256SUMS",
+        binaries=("python3", "pip3"),
+        platforms={
+            "Linux-x86_64": {"triple": "x86_64-unknown-linux-gnu"},
+            "Linux-aarch64": {"triple": "aarch64-unknown-linux-gnu"},
+            "Darwin-x86_64": {"triple": "x86_64-apple-darwin"},
+            "Darwin-aarch64": {"triple": "aarch64-apple-darwin"},
+        },
+    ),
+    "go": Toolchain(
+        "go", "1.22.5",
+        url="https://dl.google.com/go/go{version}.{os}-{arch}.tar.gz",
+        checksums="{url}.sha256",
+        binaries=("go", "gofmt"),
+        platforms={
+            "Linux-x86_64": {"os": "linux", "arch": "amd64"},
+            "Linux-aarch64": {"os": "linux", "arch": "arm64"},
+            "Darwin-x86_64": {"os": "darwin", "arch": "amd64"},
+            "Darwin-aarch64": {"os": "darwin", "arch": "arm64"},
+        },
+    ),
+    "node": Toolchain(
+        "node", "20.15.1",
+        url="https://nodejs.org/dist/v{version}/node-v{version}-{os}-{arch}.tar.xz",
+        checksums="https://nodejs.org/dist/v{version}/SHASUMS256.txt",
+        binaries=("node", "npm", "npx", "corepack"),
+        platforms={
+            "Linux-x86_64": {"os": "linux", "arch": "x64"},
+            "Linux-aarch64": {"os": "linux", "arch": "arm64"},
+            "Darwin-x86_64": {"os": "darwin", "arch": "x64"},
+            "Darwin-aarch64": {"os": "darwin", "arch": "arm64"},
+        },
+    ),
+    "java": Toolchain(
+        "java", "21.0.4+7",
+        url="https://github.com/adoptium/temurin{major}-binaries/releases/download/jdk-{quoted}/"
+            "OpenJDK{major}U-jdk_{arch}_{os}_hotspot_{underscored}.tar.gz",
+        checksums="{url}.sha256.txt",
+        binaries=("java", "javac", "jar", "jshell"),
+        platforms={
+            "Linux-x86_64": {"os": "linux", "arch": "x64"},
+            "Linux-aarch64": {"os": "linux", "arch": "aarch64"},
+            "Darwin-x86_64": {"os": "mac", "arch": "x64", "bin_dir": "Contents/Home/bin"},
+            "Darwin-aarch64": {"os": "mac", "arch": "aarch64", "bin_dir": "Contents/Home/bin"},
+        },
+    ),
+    "julia": Toolchain(
+        "julia", "1.10.4",
+        url="https://julialang-s3.julialang.org/bin/{os}/{arch}/{minor}/julia-{version}-{platform}.tar.gz",
+        checksums="https://julialang-s3.julialang.org/bin/checksums/julia-{version}.sha256",
+        binaries=("julia",),
+        platforms={
+            "Linux-x86_64": {"os": "linux", "arch": "x64", "platform": "linux-x86_64"},
+            "Linux-aarch64": {"os": "linux", "arch": "aarch64", "platform": "linux-aarch64"},
+            "Darwin-x86_64": {"os": "mac", "arch": "x64", "platform": "mac64"},
+            "Darwin-aarch64": {"os": "mac", "arch": "aarch64", "platform": "macaarch64"},
+        },
+    ),
+    # Ruby publishes no relocatable builds
+    "ruby": Toolchain(
+        "ruby",
+        packages={"brew": "ruby", "apt": "ruby-full", "dnf": "ruby", "pacman": "ruby",
+                  "winget": "RubyInstallerTeam.Ruby.3.3"},
+    ),
+}
+
+
+def find_checksum(text: str, filename: str) -> Optional[str]:
+    """sha256 of a file from a checksum file: a bare hash, or one `<sha256>  <name>` line per file"""
+    lines = [line.split() for line in text.splitlines() if line.strip()]
+    for fields in lines:
+        if len(fields) >= 2 and fields[-1].lstrip("*").rsplit("/", 1)[-1] == filename \
+                and re.fullmatch(r"[0-9a-fA-F]{64}", fields[0]):
+            return fields[0].lower()
+    if len(lines) == 1 and re.fullmatch(r"[0-9a-fA-F]{64}", lines[0][0]):
+        return lines[0][0].lower()
+    return None
+
+
+def extract_tar_stream(stream, destination: Path, strip: int = 1) -> int:
+    """Unpack a compressed tar archive in one pass and return the number of members
+
+    The archive is decompressed as it is read ("r|*"), so it is never held
+    in memory or seeked. The first `strip` path components are dropped, and
+    members that would land outside the destination are refused.
+    """
+    import tarfile
+    
+    root = os.path.realpath(str(destination))
+    
+    def inside(path: str) -> bool:
+        return path == root or path.startswith(root + os.sep)
+    
+    count = 0
+    try:
+        with tarfile.open(fileobj=stream, mode="r|*") as archive:
+            # The checks below replace the extraction filters of newer Pythons
+            archive.extraction_filter = getattr(tarfile, "fully_trusted_filter", None)
+            for member in archive:
+                parts = [part for part in member.name.split("/") if part not in ("", ".")]
+                if len(parts) <= strip:
+                    continue
+                if ".." in parts or member.isdev():
+                    raise ValueError(f"unsafe archive member {member.name}")
+                member.name = "/".join(parts[strip:])
+                target = os.path.realpath(os.path.join(root, member.name))
+                if member.islnk():
+                    # Hard links name another member, which lost its leading components too
+                    linked = [part for part in member.linkname.split("/") if part not in ("", ".")]
+                    member.linkname = "/".join(linked[strip:])
+                    link = os.path.realpath(os.path.join(root, member.linkname))
+                elif member.issym():
+                    link = os.path.normpath(os.path.join(os.path.dirname(target), member.linkname))
+                else:
+                    link = target
+                if os.path.isabs(member.linkname) or not inside(target) or not inside(link):
+                    raise ValueError(f"archive member {member.name} points outside the archive")
+                if hasattr(os, "getuid"):
+                    member.uid, member.gid, member.uname, member.gname = os.getuid(), os.getgid(), "", ""
+                archive.extract(member, root)
+                count += 1
+    except tarfile.TarError as e:
+        raise ValueError(f"broken archive: {e}")
+    return count
+
+
+@dataclass
+class FleetTarget:
+    """One home directory, container root filesystem or remote machine of a fleet manifest"""
+    name: str
+    # Home directory to set up, inside the rootfs or on the remote machine for those targets
+    home: Optional[str] = None
+    rootfs: Optional[str] = None
+    # Prefix that runs a command on the target, such as "ssh host" or "docker exec -i box"
+    command: Optional[str] = None
+    args: Tuple[str, ...] = ()
+
+    @property
+    def kind(self) -> str:
+        return "command" if self.command else "rootfs" if self.rootfs else "home"
+
+
+def load_fleet_manifest(path: Path) -> List[FleetTarget]:
+    """Read a fleet manifest: a YAML or JSON list of targets, or a mapping with `targets` and `args`
+
+    Top-level `args` are atriumos options for every target, placed before
+    the target's own `args`. YAML needs PyYAML; JSON always works.
+    """
+    text = path.read_text()
+    if path.suffix in (".yml", ".yaml"):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError(f"{path} is YAML, which needs PyYAML (pip install pyyaml); or write it as JSON")
+        data = yaml.safe_load(text)
+    else:
+        data = json.loads(text)
+    if isinstance(data, list):
+        data = {"targets": data}
+    if not isinstance(data, dict) or not isinstance(data.get("targets"), list):
+        raise ValueError(f"{path} has no list of targets")
+    
+    common = [str(arg) for arg in data.get("args") or []]
+    targets, names = [], set()  # type: List[FleetTarget], Set[str]
+    for index, entry in enumerate(data["targets"], 1):
+        if not isinstance(entry, dict):
+            raise ValueError(f"{path}: target {index} is not a mapping")
+        unknown = set(entry) - {"name", "home", "rootfs", "command", "args"}
+        if unknown:
+            raise ValueError(f"{path}: target {index} has unknown keys: {', '.join(sorted(unknown))}")
+        if entry.get("rootfs") and entry.get("command"):
+            raise ValueError(f"{path}: target {index} has both rootfs and command")
+        if not (entry.get("home") or entry.get("rootfs") or entry.get("command")):
+            raise ValueError(f"{path}: target {index} needs a home, rootfs or command")
+        where = entry.get("home") or entry.get("rootfs") or entry.get("command")
+        name = str(entry.get("name") or Path(str(where).split()[-1]).name or f"target-{index}")
+        # The name is also the log file name
+        name = re.sub(r"[^\w.-]", "_", name)
+        if name in names:
+            raise ValueError(f"{path}: more than one target is named {name}")
+        names.add(name)
+        targets.append(FleetTarget(name, entry.get("home"), entry.get("rootfs"), entry.get("command"),
+                                   tuple(common + [str(arg) for arg in entry.get("args") or []])))
+    return targets
+
+
+class AtriumOS:
+    def __init__(self, jobs: int = 4, cache_dir: Optional[Path] = None, offline: bool = False,
+                 force: Optional[List[str]] = None, log_dir: Optional[Path] = None,
+                 assume_yes: bool = False, wallpapers_folders: Optional[List[str]] = None,
+                 index_max_age: float = 6 * 3600, home: Optional[Path] = None,
+                 timeouts: Optional[Dict[str, float]] = None, attempts: Optional[Dict[str, int]] = None,
+                 step_timeouts: Optional[Dict[str, float]] = None, toolchains: Optional[List[str]] = None):
         self.system = platform.system()
-        self.home = Path.home()
+        self.jobs = jobs
+        self.force = set(force or [])
+        self.assume_yes = assume_yes
+        self.log_dir = log_dir
+        self.tail_lines = 40
+        self._current = threading.local()
+        self.retry_policies = self.make_retry_policies(timeouts or {}, attempts or {})
+        self.step_timeouts = dict(step_timeouts or {})
+        # Set on Ctrl-C; running commands are stopped and no new ones start
+        self.cancelled = threading.Event()
+        self._processes = set()  # type: Set[subprocess.Popen]
+        self._processes_lock = threading.Lock()
+        self.answers: Dict[str, object] = {}
+        self.home = Path(home) if home else Path.home()
         self.config_path = self.home / ".config" / "atriumos"
         self.repos_path = self.home / "Repos"
         self.wallpapers_path = self.home / "Wallpapers"
+        self.wallpapers_folders = list(wallpapers_folders or [])
+        self.index_max_age = index_max_age
+        # Set when a package source was added or changed, so the index has to be refreshed
+        self.sources_changed = False
+        self._linux_manager = None  # type: Optional[str]
+        self.packages = PackagePlan()
+        self.tracer = Tracer()
+        self.cache = DownloadCache(cache_dir or self.config_path / "cache", offline=offline, tracer=self.tracer,
+                                   cancelled=self.cancelled)
+        # User-space binaries atriumOS installs count as installed even before they are on PATH
+        self.bin_path = self.home / ".local" / "bin"
+        self.inventory = ToolInventory(self.config_path / "inventory.json",
+                                       os.environ.get("PATH", "") + os.pathsep + str(self.bin_path))
+        self.journal = StateJournal(self.config_path / "state.json")
+        self.toolchains_path = self.home / ".local" / "share" / "atriumos" / "toolchains"
+        self.toolchains = self.parse_toolchains(toolchains or [])
+        
+        # macOS applications installed through Homebrew
+        self.macos_apps = [
+            ("telegram", "Telegram Desktop", "--cask"),
+            ("google-chrome", "Google Chrome (Dev)", "--cask"),
+        ]
         
         # oh-my-posh theme configuration
         self.omp_theme = {
@@ -188,6 +2461,9 @@ class AtriumOS:
             "final_space": True,
             "version": 3
         }
+        self.full_theme = self.omp_theme
+        self.lean_path = self.config_path / "theme-lean.json"
+        self.omp_theme = self.apply_lean(self.full_theme, self.load_lean())
 
     def show_banner(self):
         """Display the atriumOS banner"""
@@ -205,121 +2481,786 @@ class AtriumOS:
 [/bold cyan]
 [dim]Universal Development Environment Setup v1.0[/dim]
         """
-        console.print(Panel(banner, border_style="cyan", padding=(1, 2)))
+        console.panel(banner, style="cyan")
 
     def detect_system(self):
         """Show detected system info"""
-        table = Table(show_header=False, box=None, padding=(0, 2))
-        table.add_row("[cyan]Operating System:[/cyan]", f"[bold]{self.system}[/bold]")
-        table.add_row("[cyan]Architecture:[/cyan]", f"[bold]{platform.machine()}[/bold]")
-        table.add_row("[cyan]Python Version:[/cyan]", f"[bold]{platform.python_version()}[/bold]")
-        table.add_row("[cyan]Home Directory:[/cyan]", f"[bold]{self.home}[/bold]")
+        rows = [
+            ("[cyan]Operating System:[/cyan]", f"[bold]{self.system}[/bold]"),
+            ("[cyan]Architecture:[/cyan]", f"[bold]{platform.machine()}[/bold]"),
+            ("[cyan]Python Version:[/cyan]", f"[bold]{platform.python_version()}[/bold]"),
+            ("[cyan]Home Directory:[/cyan]", f"[bold]{self.home}[/bold]"),
+        ]
         
-        console.print(Panel(table, title="[bold cyan]System Detection[/bold cyan]", border_style="cyan"))
+        console.table(rows, title="System Detection")
+
+    def step_log(self) -> Optional[Path]:
+        """Full output log of the step running on this thread, when --log-dir is set"""
+        if self.log_dir is None:
+            return None
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        return self.log_dir / f"{getattr(self._current, 'step', 'atriumos')}.log"
+
+    @staticmethod
+    def make_retry_policies(timeouts: Dict[str, float], attempts: Dict[str, int]) -> Dict[str, RetryPolicy]:
+        """Retry policies with --timeout and --attempts applied, '*' standing for every class"""
+        unknown = (set(timeouts) | set(attempts)) - set(RETRY_POLICIES) - {"*"}
+        if unknown:
+            raise ValueError(f"Unknown command class: {', '.join(sorted(unknown))} "
+                             f"(choose from {', '.join(RETRY_POLICIES)})")
+        policies = {}
+        for name, policy in RETRY_POLICIES.items():
+            timeout = timeouts.get(name, timeouts.get("*", policy.timeout))
+            tries = attempts.get(name, attempts.get("*", policy.attempts))
+            policies[name] = replace(policy, timeout=timeout or None, attempts=max(1, tries))
+        return policies
+
+    def cancel(self):
+        """Stop every running command and refuse to start new ones"""
+        self.cancelled.set()
+        with self._processes_lock:
+            processes = list(self._processes)
+        for process in processes:
+            kill_process_group(process)
+
+    def interrupt(self, signum, frame):
+        """SIGINT and SIGTERM handler: cancel the commands, then unwind as on Ctrl-C
+
+        Commands run in their own process groups, so the terminal's Ctrl-C
+        does not reach them; worker pools would otherwise wait for them.
+        """
+        self.cancel()
+        raise KeyboardInterrupt
+
+    def execute(self, command: Union[str, List[str]], description: str, shell: bool = False,
+                cwd: Optional[Path] = None, env: Optional[Dict[str, str]] = None,
+                keep: Optional["re.Pattern"] = None, command_class: str = "default",
+                attempts: Optional[int] = None, stdin: Optional[Path] = None, echo: bool = True) -> CommandResult:
+        """Run a command under the retry policy of its class
 
-    def run_command(self, command: str, description: str, shell: bool = False) -> bool:
+        Each attempt is limited by the policy's timeout and by what is left of
+        the step's --step-timeout; failures the policy considers transient are
+        retried after an exponential, jittered pause.
+        """
+        policy = self.retry_policies[command_class]
+        attempts = attempts or policy.attempts
+        attempt = 1
+        while True:
+            timeout, step_limited = policy.timeout, False
+            deadline = getattr(self._current, "deadline", None)
+            if deadline is not None and (timeout is None or deadline - time.monotonic() < timeout):
+                timeout, step_limited = deadline - time.monotonic(), True
+                if timeout <= 0:
+                    return CommandResult(1, [f"{description} not started, the step ran out of time"], [],
+                                         attempts=attempt - 1, timed_out=True)
+            result = self._execute_once(command, description, shell, cwd, env, keep, policy.transient,
+                                        timeout, attempt, stdin, echo)
+            result.attempts = attempt
+            if (result.returncode == 0 or attempt >= attempts or (result.timed_out and step_limited)
+                    or not policy.should_retry(result)):
+                return result
+            delay = policy.delay(attempt)
+            reason = f"timed out after {timeout:.0f}s" if result.timed_out else f"exit {result.returncode}"
+            console.print(f"[yellow]⚠[/yellow] {description} failed ({reason}), "
+                          f"retrying in {delay:.1f}s ({attempt + 1}/{attempts})")
+            if self.cancelled.wait(delay):
+                return result
+            attempt += 1
+
+    def _execute_once(self, command: Union[str, List[str]], description: str, shell: bool,
+                      cwd: Optional[Path], env: Optional[Dict[str, str]], keep: Optional["re.Pattern"],
+                      transient: Optional["re.Pattern"], timeout: Optional[float], attempt: int,
+                      stdin: Optional[Path] = None, echo: bool = True) -> CommandResult:
+        """Run a command once, streaming its output behind a progress indicator
+
+        Memory stays flat however much a command prints: only the last
+        tail_lines lines are kept, plus up to 1000 lines matching `keep` or
+        `transient` for callers and retry decisions. Everything goes to the
+        step log, and with echo to the console. The command reads `stdin` or
+        nothing. On timeout or cancellation the whole process group is stopped.
+        """
+        if self.cancelled.is_set():
+            raise CommandCancelled(f"{description} was not started, the run was interrupted")
+        args = command if shell or isinstance(command, list) else command.split()
+        if env is not None:
+            env = {**os.environ, **env}
+        tail: deque = deque(maxlen=self.tail_lines)
+        matches: deque = deque(maxlen=1000)
+        patterns = [pattern for pattern in (keep, transient) if pattern is not None]
+        log_path = self.step_log()
+        timed_out = threading.Event()
+        
+        command_line = command if isinstance(command, str) else " ".join(command)
+        with console.status(description) as show, \
+                open(log_path, "a", encoding="utf-8") if log_path else open(os.devnull, "w") as log, \
+                open(stdin, "rb") if stdin else open(os.devnull, "rb") as input_file, \
+                self.tracer.span(description, "command", command=command_line, attempt=attempt) as trace:
+            log.write(f"$ {command_line}\n")
+            # Never the terminal: a command in a background process group must not wait on it
+            args, shell, options = in_process_group(args, shell, env)
+            process = subprocess.Popen(args, shell=shell, cwd=cwd, env=env, stdin=input_file,
+                                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **options)
+            with self._processes_lock:
+                self._processes.add(process)
+            
+            def expire():
+                timed_out.set()
+                kill_process_group(process)
+            
+            watchdog = threading.Timer(timeout, expire) if timeout is not None else None
+            if watchdog is not None:
+                watchdog.daemon = True
+                watchdog.start()
+            try:
+                for line in iter_output_lines(process.stdout):
+                    tail.append(line)
+                    if any(pattern.search(line) for pattern in patterns):
+                        matches.append(line)
+                    log.write(line + "\n")
+                    if echo and line.strip():
+                        show(line.strip())
+            except BaseException:
+                kill_process_group(process)
+                raise
+            finally:
+                if watchdog is not None:
+                    watchdog.cancel()
+                process.stdout.close()
+                returncode, cpu, max_rss = wait_with_usage(process)
+                with self._processes_lock:
+                    self._processes.discard(process)
+            if timed_out.is_set():
+                log.write(f"[timed out after {timeout:.0f}s]\n")
+            log.write(f"[exit {returncode}]\n")
+            trace.update(exit_code=returncode, max_rss_kb=max_rss, timed_out=timed_out.is_set())
+            if cpu is not None:
+                trace["child_cpu_ms"] = cpu * 1000
+        
+        if self.cancelled.is_set():
+            raise CommandCancelled(f"{description} was stopped, the run was interrupted")
+        return CommandResult(returncode, list(tail), list(matches), log_path, timed_out=timed_out.is_set())
+
+    def run_command(self, command: Union[str, List[str]], description: str, shell: bool = False,
+                    cwd: Optional[Path] = None, env: Optional[Dict[str, str]] = None,
+                    command_class: str = "default") -> bool:
         """Run a command with progress indicator"""
         try:
-            with Progress(
-                SpinnerColumn(),
-                TextColumn("[progress.description]{task.description}"),
-                console=console,
-            ) as progress:
-                progress.add_task(description=description, total=None)
-                
-                if shell:
-                    result = subprocess.run(
-                        command,
-                        shell=True,
-                        capture_output=True,
-                        text=True,
-                        check=True
-                    )
-                else:
-                    result = subprocess.run(
-                        command.split(),
-                        capture_output=True,
-                        text=True,
-                        check=True
-                    )
-                
-            console.print(f"[green]✓[/green] {description}")
+            result = self.execute(command, description, shell=shell, cwd=cwd, env=env, command_class=command_class)
+        except CommandCancelled:
+            raise
+        except Exception as e:
+            console.print(f"[red]✗[/red] {description} - Error: {str(e)}")
+            return False
+        
+        if result.returncode != 0:
+            reason = "timed out" if result.timed_out else f"exit {result.returncode}"
+            if result.attempts > 1:
+                reason += f", {result.attempts} attempts"
+            console.print(f"[red]✗[/red] {description} - Error ({reason}):")
+            for line in result.tail[-10:]:
+                console.print(f"    {line}", markup=False)
+            if result.log_path:
+                console.print(f"    Full log: {result.log_path}", markup=False)
+            return False
+        
+        console.print(f"[green]✓[/green] {description}")
+        return True
+
+    def download(self, url: str, description: str) -> Optional[Path]:
+        """Fetch a URL through the download cache, reporting failures"""
+        try:
+            return self.cache.fetch(url)
+        except DownloadError as e:
+            console.print(f"[red]✗[/red] Downloading {description} - Error: {str(e)}")
+            return None
+
+    def is_installed(self, tool: str) -> bool:
+        """Check whether a tool is available on PATH"""
+        return self.inventory.has(tool)
+
+    def show_inventory(self):
+        """Show every tool atriumOS looks for, with its version and location"""
+        rows = []
+        for name in ToolInventory.TOOLS:
+            if self.inventory.has(name):
+                version = self.inventory.version(name) or "?"
+                rows.append((f"[cyan]{name}[/cyan]", version, f"[dim]{self.inventory.path(name)}[/dim]"))
+            else:
+                rows.append((f"[cyan]{name}[/cyan]", "[yellow]not installed[/yellow]", ""))
+        
+        console.table(rows, columns=["Tool", "Version", "Path"], title="Tool Inventory")
+
+    def install_homebrew(self):
+        """Install Homebrew on macOS"""
+        if self.system != "Darwin":
+            return True
+            
+        # Check if homebrew is already installed
+        if self.is_installed("brew"):
+            console.print("[green]✓[/green] Homebrew already installed")
+            return True
+        
+        console.print("\n[bold yellow]Installing Homebrew...[/bold yellow]")
+        script = self.download(HOMEBREW_INSTALL_URL, "Homebrew installer")
+        if script is None:
+            return False
+        # NONINTERACTIVE keeps the installer from waiting on a worker thread for RETURN
+        install_cmd = f'NONINTERACTIVE=1 /bin/bash "{script}"'
+        installed = self.run_command(install_cmd, "Installing Homebrew", shell=True, command_class="installer")
+        self.inventory.refresh()
+        return installed
+
+    def sudo(self) -> List[str]:
+        """Prefix for commands that need administrator access"""
+        if self.system == "Windows" or os.geteuid() == 0:
+            return []
+        # Unattended runs have nobody to type a password, so sudo fails instead of waiting for one
+        return ["sudo", "-n"] if self.assume_yes else ["sudo"]
+
+    def linux_package_manager(self) -> Optional[str]:
+        """Package manager of this Linux distribution: apt, dnf or pacman"""
+        if self._linux_manager is None:
+            release = read_os_release()
+            for distro in [release.get("ID", "")] + release.get("ID_LIKE", "").split():
+                if distro in LINUX_PACKAGE_MANAGERS:
+                    self._linux_manager = LINUX_PACKAGE_MANAGERS[distro]
+                    break
+            else:
+                self._linux_manager = next(
+                    (manager for manager in ("apt", "dnf", "pacman") if self.is_installed(manager)), ""
+                )
+        return self._linux_manager or None
+
+    def install_file(self, content: bytes, target: Path, description: str) -> bool:
+        """Install a root-owned file unless it already has this content"""
+        try:
+            if target.read_bytes() == content:
+                console.print(f"[green]✓[/green] {description} already up to date")
+                return True
+        except OSError:
+            pass
+        
+        self.config_path.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=str(self.config_path), delete=False) as f:
+            f.write(content)
+        try:
+            command = self.sudo() + ["install", "-D", "-m", "644", f.name, str(target)]
+            if not self.run_command(command, description):
+                return False
+        finally:
+            os.unlink(f.name)
+        self.sources_changed = True
+        return True
+
+    def setup_github_cli_source(self):
+        """Add the GitHub CLI package repository on Linux"""
+        if self.system != "Linux" or self.is_installed("gh"):
+            return True
+        
+        manager = self.linux_package_manager()
+        if manager not in ("apt", "dnf"):
+            # Arch ships github-cli in its own repositories
+            return True
+        
+        console.print("\n[bold yellow]Adding GitHub CLI package source...[/bold yellow]")
+        
+        if manager == "apt":
+            keyring = self.download(GH_KEYRING_URL, "GitHub CLI keyring")
+            if keyring is None:
+                return False
+            arch = subprocess.run(["dpkg", "--print-architecture"], capture_output=True, text=True,
+                                  timeout=PROBE_TIMEOUT).stdout.strip()
+            source = (f"deb [arch={arch} signed-by={GH_APT_KEYRING}] "
+                      "https://cli.github.com/packages stable main\n")
+            return (self.install_file(keyring.read_bytes(), GH_APT_KEYRING, "Installing GitHub CLI keyring")
+                    and self.install_file(source.encode(), GH_APT_SOURCE, "Setting up GitHub CLI source"))
+        
+        repo = self.download(GH_RPM_REPO_URL, "GitHub CLI repository")
+        if repo is None:
+            return False
+        return self.install_file(repo.read_bytes(), GH_DNF_REPO, "Setting up GitHub CLI source")
+
+    def plan_packages(self):
+        """Declare every package this run installs through a package manager"""
+        if not self.is_installed("gh"):
+            if self.system == "Darwin":
+                self.packages.add("brew", "gh", "GitHub CLI", "install_github_cli")
+            elif self.system == "Linux" and self.linux_package_manager():
+                manager = self.linux_package_manager()
+                self.packages.add(manager, "github-cli" if manager == "pacman" else "gh", "GitHub CLI",
+                                  "install_github_cli")
+            elif self.system == "Windows":
+                self.packages.add("winget", "GitHub.cli", "GitHub CLI", "install_github_cli")
+        
+        if self.system == "Darwin":
+            self.packages.add("brew", "jandedobbeleer/oh-my-posh/oh-my-posh", "oh-my-posh", "install_oh_my_posh")
+            for app_name, description, *flags in self.macos_apps:
+                manager = "brew-cask" if "--cask" in flags else "brew"
+                self.packages.add(manager, app_name, description, "install_macos_apps")
+        elif self.system == "Windows":
+            self.packages.add("winget", "JanDeDobbeleer.OhMyPosh", "oh-my-posh", "install_oh_my_posh")
+        
+        if self.system == "Linux":
+            manager = self.linux_package_manager()
+        else:
+            manager = {"Darwin": "brew", "Windows": "winget"}.get(self.system)
+        for name in self.toolchains:
+            packages = TOOLCHAINS[name].packages or {}
+            if manager in packages and not self.is_installed(name):
+                self.packages.add(manager, packages[manager], name.title(), f"toolchain_{name}")
+
+    def install_packages(self):
+        """Install all declared packages with one transaction per package manager
+
+        Steps that declared packages run after this one even when some
+        package failed, and check their own packages in the plan.
+        """
+        if not self.packages:
             return True
-        except subprocess.CalledProcessError as e:
-            console.print(f"[red]✗[/red] {description} - Error: {e.stderr}")
+        
+        console.print("\n[bold yellow]Installing packages...[/bold yellow]")
+        with host_lock("packages", "Waiting for another atriumOS run on this machine to finish installing packages"):
+            self._install_declared()
+        
+        self.inventory.refresh()
+        # A partial failure keeps the step out of the journal so the next run retries it
+        return all(self.packages.results.values())
+
+    def _install_declared(self):
+        """Run the transactions of every package manager that has declared packages"""
+        brew_env = {"HOMEBREW_NO_INSTALL_CLEANUP": "1"}
+        for manager, flag in (("brew", "--formula"), ("brew-cask", "--cask")):
+            packages = self.packages.packages(manager)
+            if packages:
+                failed = self._install_batch(manager, ["brew", "install", flag], packages,
+                                             parse_brew_failures, env=brew_env)
+                self._report(packages, failed)
+                # One index refresh per run is enough
+                brew_env["HOMEBREW_NO_AUTO_UPDATE"] = "1"
+        
+        for manager, parse in (("apt", parse_apt_failures), ("dnf", parse_dnf_failures),
+                               ("pacman", parse_pacman_failures)):
+            packages = self.packages.packages(manager)
+            if packages:
+                self._report(packages, self._linux_install(manager, packages, parse))
+        
+        packages = self.packages.packages("winget")
+        if packages:
+            self._report(packages, self._winget_import(packages))
+
+    def index_is_fresh(self, manager: str) -> bool:
+        """Whether a package index is recent enough to install from without refreshing"""
+        if self.sources_changed:
             return False
+        age = package_index_age(manager)
+        if age is None or age > self.index_max_age:
+            return False
+        console.print(f"[cyan]ℹ[/cyan] {manager} package index is {age / 60:.0f} minutes old, not refreshing it")
+        return True
+
+    def _linux_install(self, manager: str, packages: List[str],
+                       parse: Callable[[str, List[str], int], Set[str]]) -> Set[str]:
+        """Install packages with apt, dnf or pacman, refreshing the index only when it is stale"""
+        fresh = self.index_is_fresh(manager)
+        # With no known index age (dnf 5 keeps its cache elsewhere), dnf's own metadata_expire decides
+        unknown = manager == "dnf" and not self.sources_changed and package_index_age(manager) is None
+        
+        def install_command(refresh: bool) -> Optional[List[str]]:
+            """The install command, None when the index refresh it needs failed"""
+            if manager == "apt":
+                if refresh and not self.run_command(self.sudo() + ["apt-get", "update"], "Refreshing apt package index",
+                                                    command_class="package"):
+                    console.print("[red]✗[/red] The apt package index could not be refreshed, "
+                                  "not installing from stale or partial package lists")
+                    return None
+                return self.sudo() + ["env", "DEBIAN_FRONTEND=noninteractive", "apt-get", "install", "-y"]
+            if manager == "dnf":
+                if unknown:
+                    return self.sudo() + ["dnf", "install", "-y"]
+                # dnf refreshes metadata older than metadata_expire by itself
+                expire = 0 if refresh else int(self.index_max_age)
+                return self.sudo() + ["dnf", "install", "-y", f"--setopt=metadata_expire={expire}"]
+            # Arch does not support partial upgrades, so a refreshed index means upgrading the system too
+            return self.sudo() + ["pacman", "-Syu" if refresh else "-S", "--needed", "--noconfirm"]
+        
+        install = install_command(refresh=not fresh)
+        remaining, failed = list(packages), set()
+        while remaining:
+            if install is None:
+                return failed | set(remaining)
+            rejected = self._transaction(manager, install + remaining, remaining, parse)
+            if rejected and (fresh or unknown):
+                # The index may predate the package, so refresh once and try again
+                fresh = unknown = False
+                install = install_command(refresh=True)
+                continue
+            failed |= rejected
+            if not rejected or rejected == set(remaining):
+                break
+            # The manager rolled back the whole transaction, so try again without the bad packages
+            remaining = [package for package in remaining if package not in rejected]
+        return failed
+
+    def _install_batch(self, manager: str, command: List[str], packages: List[str],
+                       parse: Callable[[str, List[str], int], Set[str]],
+                       env: Optional[Dict[str, str]] = None) -> Set[str]:
+        """Install packages in one transaction, retrying without the ones the manager rejected
+
+        brew aborts the whole batch over one bad package, so the packages it
+        did not name were not installed either and get a transaction of their own.
+        """
+        remaining, failed = list(packages), set()
+        while remaining:
+            rejected = self._transaction(manager, command + remaining, remaining, parse, env=env)
+            failed |= rejected
+            if not rejected or rejected == set(remaining):
+                break
+            remaining = [package for package in remaining if package not in rejected]
+        return failed
+
+    def _transaction(self, manager: str, command: List[str], packages: List[str],
+                     parse: Callable[[str, List[str], int], Set[str]],
+                     env: Optional[Dict[str, str]] = None) -> Set[str]:
+        """Run one package manager transaction and return the packages that failed"""
+        names = "|".join(re.escape(package.rsplit("/", 1)[-1]) for package in packages)
+        keep = re.compile(rf"^(Error|E):|installed|not found|failed|{names}", re.IGNORECASE)
+        try:
+            result = self.execute(command, f"Installing {len(packages)} {manager} package(s)", env=env, keep=keep,
+                                  command_class="package")
+            output, returncode = result.output, result.returncode
+        except CommandCancelled:
+            raise
         except Exception as e:
-            console.print(f"[red]✗[/red] {description} - Error: {str(e)}")
-            return False
+            output, returncode = str(e), 1
+        return parse(output, packages, returncode)
 
-    def install_homebrew(self):
-        """Install Homebrew on macOS"""
-        if self.system != "Darwin":
-            return True
-            
-        # Check if homebrew is already installed
-        if subprocess.run(["which", "brew"], capture_output=True).returncode == 0:
-            console.print("[green]✓[/green] Homebrew already installed")
-            return True
+    def _report(self, packages: List[str], failed: Set[str]):
+        """Record and print the outcome of each package"""
+        self.packages.record(packages, failed)
+        for package in packages:
+            description = self.packages.description(package)
+            if package in failed:
+                console.print(f"[red]✗[/red] Installing {description}")
+            else:
+                console.print(f"[green]✓[/green] Installing {description}")
+
+    def _winget_import(self, packages: List[str]) -> Set[str]:
+        """Install winget packages in one `winget import` transaction"""
+        import_file = {
+            "$schema": "https://aka.ms/winget-packages.schema.2.0.json",
+            "Sources": [{
+                "SourceDetails": {
+                    "Name": "winget",
+                    "Argument": "https://cdn.winget.microsoft.com/cache",
+                    "Identifier": "Microsoft.Winget.Source_8wekyb3d8bbwe",
+                    "Type": "Microsoft.PreIndexed.Package",
+                },
+                "Packages": [{"PackageIdentifier": package} for package in packages],
+            }],
+        }
+        self.config_path.mkdir(parents=True, exist_ok=True)
+        import_path = self.config_path / "winget-packages.json"
+        with open(import_path, "w") as f:
+            json.dump(import_file, f, indent=2)
         
-        console.print("\n[bold yellow]Installing Homebrew...[/bold yellow]")
-        install_cmd = '/bin/bash -c "$(curl -fsSL https://raw.githubusercontent.com/Homebrew/install/HEAD/install.sh)"'
-        return self.run_command(install_cmd, "Installing Homebrew", shell=True)
+        command = ["winget", "import", "--import-file", str(import_path),
+                   "--accept-package-agreements", "--accept-source-agreements"]
+        return self._transaction("winget", command, packages, parse_winget_failures)
 
     def install_github_cli(self):
         """Install GitHub CLI based on OS"""
         console.print("\n[bold yellow]Installing GitHub CLI...[/bold yellow]")
         
         # Check if gh is already installed
-        if subprocess.run(["which", "gh"], capture_output=True).returncode == 0:
+        if self.is_installed("gh"):
             console.print("[green]✓[/green] GitHub CLI already installed")
             return True
         
-        if self.system == "Darwin":
-            return self.run_command("brew install gh", "Installing GitHub CLI")
-        elif self.system == "Linux":
-            # For Ubuntu/Debian
-            commands = [
-                "curl -fsSL https://cli.github.com/packages/githubcli-archive-keyring.gpg | sudo dd of=/usr/share/keyrings/githubcli-archive-keyring.gpg",
-                "sudo chmod go+r /usr/share/keyrings/githubcli-archive-keyring.gpg",
-                'echo "deb [arch=$(dpkg --print-architecture) signed-by=/usr/share/keyrings/githubcli-archive-keyring.gpg] https://cli.github.com/packages stable main" | sudo tee /etc/apt/sources.list.d/github-cli.list > /dev/null',
-                "sudo apt update",
-                "sudo apt install gh -y"
-            ]
-            for cmd in commands:
-                if not self.run_command(cmd, f"Setting up GitHub CLI", shell=True):
-                    return False
-            return True
-        elif self.system == "Windows":
-            return self.run_command("winget install --id GitHub.cli", "Installing GitHub CLI")
+        if self.system == "Linux" and not self.linux_package_manager():
+            console.print("[red]✗[/red] No supported package manager (apt, dnf or pacman) found")
+            return False
         
-        return False
+        return self.packages.succeeded("install_github_cli")
+
+    # Answers used with --yes; anything that needs a person at the terminal is skipped
+    UNATTENDED_ANSWERS = {
+        "github_auth": False,
+        "wallpapers_repo": "",
+    }
+
+    def ask(self, key: str, question: Callable[[], object]) -> object:
+        """Return a remembered answer, asking the question the first time"""
+        if key not in self.answers:
+            self.answers[key] = self.UNATTENDED_ANSWERS[key] if self.assume_yes else question()
+        return self.answers[key]
+
+    def ask_github_auth(self) -> bool:
+        """Ask whether to authenticate with GitHub"""
+        def question():
+            console.print("\n[bold yellow]GitHub Authentication[/bold yellow]")
+            return console.confirm("Do you want to authenticate with GitHub now?", default=True)
+        return bool(self.ask("github_auth", question))
+
+    def ask_wallpapers_repo(self) -> str:
+        """Ask for the wallpapers repository URL, empty when not syncing"""
+        def question():
+            console.print("\n[bold yellow]Wallpapers Directory Setup[/bold yellow]")
+            if console.confirm("Do you want to sync wallpapers with a GitHub repository?", default=False):
+                return console.prompt("Enter GitHub repository URL")
+            return ""
+        return str(self.ask("wallpapers_repo", question) or "")
+
+    def needs_sudo(self) -> bool:
+        """Whether any step is going to ask sudo for a password"""
+        if self.system == "Windows" or os.geteuid() == 0:
+            return False
+        if self.system == "Darwin":
+            return not self.is_installed("brew")
+        # On Linux only the system package manager needs root, for every package declared for it
+        return any(self.packages.packages(manager) for manager in ("apt", "dnf", "pacman"))
+
+    def collect_prompts(self, steps: List[Step]):
+        """Ask every question the steps need up front so no worker blocks on the terminal"""
+        questions = {
+            "github_auth": self.ask_github_auth,
+            "wallpapers_repo": self.ask_wallpapers_repo,
+        }
+        for step in steps:
+            for key in step.prompts:
+                questions[key]()
+
+    def authenticate(self, steps: List[Step]):
+        """Ask for the sudo password once, before workers start needing it"""
+        installs = {"install_homebrew", "setup_github_cli_source", "install_packages"}
+        if not self.assume_yes and installs & {step.name for step in steps} and self.needs_sudo():
+            console.print("\n[cyan]ℹ[/cyan] Some steps need administrator access")
+            subprocess.run(["sudo", "-v"], check=False)
 
     def setup_github_auth(self):
         """Setup GitHub authentication"""
-        console.print("\n[bold yellow]GitHub Authentication[/bold yellow]")
-        
-        if Confirm.ask("Do you want to authenticate with GitHub now?", default=True):
+        if self.ask_github_auth():
             console.print("\n[cyan]Opening browser for GitHub authentication...[/cyan]")
             subprocess.run(["gh", "auth", "login", "--web"], check=False)
             console.print("[green]✓[/green] GitHub authentication completed")
         else:
             console.print("[yellow]⚠[/yellow] You can authenticate later with: [bold]gh auth login[/bold]")
 
+    def install_binary(self, url: str, name: str, description: str) -> bool:
+        """Install a release binary into ~/.local/bin after checking its published sha256"""
+        checksum = self.download(url + ".sha256", f"{description} checksum")
+        if checksum is None:
+            return False
+        match = re.search(r"\b[0-9a-f]{64}\b", checksum.read_text(errors="replace").lower())
+        if match is None:
+            console.print(f"[red]✗[/red] {description} checksum file is not a sha256")
+            return False
+        
+        try:
+            with console.status(f"Downloading {description}"):
+                binary = self.cache.fetch(url, sha256=match.group(0))
+        except DownloadError as e:
+            console.print(f"[red]✗[/red] Downloading {description} - Error: {str(e)}")
+            return False
+        
+        target = self.bin_path / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f".{name}.tmp")
+        shutil.copyfile(binary, tmp)
+        tmp.chmod(0o755)
+        os.replace(tmp, target)
+        self.journal.add_file(target, name)
+        console.print(f"[green]✓[/green] Installed {description} to {target}")
+        
+        if str(target.parent) not in os.environ.get("PATH", "").split(os.pathsep):
+            console.print(f"[cyan]ℹ[/cyan] Add {target.parent} to your PATH to use {name} directly")
+        return True
+
+    def parse_toolchains(self, specs: List[str]) -> Dict[str, str]:
+        """Turn ['python', 'go@1.22.5'] into toolchain names and versions, pinned ones by default"""
+        toolchains = {}
+        for spec in specs:
+            name, _, version = spec.partition("@")
+            if name not in TOOLCHAINS:
+                raise ValueError(f"Unknown toolchain: {name} (choose from {', '.join(TOOLCHAINS)})")
+            if version and TOOLCHAINS[name].packages:
+                console.print(f"[yellow]⚠[/yellow] {name} comes from the system package manager, "
+                              f"ignoring version {version}")
+                version = ""
+            toolchains[name] = version or TOOLCHAINS[name].version
+        return toolchains
+
+    def toolchain_marker(self, name: str) -> dict:
+        """What the marker of the requested toolchain version says, empty when it is not installed"""
+        try:
+            return json.loads((self.toolchains_path / name / self.toolchains[name] / TOOLCHAIN_MARKER).read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def install_toolchain(self, name: str) -> bool:
+        """Install a pinned toolchain into user space and link its binaries into ~/.local/bin"""
+        toolchain, version = TOOLCHAINS[name], self.toolchains[name]
+        step = f"toolchain_{name}"
+        if toolchain.packages:
+            installed = self.packages.succeeded(step)
+            if installed:
+                console.print(f"[green]✓[/green] {name} installed")
+            else:
+                console.print(f"[red]✗[/red] {name} not installed")
+            return installed
+        
+        release = toolchain.release(self.system, platform.machine(), version)
+        if release is None:
+            console.print(f"[red]✗[/red] No {name} build for {self.system} on {platform.machine()}")
+            return False
+        
+        root = self.toolchains_path / name / version
+        if self.toolchain_marker(name).get("url") == release["url"]:
+            console.print(f"[green]✓[/green] {name} {version} already installed")
+        elif not self.unpack_toolchain(name, version, release, root):
+            return False
+        
+        self.journal.add_file(self.toolchains_path / name, step)
+        self.bin_path.mkdir(parents=True, exist_ok=True)
+        for binary in toolchain.binaries:
+            target, link = root / release["bin_dir"] / binary, self.bin_path / binary
+            if not target.exists() or (link.is_symlink() and os.readlink(link) == str(target)):
+                continue
+            if link.exists() and not link.is_symlink():
+                console.print(f"[yellow]⚠[/yellow] {link} is not a link atriumOS made, leaving it alone")
+                continue
+            tmp = link.with_name(f".{binary}.tmp")
+            if tmp.is_symlink() or tmp.exists():
+                tmp.unlink()
+            os.symlink(str(target), str(tmp))
+            os.replace(tmp, link)
+            self.journal.add_file(link, step)
+        
+        # Versions replaced by this one are no longer linked anywhere
+        for other in (self.toolchains_path / name).iterdir():
+            if other != root and (other / TOOLCHAIN_MARKER).exists():
+                shutil.rmtree(other, ignore_errors=True)
+        
+        if str(self.bin_path) not in os.environ.get("PATH", "").split(os.pathsep):
+            console.print(f"[cyan]ℹ[/cyan] Add {self.bin_path} to your PATH to use {name} directly")
+        return True
+
+    def unpack_toolchain(self, name: str, version: str, release: Dict[str, str], root: Path) -> bool:
+        """Download a toolchain archive through the cache, check it and unpack it into root"""
+        checksums = self.download(release["checksums"], f"{name} {version} checksums")
+        if checksums is None:
+            return False
+        filename = release["url"].rsplit("/", 1)[-1].replace("%2B", "+")
+        sha256 = find_checksum(checksums.read_text(errors="replace"), filename)
+        if sha256 is None:
+            console.print(f"[red]✗[/red] {release['checksums']} has no checksum for {filename}")
+            return False
+        
+        try:
+            with console.status(f"Downloading {name} {version}"):
+                archive = self.cache.fetch(release["url"], sha256=sha256)
+        except DownloadError as e:
+            console.print(f"[red]✗[/red] Downloading {name} {version} - Error: {str(e)}")
+            return False
+        
+        # Unpacked next to the final directory and moved into place, so a half-written toolchain is never used
+        partial = root.with_name(f".{version}.partial")
+        shutil.rmtree(partial, ignore_errors=True)
+        partial.mkdir(parents=True)
+        try:
+            with console.status(f"Unpacking {name} {version}"), open(archive, "rb") as f, \
+                    self.tracer.span(f"Unpacking {name} {version}", "extract") as trace:
+                trace["members"] = extract_tar_stream(f, partial)
+            marker = {"name": name, "version": version, "url": release["url"], "sha256": sha256}
+            (partial / TOOLCHAIN_MARKER).write_text(json.dumps(marker, indent=2, sort_keys=True))
+            if root.exists():
+                shutil.rmtree(root)
+            os.replace(partial, root)
+        except (OSError, ValueError) as e:
+            console.print(f"[red]✗[/red] Unpacking {name} {version} - Error: {str(e)}")
+            return False
+        finally:
+            shutil.rmtree(partial, ignore_errors=True)
+        console.print(f"[green]✓[/green] Installed {name} {version} to {root}")
+        return True
+
     def install_oh_my_posh(self):
         """Install oh-my-posh"""
         console.print("\n[bold yellow]Installing oh-my-posh...[/bold yellow]")
         
-        if self.system == "Darwin":
-            return self.run_command("brew install jandedobbeleer/oh-my-posh/oh-my-posh", "Installing oh-my-posh")
-        elif self.system == "Linux":
-            cmd = "curl -s https://ohmyposh.dev/install.sh | bash -s"
-            return self.run_command(cmd, "Installing oh-my-posh", shell=True)
-        elif self.system == "Windows":
-            return self.run_command("winget install JanDeDobbeleer.OhMyPosh -s winget", "Installing oh-my-posh")
+        if self.system == "Linux":
+            arch = RELEASE_ARCHITECTURES.get(platform.machine().lower())
+            if arch is None:
+                console.print(f"[red]✗[/red] No oh-my-posh release for {platform.machine()}")
+                return False
+            installed = self.install_binary(OH_MY_POSH_RELEASE_URL.format(arch=arch), "oh-my-posh", "oh-my-posh")
+            self.inventory.refresh()
+            return installed
+        elif self.system in ["Darwin", "Windows"]:
+            return self.packages.succeeded("install_oh_my_posh")
         
         return False
 
+    def detect_shell(self) -> Optional[str]:
+        """Login shell atriumOS configures, zsh or bash"""
+        shell = os.environ.get("SHELL", "")
+        if "zsh" in shell:
+            return "zsh"
+        elif "bash" in shell:
+            return "bash"
+        return None
+
+    def theme_hash(self) -> str:
+        """Hash of the theme as written to atriumos-theme.json"""
+        return hashlib.sha256(json.dumps(self.omp_theme, indent=2).encode("utf-8")).hexdigest()
+
+    def write_shell_init(self, shell: str, theme_path: Path) -> Optional[Path]:
+        """Generate the oh-my-posh init script once instead of on every shell start
+
+        The script is only regenerated when the oh-my-posh version or the
+        theme hash recorded in its first line no longer match.
+        """
+        omp = self.inventory.path("oh-my-posh")
+        if omp is None:
+            return None
+        
+        init_path = self.config_path / f"init.{shell}"
+        header = f"# atriumOS: oh-my-posh {self.inventory.version('oh-my-posh')} theme {self.theme_hash()}\n"
+        try:
+            with open(init_path) as f:
+                if f.readline() == header:
+                    return init_path
+        except OSError:
+            pass
+        
+        result = subprocess.run([omp, "init", shell, "--config", str(theme_path), "--print"],
+                                capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+        if result.returncode != 0 or not result.stdout.strip():
+            console.print(f"[yellow]⚠[/yellow] Could not generate the oh-my-posh init script: {result.stderr.strip()}")
+            return None
+        
+        tmp = init_path.with_name(init_path.name + ".tmp")
+        tmp.write_text(header + result.stdout)
+        os.replace(tmp, init_path)
+        return init_path
+
+    def shell_init_block(self, shell: str, theme_path: Path) -> str:
+        """rc-file lines that load oh-my-posh, from the cached init script when possible"""
+        init_path = self.write_shell_init(shell, theme_path)
+        if init_path is None:
+            return f'eval "$(oh-my-posh init {shell} --config {theme_path})"'
+        
+        omp = self.inventory.path("oh-my-posh")
+        # `-nt` is a shell builtin, so an unchanged setup starts without forking oh-my-posh
+        return f"""_atriumos_omp='{omp}'
+_atriumos_init='{init_path}'
+if [ -x "$_atriumos_omp" ]; then
+    if [ "$_atriumos_omp" -nt "$_atriumos_init" ] || [ '{theme_path}' -nt "$_atriumos_init" ]; then
+        "$_atriumos_omp" init {shell} --config '{theme_path}' --print > "$_atriumos_init"
+    fi
+    . "$_atriumos_init"
+fi
+unset _atriumos_omp _atriumos_init"""
+
     def setup_oh_my_posh_theme(self):
         """Setup oh-my-posh theme"""
         console.print("\n[bold yellow]Configuring oh-my-posh theme...[/bold yellow]")
@@ -328,40 +3269,35 @@ class AtriumOS:
         self.config_path.mkdir(parents=True, exist_ok=True)
         theme_path = self.config_path / "atriumos-theme.json"
         
-        # Save theme
-        with open(theme_path, "w") as f:
-            json.dump(self.omp_theme, f, indent=2)
+        # Save theme, leaving the file alone when it is unchanged so cached init scripts stay valid
+        theme = json.dumps(self.omp_theme, indent=2)
+        if not theme_path.exists() or theme_path.read_text() != theme:
+            theme_path.write_text(theme)
         
         console.print(f"[green]✓[/green] Theme saved to {theme_path}")
         
         # Setup shell integration
-        shell_config = None
-        init_command = f'eval "$(oh-my-posh init bash --config {theme_path})"'
-        
         if self.system in ["Darwin", "Linux"]:
-            # Detect shell
-            shell = os.environ.get("SHELL", "")
-            if "zsh" in shell:
-                shell_config = self.home / ".zshrc"
-                init_command = f'eval "$(oh-my-posh init zsh --config {theme_path})"'
-            elif "bash" in shell:
-                shell_config = self.home / ".bashrc"
-            
-            if shell_config:
-                # Check if already configured
-                if shell_config.exists():
-                    content = shell_config.read_text()
-                    if "oh-my-posh" in content:
-                        console.print("[green]✓[/green] oh-my-posh already configured in shell")
-                        return True
+            shell = self.detect_shell()
+            if shell:
+                shell_config = self.home / f".{shell}rc"
+                content = shell_config.read_text() if shell_config.exists() else ""
                 
-                # Add configuration
-                with open(shell_config, "a") as f:
-                    f.write(f"\n# atriumOS oh-my-posh configuration\n")
-                    f.write(f"{init_command}\n")
+                # Earlier versions appended a bare eval line; swap it for the managed block
+                legacy = re.search(r"\n?# atriumOS oh-my-posh configuration\neval .*oh-my-posh init.*\n?", content)
+                if legacy:
+                    content = content[:legacy.start()] + content[legacy.end():]
+                elif "oh-my-posh" in content and not find_managed_block(content, "oh-my-posh"):
+                    console.print("[green]✓[/green] oh-my-posh already configured in shell")
+                    return True
                 
-                console.print(f"[green]✓[/green] oh-my-posh configured in {shell_config}")
-                console.print(f"[yellow]⚠[/yellow] Run [bold]source {shell_config}[/bold] to apply changes")
+                updated = upsert_managed_block(content, "oh-my-posh", self.shell_init_block(shell, theme_path))
+                if updated != content or legacy:
+                    shell_config.write_text(updated)
+                    console.print(f"[green]✓[/green] oh-my-posh configured in {shell_config}")
+                    console.print(f"[yellow]⚠[/yellow] Run [bold]source {shell_config}[/bold] to apply changes")
+                else:
+                    console.print("[green]✓[/green] oh-my-posh already configured in shell")
         
         elif self.system == "Windows":
             console.print("[yellow]⚠[/yellow] For Windows, add this to your PowerShell profile:")
@@ -369,6 +3305,171 @@ class AtriumOS:
         
         return True
 
+    def bench_shell(self, shell: Optional[str] = None, runs: int = 10):
+        """Measure interactive shell startup with and without the cached oh-my-posh init"""
+        shell = shell or self.detect_shell() or "bash"
+        shell_path = shutil.which(shell)
+        if shell_path is None:
+            raise ValueError(f"{shell} is not installed")
+        
+        theme_path = self.config_path / "atriumos-theme.json"
+        variants = [("no prompt", "")]
+        if self.inventory.has("oh-my-posh") and theme_path.exists():
+            variants.append(("eval on start", f'eval "$(oh-my-posh init {shell} --config {theme_path})"'))
+            variants.append(("cached init", self.shell_init_block(shell, theme_path)))
+        else:
+            console.print("[yellow]⚠[/yellow] oh-my-posh or the atriumOS theme is missing, only timing the bare shell")
+        
+        rows = []
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, rc in variants:
+                rc_dir = Path(tmp) / name.replace(" ", "-")
+                rc_dir.mkdir()
+                rc_file = rc_dir / (".zshrc" if shell == "zsh" else ".bashrc")
+                rc_file.write_text(rc + "\n")
+                if shell == "zsh":
+                    command, env = [shell_path, "-i", "-c", "exit"], {**os.environ, "ZDOTDIR": str(rc_dir)}
+                else:
+                    command, env = [shell_path, "--rcfile", str(rc_file), "-i", "-c", "exit"], None
+                
+                timings = []
+                for _ in range(runs + 1):
+                    start = time.perf_counter()
+                    subprocess.run(command, env=env, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=PROBE_TIMEOUT)
+                    timings.append((time.perf_counter() - start) * 1000)
+                # The first run warms caches and is not counted
+                timings = sorted(timings[1:])
+                rows.append((name, f"{timings[len(timings) // 2]:.1f} ms", f"{min(timings):.1f} ms"))
+        
+        console.table(rows, columns=["Variant", "Median", "Best"], title=f"{shell} startup ({runs} runs)")
+
+    # Segments that are never dropped from a lean theme
+    LEAN_KEEP = ("path", "text")
+    
+    # Cheaper configurations tried before a segment is dropped
+    LEAN_PROPERTIES = {
+        "git": {
+            "fetch_status": False,
+            "fetch_upstream_icon": False,
+            "fetch_stash_count": False,
+            "fetch_worktree_count": False,
+        },
+    }
+
+    def load_lean(self) -> dict:
+        """Lean theme adjustments saved by `theme profile --lean`"""
+        try:
+            return json.loads(self.lean_path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def apply_lean(theme: dict, lean: dict) -> dict:
+        """Copy of a theme with segments dropped or reconfigured"""
+        theme = json.loads(json.dumps(theme))
+        drop = set(lean.get("drop", []))
+        properties = lean.get("properties", {})
+        for block in theme["blocks"]:
+            block["segments"] = [segment for segment in block["segments"] if segment["type"] not in drop]
+            for segment in block["segments"]:
+                if segment["type"] in properties:
+                    segment["properties"] = {**segment.get("properties", {}), **properties[segment["type"]]}
+        return theme
+
+    def profile_theme(self, theme: dict, runs: int = 5, cwd: Optional[Path] = None,
+                      omp: Optional[str] = None) -> Tuple[Dict[str, List[float]], List[float]]:
+        """Render a theme repeatedly with `oh-my-posh debug` and collect segment timings"""
+        omp = omp or self.inventory.path("oh-my-posh")
+        if omp is None:
+            raise ValueError("oh-my-posh is not installed")
+        
+        timings = {}  # type: Dict[str, List[float]]
+        totals = []
+        with tempfile.TemporaryDirectory() as tmp:
+            theme_path = Path(tmp) / "theme.json"
+            theme_path.write_text(json.dumps(theme, indent=2))
+            for _ in range(runs):
+                result = subprocess.run([omp, "debug", "--plain", "--config", str(theme_path)],
+                                        cwd=str(cwd) if cwd else None, capture_output=True, text=True,
+                                        timeout=PROBE_TIMEOUT)
+                if result.returncode != 0:
+                    raise ValueError(f"oh-my-posh debug failed: {result.stderr.strip() or result.stdout.strip()}")
+                segments, total = parse_omp_debug(result.stdout)
+                for name, ms in segments.items():
+                    timings.setdefault(name, []).append(ms)
+                totals.append(total if total is not None else sum(segments.values()))
+        return timings, totals
+
+    def show_theme_profile(self, timings: Dict[str, List[float]], totals: List[float], title: str):
+        """Print a per-segment cost table, most expensive first"""
+        from statistics import median
+        
+        medians = {name: median(values) for name, values in timings.items()}
+        total = median(totals) if totals else 0.0
+        rows = [
+            (name, f"{medians[name]:.1f} ms", f"{max(timings[name]):.1f} ms",
+             f"{medians[name] / total * 100:.0f}%" if total else "-")
+            for name in sorted(medians, key=medians.get, reverse=True)
+        ]
+        rows.append(("total", f"{total:.1f} ms", f"{max(totals, default=0.0):.1f} ms", ""))
+        console.table(rows, columns=["Segment", "Median", "Max", "Share"], title=title)
+
+    def lean_theme(self, budget_ms: float, runs: int = 5, cwd: Optional[Path] = None,
+                   omp: Optional[str] = None) -> dict:
+        """Reconfigure or drop the slowest segments until a render fits the budget"""
+        from statistics import median
+        
+        lean = {"budget_ms": budget_ms, "drop": [], "properties": {}}
+        while True:
+            theme = self.apply_lean(self.full_theme, lean)
+            timings, totals = self.profile_theme(theme, runs, cwd, omp)
+            total = median(totals)
+            if total <= budget_ms:
+                break
+            
+            candidates = sorted(
+                (name for name in timings if name not in self.LEAN_KEEP and name not in lean["drop"]),
+                key=lambda name: median(timings[name]), reverse=True,
+            )
+            if not candidates:
+                console.print(f"[yellow]⚠[/yellow] Nothing left to trim, the prompt still takes {total:.1f} ms")
+                break
+            
+            slowest = candidates[0]
+            if slowest in self.LEAN_PROPERTIES and slowest not in lean["properties"]:
+                lean["properties"][slowest] = self.LEAN_PROPERTIES[slowest]
+                console.print(f"[cyan]→[/cyan] {slowest}: {median(timings[slowest]):.1f} ms, switching to a cheaper configuration")
+            else:
+                lean["drop"].append(slowest)
+                lean["properties"].pop(slowest, None)
+                console.print(f"[cyan]→[/cyan] {slowest}: {median(timings[slowest]):.1f} ms, dropping the segment")
+        
+        self.show_theme_profile(timings, totals, title=f"Lean theme (budget {budget_ms:g} ms)")
+        return lean
+
+    def theme_profile(self, runs: int = 5, cwd: Optional[Path] = None, omp: Optional[str] = None,
+                      lean: bool = False, budget_ms: float = 50.0):
+        """Profile the prompt and optionally save a lean theme that fits the budget"""
+        timings, totals = self.profile_theme(self.omp_theme, runs, cwd, omp)
+        self.show_theme_profile(timings, totals, title=f"Prompt render ({runs} runs in {cwd or Path.cwd()})")
+        if not lean:
+            return
+        
+        # Trimming starts from the full theme, so a bigger budget brings segments back
+        settings = self.lean_theme(budget_ms, runs, cwd, omp)
+        self.config_path.mkdir(parents=True, exist_ok=True)
+        self.lean_path.write_text(json.dumps(settings, indent=2))
+        self.omp_theme = self.apply_lean(self.full_theme, settings)
+        self.setup_oh_my_posh_theme()
+
+    def theme_reset(self):
+        """Go back to the full theme"""
+        if self.lean_path.exists():
+            self.lean_path.unlink()
+        self.omp_theme = self.full_theme
+        self.setup_oh_my_posh_theme()
+
     def create_directories(self):
         """Create necessary directories"""
         console.print("\n[bold yellow]Creating directories...[/bold yellow]")
@@ -389,36 +3490,430 @@ class AtriumOS:
         
         console.print("\n[bold yellow]Installing macOS Applications...[/bold yellow]")
         
-        apps = [
-            ("telegram", "Telegram Desktop"),
-            ("google-chrome", "Google Chrome (Dev)", "--cask"),
-        ]
-        
-        for app_name, description, *flags in apps:
-            flag = flags[0] if flags else ""
-            if flag:
-                cmd = f"brew install {flag} {app_name}"
+        for app_name, description, *flags in self.macos_apps:
+            if self.packages.results.get(app_name):
+                console.print(f"[green]✓[/green] {description} installed")
             else:
-                cmd = f"brew install {app_name}"
-            self.run_command(cmd, f"Installing {description}")
+                console.print(f"[red]✗[/red] {description} not installed")
+        return self.packages.succeeded("install_macos_apps")
+
+    @staticmethod
+    def git_commit_of(command: List[str]) -> Optional[str]:
+        """First word of a git command's output, such as the commit rev-parse or ls-remote prints"""
+        try:
+            result = subprocess.run(command, capture_output=True, text=True, stdin=subprocess.DEVNULL,
+                                    env={**os.environ, "GIT_TERMINAL_PROMPT": "0"}, timeout=PROBE_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        words = result.stdout.split()
+        return words[0] if result.returncode == 0 and words else None
+
+    def wallpapers_head(self) -> Optional[str]:
+        """Commit the wallpapers checkout should be at
+
+        A fetch leaves no file behind that the journal could watch, so the
+        remote is asked with `git ls-remote`, but like the package index at
+        most once per index_max_age: after a recent fetch the remote-tracking
+        branch answers, after a recent check the commit it saw. Offline, or
+        when the remote cannot be reached, the local ref stands in.
+        """
+        repo_url = self.answers.get("wallpapers_repo")
+        path = self.wallpapers_path
+        if not repo_url or not (path / ".git").exists():
+            return None
+        git = ["git", "-C", str(path)]
+        local = self.git_commit_of(git + ["rev-parse", "@{u}"]) or self.git_commit_of(git + ["rev-parse", "HEAD"])
+        
+        state_path = self.config_path / "wallpapers-remote.json"
+        try:
+            state = json.loads(state_path.read_text())
+        except (OSError, ValueError):
+            state = {}
+        fetched = file_mtime(path / ".git" / "FETCH_HEAD") or 0
+        checked = state.get("checked_ns", 0) if state.get("url") == repo_url else 0
+        if self.cache.offline or time.time_ns() - max(fetched, checked) < self.index_max_age * 1e9:
+            return state["head"] if checked > fetched else local
+        
+        remote = self.git_commit_of(["git", "ls-remote", repo_url, "HEAD"])
+        if remote is None:
+            return local
+        self.config_path.mkdir(parents=True, exist_ok=True)
+        tmp = state_path.with_name(state_path.name + ".tmp")
+        tmp.write_text(json.dumps({"url": repo_url, "head": remote, "checked_ns": time.time_ns()}) + "\n")
+        os.replace(tmp, state_path)
+        return remote
+
+    def sync_wallpapers(self, repo_url: str) -> bool:
+        """Clone or fast-forward the wallpapers checkout, downloading only what is missing
+
+        New checkouts are shallow and blob-filtered, so only the blobs of the
+        checked-out files are fetched, and with wallpapers_folders only those
+        folders are checked out. Git LFS smudging is deferred so LFS files can
+        be pulled for the same folders in one batch.
+        """
+        path = self.wallpapers_path
+        folders = list(self.wallpapers_folders)
+        env = {"GIT_LFS_SKIP_SMUDGE": "1"}
+        git = ["git", "-C", str(path)]
+        
+        if (path / ".git").exists():
+            origin = subprocess.run(git + ["remote", "get-url", "origin"], capture_output=True, text=True,
+                                    timeout=PROBE_TIMEOUT)
+            if origin.stdout.strip() != repo_url:
+                console.print(f"[yellow]⚠[/yellow] {path} tracks {origin.stdout.strip() or 'no remote'}, not {repo_url}; leaving it alone")
+                return False
+            # No --depth here: that would cut the history at the new tip and the fast-forward would fail
+            fetch = git + ["fetch", "--filter=blob:none", "origin"]
+            if not self.run_command(fetch, "Fetching wallpapers", env=env, command_class="network"):
+                return False
+            if not self.update_sparse_checkout(git, folders, env):
+                return False
+            if not self.run_command(git + ["merge", "--ff-only", "@{u}"], "Fast-forwarding wallpapers", env=env):
+                console.print(f"[yellow]⚠[/yellow] Local changes in {path} block the update, resolve them with git")
+                return False
+        else:
+            if path.exists() and any(path.iterdir()):
+                console.print(f"[yellow]⚠[/yellow] {path} is not empty and not a git checkout; leaving it alone")
+                return False
+            clone = ["git", "clone", "--depth", "1", "--filter=blob:none", "--no-checkout", repo_url, str(path)]
+            if not self.run_command(clone, "Cloning wallpapers repository", env=env, command_class="network"):
+                return False
+            if not self.update_sparse_checkout(git, folders, env):
+                return False
+            # Blobless: the checkout downloads the blobs it needs
+            if not self.run_command(git + ["checkout"], "Checking out wallpapers", env=env, command_class="network"):
+                return False
+        
+        return self.pull_lfs(git, folders)
+
+    def update_sparse_checkout(self, git: List[str], folders: List[str], env: Dict[str, str]) -> bool:
+        """Limit the working tree to the configured folders, or check out everything"""
+        if folders:
+            return self.run_command(git + ["sparse-checkout", "set", "--cone"] + folders,
+                                    f"Selecting wallpaper folders: {', '.join(folders)}", env=env)
+        sparse = subprocess.run(git + ["config", "--bool", "core.sparseCheckout"], capture_output=True, text=True,
+                                timeout=PROBE_TIMEOUT)
+        if sparse.stdout.strip() == "true":
+            return self.run_command(git + ["sparse-checkout", "disable"], "Selecting all wallpaper folders", env=env)
+        return True
+
+    def pull_lfs(self, git: List[str], folders: List[str]) -> bool:
+        """Download Git LFS files for the checked-out folders, when the repository uses LFS"""
+        attributes = self.wallpapers_path / ".gitattributes"
+        if not attributes.exists() or "filter=lfs" not in attributes.read_text(errors="replace"):
+            return True
+        if shutil.which("git-lfs") is None:
+            console.print("[yellow]⚠[/yellow] The wallpapers repository uses Git LFS; install git-lfs and run [bold]git lfs pull[/bold]")
+            return False
+        command = git + ["lfs", "pull"]
+        if folders:
+            command.append("--include=" + ",".join(f"{folder.rstrip('/')}/**" for folder in folders))
+        return self.run_command(command, "Downloading Git LFS wallpapers", command_class="network")
+
+    def wallpapers_sync(self, repo_url: Optional[str] = None) -> bool:
+        """Sync wallpapers outside of a full setup run"""
+        repo_url = repo_url or self.journal.answers("setup_wallpapers_sync").get("wallpapers_repo")
+        if not repo_url and (self.wallpapers_path / ".git").exists():
+            origin = subprocess.run(["git", "-C", str(self.wallpapers_path), "remote", "get-url", "origin"],
+                                    capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+            repo_url = origin.stdout.strip()
+        if not repo_url:
+            raise ValueError("No wallpapers repository configured, pass its URL")
+        
+        self.wallpapers_path.mkdir(parents=True, exist_ok=True)
+        if not self.sync_wallpapers(repo_url):
+            return False
+        console.print(f"[green]✓[/green] Wallpapers in {self.wallpapers_path} are up to date")
+        return True
 
     def setup_wallpapers_sync(self):
         """Setup wallpapers directory sync with GitHub"""
         console.print("\n[bold yellow]Wallpapers Directory Setup[/bold yellow]")
         
-        if Confirm.ask("Do you want to sync wallpapers with a GitHub repository?", default=False):
-            repo_url = Prompt.ask("Enter GitHub repository URL")
-            
-            if repo_url:
-                os.chdir(self.wallpapers_path.parent)
-                if self.run_command(f"git clone {repo_url} Wallpapers", "Cloning wallpapers repository"):
-                    console.print("[green]✓[/green] Wallpapers synced successfully")
-                else:
-                    console.print("[yellow]⚠[/yellow] You can manually clone later: [bold]git clone {repo_url}[/bold]")
+        repo_url = self.ask_wallpapers_repo()
+        if repo_url:
+            if self.sync_wallpapers(repo_url):
+                console.print("[green]✓[/green] Wallpapers synced successfully")
+            else:
+                console.print(f"[yellow]⚠[/yellow] You can sync later with: [bold]atriumos wallpapers sync {repo_url}[/bold]")
+                return False
         else:
             console.print(f"[cyan]ℹ[/cyan] Wallpapers directory created at: {self.wallpapers_path}")
+        return True
+
+    def list_org_repos(self, org: str, limit: int = 1000) -> List[RepoSpec]:
+        """Repositories of a GitHub organization or user, from `gh repo list`"""
+        result = subprocess.run(["gh", "repo", "list", org, "--limit", str(limit),
+                                 "--json", "nameWithOwner,url,isFork,parent"],
+                                capture_output=True, text=True, timeout=RETRY_POLICIES["network"].timeout)
+        if result.returncode != 0:
+            raise ValueError(f"gh repo list {org} failed: {result.stderr.strip()}")
+        
+        specs = []
+        for repo in json.loads(result.stdout):
+            # Forks share a store with their parent, named after the parent repository
+            parent = repo.get("parent") or {}
+            family = parent.get("name") if repo.get("isFork") and parent.get("name") else repo["nameWithOwner"].split("/")[-1]
+            specs.append(RepoSpec(repo["url"], repo["nameWithOwner"].split("/")[-1], family))
+        return unique_repo_names(specs)
+
+    def clone_repos(self, specs: List[RepoSpec], mode: str = "full", jobs: int = 8,
+                    retries: int = 2, store: Optional[Path] = None) -> bool:
+        """Clone repositories into ~/Repos on a bounded pool
+
+        In full mode, repositories of the same family are first fetched into
+        one bare store under store/<family>.git and then cloned with
+        --reference to it, so objects shared by forks are downloaded once.
+        Shallow and blobless modes skip the store and cut the download instead.
+        """
+        store = store or self.repos_path / ".objects"
+        self.repos_path.mkdir(parents=True, exist_ok=True)
+        pending = [spec for spec in specs if not (self.repos_path / spec.name / ".git").exists()]
+        for spec in specs:
+            if spec not in pending:
+                console.print(f"[green]✓[/green] {spec.name} already cloned")
+        
+        families = {}  # type: Dict[str, List[RepoSpec]]
+        for spec in pending:
+            families.setdefault(spec.family, []).append(spec)
+        references = {}  # type: Dict[str, Optional[Path]]
+        
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            if mode == "full":
+                # Stores only pay off when a family has more than one member; each store is filled by one worker
+                shared = {family: members for family, members in families.items() if len(members) > 1}
+                futures = {pool.submit(self._fill_store, store / f"{family}.git", members, retries): family
+                           for family, members in shared.items()}
+                for future in futures:
+                    references[futures[future]] = future.result()
+            
+            futures = {pool.submit(self._clone_repo, spec, mode, references.get(spec.family), retries): spec
+                       for spec in pending}
+            results = {futures[future].name: future.result() for future in futures}
+        
+        failed = [name for name, ok in results.items() if not ok]
+        if failed:
+            console.print(f"[red]✗[/red] {len(failed)} of {len(pending)} repositories failed: {', '.join(sorted(failed))}")
+        elif pending:
+            console.print(f"[green]✓[/green] Cloned {len(pending)} repositories into {self.repos_path}")
+        return not failed
+
+    def _retry(self, command: List[str], description: str, retries: int) -> bool:
+        """Run a git command under the network retry policy, with at most `retries` retries"""
+        result = self.execute(command, description, command_class="network", attempts=retries + 1)
+        if result.returncode == 0:
+            return True
+        console.print(f"[red]✗[/red] {description} - failed after {result.attempts} attempts:")
+        for line in result.tail[-5:]:
+            console.print(f"    {line}", markup=False)
+        return False
+
+    def _fill_store(self, path: Path, members: List[RepoSpec], retries: int) -> Optional[Path]:
+        """Fetch every member of a family into its bare object store"""
+        if not path.exists():
+            subprocess.run(["git", "init", "--quiet", "--bare", str(path)], check=True, timeout=PROBE_TIMEOUT)
+        # A member that fails to fetch here is simply downloaded in full by its own clone
+        for spec in members:
+            refspec = f"+refs/heads/*:refs/remotes/{spec.name}/*"
+            self._retry(["git", "-C", str(path), "fetch", "--quiet", spec.url, refspec],
+                        f"Fetching {spec.name} into the {path.stem} store", retries)
+        return path
+
+    def _clone_repo(self, spec: RepoSpec, mode: str, reference: Optional[Path], retries: int) -> bool:
+        """Clone one repository into ~/Repos"""
+        command = ["git", "clone", "--quiet"]
+        if mode == "shallow":
+            command += ["--depth", "1"]
+        elif mode == "blobless":
+            command += ["--filter=blob:none"]
+        if reference is not None:
+            command += ["--reference", str(reference)]
+        command += [spec.url, str(self.repos_path / spec.name)]
+        
+        if self._retry(command, f"Cloning {spec.name}", retries):
+            console.print(f"[green]✓[/green] Cloned {spec.name}")
+            return True
+        return False
+
+    def repos_status(self, as_json: bool = False, refresh: bool = False, jobs: int = 8):
+        """Show branch, upstream and changes of every checkout in ~/Repos"""
+        index = RepoIndex(self.config_path / "repos.json", self.repos_path, jobs)
+        repos = index.scan(refresh)
+        if as_json:
+            print(json.dumps([{"name": name, "path": str(self.repos_path / name), **entry}
+                              for name, entry in sorted(repos.items())], indent=2))
+            return
+        
+        rows = []
+        for name, entry in sorted(repos.items()):
+            if "error" in entry:
+                rows.append((name, "", "", f"[red]{entry['error']}[/red]"))
+                continue
+            sync = ""
+            if entry["upstream"]:
+                sync = " ".join(part for part in (
+                    f"↑{entry['ahead']}" if entry["ahead"] else "",
+                    f"↓{entry['behind']}" if entry["behind"] else "",
+                ) if part) or "[green]=[/green]"
+            changes = ", ".join(part for part in (
+                f"{entry['conflicts']} conflicts" if entry["conflicts"] else "",
+                f"{entry['changed']} changed" if entry["changed"] else "",
+                f"{entry['untracked']} untracked" if entry["untracked"] else "",
+            ) if part)
+            rows.append((name, entry["branch"] or (entry["head"] or "")[:8], sync, changes or "[green]clean[/green]"))
+        console.table(rows, columns=["Repository", "Branch", "Upstream", "Changes"], title=f"{self.repos_path}")
+
+    def repos_clone(self, manifest: Optional[Path] = None, org: Optional[str] = None, limit: int = 1000,
+                    mode: str = "full", jobs: int = 8, retries: int = 2, store: Optional[Path] = None) -> bool:
+        """Clone the repositories listed in a manifest or owned by a GitHub org"""
+        specs = load_repo_manifest(manifest) if manifest else []
+        if org:
+            specs = unique_repo_names(specs + self.list_org_repos(org, limit))
+        if not specs:
+            raise ValueError("No repositories to clone, pass a manifest or --org")
+        return self.clone_repos(specs, mode, jobs, retries, store)
+
+    # Step states in a target's plain output, as PlainConsole writes them
+    FLEET_STEP_LINE = re.compile(r"^\[\s*[\d.]+s\] (\S+): (running|done|failed|skipped)$|^✓ (\S+) is up to date$")
+
+    def fleet_command(self, target: FleetTarget, script: Path) -> Tuple[List[str], Optional[Path], Optional[Dict[str, str]]]:
+        """Command that provisions a target, the file to feed it on stdin and its environment
+
+        Home targets run this script directly. Rootfs and command targets run
+        `python3 -` inside the target and get the script on stdin, so nothing
+        has to be installed there first.
+        """
+        import shlex
+        
+        options = ["--yes", "--plain"] + (["--home", target.home] if target.home else []) + list(target.args)
+        if target.kind == "home":
+            home = str(Path(target.home).expanduser())
+            options[options.index("--home") + 1] = home
+            # Homes on this machine share its download cache
+            if "--cache-dir" not in target.args:
+                options += ["--cache-dir", str(self.cache.root)]
+            return [sys.executable, str(script)] + options, None, {"HOME": home}
+        
+        remote = ["python3", "-"] + options
+        if target.kind == "rootfs":
+            # The password, if any, was asked for before the targets started
+            return (["sudo", "-n"] if self.sudo() else []) + ["chroot", target.rootfs] + remote, script, None
+        prefix = shlex.split(target.command)
+        if Path(prefix[0]).name == "ssh":
+            # ssh hands the remote shell a single string
+            remote = [" ".join(shlex.quote(arg) for arg in remote)]
+        return prefix + remote, script, None
+
+    def provision_target(self, target: FleetTarget, script: Path) -> dict:
+        """Run atriumos on one fleet target and summarize the outcome of its steps"""
+        self._current.step = target.name
+        console.step_update(target.name, "running")
+        log_path = self.step_log()
+        if log_path.exists():
+            log_path.unlink()
+        
+        command, stdin, env = self.fleet_command(target, script)
+        start = time.perf_counter()
+        try:
+            result = self.execute(command, f"Provisioning {target.name}", env=env, keep=self.FLEET_STEP_LINE,
+                                  command_class="target", stdin=stdin, echo=False)
+            returncode, timed_out, error = result.returncode, result.timed_out, None
+        except CommandCancelled:
+            console.step_update(target.name, "failed")
+            raise
+        except OSError as e:
+            result, returncode, timed_out, error = None, None, False, f"cannot run {command[0]}: {e.strerror or e}"
+        except Exception as e:
+            result, returncode, timed_out, error = None, None, False, str(e)
+        wall = time.perf_counter() - start
+        
+        steps = {}  # type: Dict[str, str]
+        for line in result.matches if result else []:
+            match = self.FLEET_STEP_LINE.match(line)
+            if match.group(3):
+                steps[match.group(3)] = "up to date"
+            else:
+                steps[match.group(1)] = match.group(2)
+        failed = sorted(name for name, state in steps.items() if state in ("failed", "running"))
+        ok = returncode == 0 and not failed
+        console.step_update(target.name, "done" if ok else "failed")
+        
+        counts = {}  # type: Dict[str, int]
+        for state in steps.values():
+            counts[state] = counts.get(state, 0) + 1
+        return {
+            "name": target.name,
+            "kind": target.kind,
+            "ok": ok,
+            "exit_code": returncode,
+            "timed_out": timed_out,
+            "error": error,
+            "wall_s": round(wall, 3),
+            "steps": counts,
+            "failed_steps": failed,
+            "log": str(log_path),
+        }
+
+    def fleet(self, manifest: Path, jobs: int = 4) -> bool:
+        """Provision every target of a fleet manifest concurrently, one atriumos process per target
+
+        Targets run unattended (--yes --plain). Each one writes its output to
+        TARGET.log in the log directory, and the aggregate report goes to
+        report.json next to them.
+        """
+        targets = load_fleet_manifest(manifest)
+        script = Path(__file__).resolve()
+        if not script.is_file():
+            raise ValueError("Fleet mode feeds atriumos.py to its targets, so it has to run from a file")
+        self.log_dir = self.log_dir or self.config_path / "fleet"
+        
+        # Targets on this machine run `sudo -n` for packages and chroot, so they rely on cached credentials
+        done = threading.Event()
+        if not self.assume_yes and self.sudo() and any(target.kind in ("home", "rootfs") for target in targets):
+            console.print("[cyan]ℹ[/cyan] Targets on this machine need administrator access")
+            subprocess.run(["sudo", "-v"], check=False)
+            
+            def keep_sudo_alive():
+                while not done.wait(60):
+                    subprocess.run(["sudo", "-n", "-v"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            threading.Thread(target=keep_sudo_alive, daemon=True).start()
+        
+        console.print(f"[cyan]ℹ[/cyan] Provisioning {len(targets)} target(s), {max(1, jobs)} at a time, "
+                      f"logs in {self.log_dir}")
+        try:
+            with console.dashboard([target.name for target in targets]), \
+                    ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+                reports = list(pool.map(lambda target: self.provision_target(target, script), targets))
+        finally:
+            done.set()
+        
+        rows = []
+        for report in reports:
+            if report["ok"]:
+                result = "[green]ok[/green]"
+            elif report["error"]:
+                result = f"[red]{report['error']}[/red]"
+            elif report["timed_out"]:
+                result = "[red]timed out[/red]"
+            elif report["failed_steps"]:
+                result = f"[red]failed: {', '.join(report['failed_steps'])}[/red]"
+            else:
+                result = f"[red]exit {report['exit_code']}[/red]"
+            steps = ", ".join(f"{count} {state}" for state, count in sorted(report["steps"].items()))
+            rows.append((report["name"], report["kind"], result, f"{report['wall_s']:.1f}s", steps or "-"))
+        console.table(rows, columns=["Target", "Kind", "Result", "Wall", "Steps"], title="Fleet Report")
+        
+        report_path = self.log_dir / "report.json"
+        report_path.write_text(json.dumps({"manifest": str(manifest), "targets": reports}, indent=2) + "\n")
+        failed = [report["name"] for report in reports if not report["ok"]]
+        if failed:
+            console.print(f"[red]✗[/red] {len(failed)} of {len(reports)} targets failed: {', '.join(failed)}")
+        else:
+            console.print(f"[green]✓[/green] Provisioned {len(reports)} targets")
+        console.print(f"    Report: {report_path}", markup=False)
+        return not failed
 
-    def show_completion(self):
+    def show_completion(self, results: Dict[str, bool]):
         """Show completion message"""
         completion_msg = """
 [bold green]🎉 atriumOS Setup Complete! 🎉[/bold green]
@@ -428,12 +3923,18 @@ class AtriumOS:
   ✓ oh-my-posh with custom theme
   ✓ ~/Repos directory created
   ✓ ~/Wallpapers directory created
-        """
+"""
         
         if self.system == "Darwin":
             completion_msg += "  ✓ Homebrew installed\n"
             completion_msg += "  ✓ Telegram Desktop installed\n"
             completion_msg += "  ✓ Google Chrome (Dev) installed\n"
+        for name, version in self.toolchains.items():
+            label = f"{name} {version}" if version else name
+            if results.get(f"toolchain_{name}"):
+                completion_msg += f"  ✓ {label} toolchain installed\n"
+            else:
+                completion_msg += f"  [red]✗[/red] {label} toolchain failed\n"
         
         completion_msg += """
 [cyan]Next steps:[/cyan]
@@ -445,52 +3946,512 @@ class AtriumOS:
 [dim]Made with ❤️  by atriumOS[/dim]
         """
         
-        console.print(Panel(completion_msg, border_style="green", padding=(1, 2)))
-
-    def run(self):
-        """Main setup flow"""
-        self.show_banner()
-        self.detect_system()
+        console.panel(completion_msg, style="green")
         
-        if not Confirm.ask("\n[bold cyan]Ready to start setup?[/bold cyan]", default=True):
-            console.print("[yellow]Setup cancelled.[/yellow]")
-            return
+        rows = self.tracer.summary_rows()
+        if rows:
+            console.table(rows, columns=["Step", "Wall", "CPU", "Downloaded", "Commands"], title="Step Timings")
+
+    def build_steps(self) -> List[Step]:
+        """Describe the setup steps for this OS and what each one depends on"""
+        packages = ("install_packages",)
+        steps = [
+            Step("install_packages", self.install_packages, ("install_homebrew", "setup_github_cli_source")),
+            Step("install_github_cli", self.install_github_cli, after=packages),
+            Step("setup_github_auth", self.setup_github_auth, ("install_github_cli",), interactive=True,
+                 prompts=("github_auth",)),
+            Step("install_oh_my_posh", self.install_oh_my_posh, after=packages if self.system != "Linux" else ()),
+            Step("setup_oh_my_posh_theme", self.setup_oh_my_posh_theme, ("install_oh_my_posh",)),
+            Step("create_directories", self.create_directories),
+            Step("setup_wallpapers_sync", self.setup_wallpapers_sync, ("create_directories",),
+                 prompts=("wallpapers_repo",)),
+        ]
         
-        # Install Homebrew (macOS only)
         if self.system == "Darwin":
-            self.install_homebrew()
+            steps.insert(0, Step("install_homebrew", self.install_homebrew))
+            steps.append(Step("install_macos_apps", self.install_macos_apps, after=packages))
+        elif self.system == "Linux":
+            steps.insert(0, Step("setup_github_cli_source", self.setup_github_cli_source))
+        
+        # One step per toolchain, so the scheduler downloads and unpacks them in parallel
+        for name in self.toolchains:
+            steps.append(Step(f"toolchain_{name}", lambda name=name: self.install_toolchain(name),
+                              after=packages if TOOLCHAINS[name].packages else ()))
+        return steps
+
+    def step_inputs(self, name: str) -> dict:
+        """Everything the outcome of a step depends on, for the state journal"""
+        theme_path = self.config_path / "atriumos-theme.json"
+        shell_configs = [self.home / ".zshrc", self.home / ".bashrc"]
+        inputs = {
+            "install_homebrew": lambda: {"brew": self.inventory.version("brew")},
+            "setup_github_cli_source": lambda: {
+                "manager": self.linux_package_manager() if self.system == "Linux" else None,
+                "files": {str(path): file_mtime(path) for path in (GH_APT_KEYRING, GH_APT_SOURCE, GH_DNF_REPO)},
+            },
+            "install_packages": lambda: {
+                "macos_apps": self.macos_apps,
+                "gh": self.inventory.version("gh"),
+                "oh-my-posh": self.inventory.version("oh-my-posh"),
+            },
+            "install_github_cli": lambda: {"gh": self.inventory.version("gh")},
+            "setup_github_auth": lambda: {
+                "answer": self.answers.get("github_auth"),
+                "hosts": file_mtime(self.home / ".config" / "gh" / "hosts.yml"),
+            },
+            "install_oh_my_posh": lambda: {"oh-my-posh": self.inventory.version("oh-my-posh")},
+            "setup_oh_my_posh_theme": lambda: {
+                "theme": self.theme_hash(),
+                "oh-my-posh": self.inventory.version("oh-my-posh"),
+                "shell": os.environ.get("SHELL", ""),
+                "files": {
+                    str(path): file_mtime(path)
+                    for path in [theme_path] + shell_configs + [self.config_path / "init.zsh", self.config_path / "init.bash"]
+                },
+            },
+            "create_directories": lambda: {
+                str(path): path.is_dir() for path in (self.repos_path, self.wallpapers_path)
+            },
+            "install_macos_apps": lambda: {"macos_apps": self.macos_apps},
+            "setup_wallpapers_sync": lambda: {
+                "repo": self.answers.get("wallpapers_repo"),
+                "folders": list(self.wallpapers_folders),
+                "head": self.wallpapers_head(),
+            },
+        }
+        if name.startswith("toolchain_"):
+            toolchain = name[len("toolchain_"):]
+            if TOOLCHAINS[toolchain].packages:
+                return {toolchain: self.inventory.version(toolchain)}
+            links = {binary: os.readlink(self.bin_path / binary) if (self.bin_path / binary).is_symlink() else None
+                     for binary in TOOLCHAINS[toolchain].binaries}
+            return {"version": self.toolchains[toolchain], "marker": self.toolchain_marker(toolchain), "links": links}
+        return inputs[name]()
+
+    def journaled(self, step: Step) -> Step:
+        """Wrap a step so a successful run is recorded in the state journal"""
+        def action():
+            self._current.step = step.name
+            timeout = self.step_timeouts.get(step.name, self.step_timeouts.get("*"))
+            self._current.deadline = time.monotonic() + timeout if timeout else None
+            console.step_update(step.name, "running")
+            try:
+                with console.suspended() if step.interactive else nullcontext(), \
+                        self.tracer.span(step.name, "step") as trace:
+                    result = step.action()
+                    trace["result"] = result is not False
+            except Exception:
+                console.step_update(step.name, "failed")
+                raise
+            console.step_update(step.name, "failed" if result is False else "done")
+            if result is not False:
+                answers = {key: self.answers[key] for key in step.prompts if key in self.answers}
+                self.journal.record(step.name, self.step_inputs(step.name), answers)
+            return result
+        return Step(step.name, action, step.requires, step.interactive, step.prompts, step.after)
+
+    def forced(self, name: str) -> bool:
+        """Whether --force asked for a step to run regardless of the journal"""
+        return "all" in self.force or name in self.force
+
+    def pending_steps(self, steps: List[Step]) -> Tuple[List[Step], List[Step]]:
+        """Split steps into those that drifted since the last run and those that are up to date
+
+        Call plan_packages first, so the steps that own packages are known.
+        """
+        names = {step.name for step in steps}
+        unknown = self.force - names - {"all"}
+        if unknown:
+            raise ValueError(f"Unknown step(s) for --force: {', '.join(sorted(unknown))} "
+                             f"(choose from {', '.join(sorted(names))})")
+        unknown = set(self.step_timeouts) - names - {"*"}
+        if unknown:
+            raise ValueError(f"Unknown step(s) for --step-timeout: {', '.join(sorted(unknown))} "
+                             f"(choose from {', '.join(sorted(names))})")
         
-        # Install GitHub CLI
-        self.install_github_cli()
+        pending, current = [], []
+        for step in steps:
+            # The journal entry is only dropped once the step actually runs, so a plan stays read-only
+            if self.forced(step.name):
+                pending.append(step)
+                continue
+            for key, answer in self.journal.answers(step.name).items():
+                self.answers.setdefault(key, answer)
+            if self.journal.matches(step.name, self.step_inputs(step.name)):
+                current.append(step)
+            else:
+                pending.append(step)
         
-        # GitHub Authentication
-        self.setup_github_auth()
+        # A step that owns packages can only report on them if install_packages runs in the same session
+        if any(step.name in self.packages.owners() for step in pending):
+            pending = [step for step in steps if step in pending or step.name == "install_packages"]
+            current = [step for step in current if step.name != "install_packages"]
+        return pending, current
+
+    # Machine-specific or rebuildable parts of the config directory that a snapshot leaves out
+    SNAPSHOT_EXCLUDE = {"cache", "inventory.json", "plan.json", "repos.json", "wallpapers-remote.json"}
+
+    def bake(self, output: Path):
+        """Capture what atriumOS set up in this home directory into a snapshot archive"""
+        paths = [
+            path for path in sorted(self.config_path.iterdir())
+            if path.name not in self.SNAPSHOT_EXCLUDE and not path.name.endswith(".tmp")
+        ] if self.config_path.is_dir() else []
+        paths += [Path(path) for path in sorted(self.journal.files)]
         
-        # Install oh-my-posh
-        self.install_oh_my_posh()
+        rc_blocks = {}
+        for rc_file in (self.home / ".zshrc", self.home / ".bashrc"):
+            if rc_file.exists():
+                blocks = managed_blocks(rc_file.read_text())
+                if blocks:
+                    rc_blocks[rc_file.name] = blocks
         
-        # Setup oh-my-posh theme
-        self.setup_oh_my_posh_theme()
+        directories = [self.repos_path, self.wallpapers_path, self.bin_path]
+        with console.status("Baking snapshot"):
+            stats = Snapshot(self.home).bake(output, paths, directories, rc_blocks)
+        console.print(f"[green]✓[/green] Snapshot written to {output}: {stats['entries']} entries, "
+                      f"{stats['blobs']} unique files, {stats['bytes'] / 1024 / 1024:.1f} MB")
+
+    def restore(self, archive: Path):
+        """Replay a snapshot archive into this home directory"""
+        with console.status("Restoring snapshot"):
+            stats = Snapshot(self.home).restore(archive)
+        console.print(f"[green]✓[/green] Restored {archive} into {self.home}: {stats['written']} files written, "
+                      f"{stats['unchanged']} already up to date, {stats['rc_blocks']} rc-file blocks")
+        console.print("[cyan]ℹ[/cyan] Run atriumos to install the system packages a snapshot does not carry")
+
+    PLAN_VERSION = 1
+
+    def probe(self) -> dict:
+        """Detect everything a run depends on, concurrently"""
+        rc_files = [self.home / ".zshrc", self.home / ".bashrc"]
         
-        # Create directories
-        self.create_directories()
+        def rc_state(path: Path) -> dict:
+            try:
+                text = path.read_text()
+            except OSError:
+                return {"exists": False}
+            return {"exists": True, "managed_blocks": re.findall(r"^# >>> atriumOS (.+) >>>$", text, re.MULTILINE)}
         
-        # Install macOS apps
-        if self.system == "Darwin":
-            self.install_macos_apps()
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            tools = pool.submit(self.inventory.refresh)
+            manager = pool.submit(self.linux_package_manager) if self.system == "Linux" else None
+            rc = {str(path): pool.submit(rc_state, path) for path in rc_files}
+            directories = {str(path): pool.submit(path.is_dir)
+                           for path in (self.config_path, self.repos_path, self.wallpapers_path)}
+            tools.result()
+            manager = manager.result() if manager else None
+            return {
+                "system": self.system,
+                "machine": platform.machine(),
+                "home": str(self.home),
+                "shell": self.detect_shell(),
+                "linux_package_manager": manager,
+                "package_index_age": package_index_age(manager) if manager else None,
+                "tools": self.inventory.tools,
+                "rc_files": {path: future.result() for path, future in rc.items()},
+                "directories": {path: future.result() for path, future in directories.items()},
+            }
+
+    def make_plan(self) -> dict:
+        """Decide what a run has to do, asking the questions of the steps it will run"""
+        facts = self.probe()
+        steps = self.build_steps()
+        self.plan_packages()
+        pending, current = self.pending_steps(steps)
+        self.collect_prompts(pending)
+        
+        names = {step.name for step in pending}
+        return {
+            "version": self.PLAN_VERSION,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": platform.node(),
+            "facts": facts,
+            "answers": dict(self.answers),
+            "toolchains": dict(self.toolchains),
+            "packages": self.packages.to_json(),
+            "steps": [
+                {
+                    "name": step.name,
+                    "action": "run" if step.name in names else "skip",
+                    "requires": list(step.requires),
+                    "after": list(step.after),
+                    "forced": self.forced(step.name),
+                    "fingerprint": StateJournal.fingerprint(self.step_inputs(step.name)),
+                }
+                for step in steps
+            ],
+        }
+
+    def show_plan(self, plan: dict):
+        """Print the steps and packages of a plan"""
+        rows = [(step["name"], "[cyan]run[/cyan]" if step["action"] == "run" else "[green]up to date[/green]")
+                for step in plan["steps"]]
+        console.table(rows, columns=["Step", "Action"], title="Plan")
+        for manager, packages in plan["packages"].items():
+            console.print(f"[cyan]→[/cyan] {manager}: {', '.join(package for package, _, _ in packages)}")
+
+    def plan(self, output: Optional[Path] = None) -> dict:
+        """Write the plan of a run to a file, and cache it in the config directory"""
+        plan = self.make_plan()
+        data = json.dumps(plan, indent=2, sort_keys=True) + "\n"
+        self.config_path.mkdir(parents=True, exist_ok=True)
+        for path in [self.config_path / "plan.json"] + ([output] if output else []):
+            tmp = path.with_name(path.name + ".tmp")
+            tmp.write_text(data)
+            os.replace(tmp, path)
+        self.show_plan(plan)
+        console.print(f"[green]✓[/green] Plan written to {output or self.config_path / 'plan.json'}")
+        return plan
+
+    def apply(self, plan: dict) -> bool:
+        """Run the steps of a plan, trusting its detection results instead of probing again"""
+        if plan.get("version") != self.PLAN_VERSION:
+            raise ValueError(f"Unsupported plan version {plan.get('version')}, make a new plan")
+        facts = plan["facts"]
+        if facts["system"] != self.system or facts["home"] != str(self.home):
+            raise ValueError(f"The plan was made for {facts['system']} with home {facts['home']}, "
+                             f"not {self.system} with home {self.home}")
+        
+        self.inventory.load(facts["tools"])
+        self._linux_manager = facts.get("linux_package_manager") or ""
+        self.answers.update(plan["answers"])
+        self.toolchains = dict(plan.get("toolchains", self.toolchains))
+        self.packages.load(plan["packages"])
+        self.force |= {step["name"] for step in plan["steps"] if step.get("forced")}
+        
+        steps = {step.name: step for step in self.build_steps()}
+        planned = [step["name"] for step in plan["steps"]]
+        if set(planned) != set(steps):
+            raise ValueError("The plan's steps do not match this version of atriumOS, make a new plan")
+        pending = [steps[step["name"]] for step in plan["steps"] if step["action"] == "run"]
+        current = [steps[step["name"]] for step in plan["steps"] if step["action"] != "run"]
+        if not pending:
+            console.print("[green]✓[/green] Nothing to do, the plan has no steps to run")
+            return True
         
-        # Setup wallpapers sync
-        self.setup_wallpapers_sync()
+        self.authenticate(pending)
+        return self.run_steps(pending, current)
+
+    def run_steps(self, pending: List[Step], current: List[Step]) -> bool:
+        """Run the pending steps on the scheduler, show the summary and return whether all succeeded"""
+        # A forced step that fails must not look up to date on the next run
+        for step in pending:
+            if self.forced(step.name):
+                self.journal.forget(step.name)
+        # Up-to-date steps stay in the graph so their dependents can start
+        graph = [self.journaled(step) for step in pending]
+        graph += [Step(step.name, lambda: True, step.requires, after=step.after) for step in current]
+        with console.dashboard([step.name for step in pending], done=[step.name for step in current]):
+            results = StepScheduler(graph, max_workers=self.jobs).run()
         
         # Show completion
-        self.show_completion()
+        self.show_completion(results)
+        return all(results.values())
+
+    def run(self) -> bool:
+        """Main setup flow, returning whether every step succeeded"""
+        self.show_banner()
+        self.detect_system()
+        self.probe()
+        
+        steps = self.build_steps()
+        self.plan_packages()
+        pending, current = self.pending_steps(steps)
+        for step in current:
+            console.print(f"[green]✓[/green] {step.name} is up to date")
+        if not pending:
+            console.print("\n[green]✓[/green] Everything is up to date")
+            return True
+        
+        if not self.assume_yes and not console.confirm("\n[bold cyan]Ready to start setup?[/bold cyan]", default=True):
+            console.print("[yellow]Setup cancelled.[/yellow]")
+            return True
+        
+        self.collect_prompts(pending)
+        self.authenticate(pending)
+        return self.run_steps(pending, current)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(prog="atriumos", description="Universal Development Environment Setup")
+    parser.add_argument("-j", "--jobs", type=int, default=4,
+                        help="maximum number of setup steps to run in parallel (default: 4)")
+    parser.add_argument("--cache-dir", type=Path, default=os.environ.get("ATRIUMOS_CACHE_DIR"),
+                        help="download cache directory, can be shared between machines "
+                             "(default: ~/.config/atriumos/cache)")
+    parser.add_argument("--offline", action="store_true",
+                        help="only use installers that are already in the download cache")
+    parser.add_argument("--inventory", action="store_true",
+                        help="show installed tools and their versions, then exit")
+    parser.add_argument("-y", "--yes", action="store_true",
+                        help="run without asking questions (GitHub login and wallpaper sync are skipped)")
+    parser.add_argument("--log-format", choices=["plain", "json"], default="plain",
+                        help="output without the dashboard: plain text (used when not on a terminal) "
+                             "or json, one object per line")
+    parser.add_argument("--refresh-rate", type=float, default=4.0, metavar="HZ",
+                        help="redraws per second of the progress dashboard (default: 4)")
+    parser.add_argument("--plain", action="store_true",
+                        help="plain text output without colors, spinners or the rich library")
+    parser.add_argument("--log-dir", type=Path,
+                        help="write the full output of every step to STEP.log in this directory")
+    parser.add_argument("--trace", type=Path, metavar="FILE",
+                        help="write step and command timings as a Chrome trace-event JSON file")
+    parser.add_argument("--force", action="append", metavar="STEP", default=[],
+                        help="run a step even if it is up to date, may be repeated ('all' for every step)")
+    
+    parser.add_argument("--home", type=Path, metavar="DIR",
+                        help="home directory to set up instead of yours, e.g. for restore or testing")
+    parser.add_argument("--index-max-age", type=float, default=6.0, metavar="HOURS",
+                        help="reuse apt/dnf/pacman package lists younger than this (default: 6, 0 always refreshes)")
+    parser.add_argument("--wallpapers-folder", action="append", metavar="FOLDER", default=[],
+                        help="only check out this folder of the wallpapers repository, may be repeated")
+    parser.add_argument("--timeout", action="append", metavar="[CLASS=]SECONDS", default=[],
+                        help="time limit per command attempt, for every class or one of "
+                             f"{', '.join(RETRY_POLICIES)} (0 for none), may be repeated")
+    parser.add_argument("--attempts", action="append", metavar="[CLASS=]N", default=[],
+                        help="attempts per command before giving up, for every class or one, may be repeated")
+    parser.add_argument("--toolchain", action="append", metavar="NAME[@VERSION]", default=[],
+                        help=f"also install a language toolchain ({', '.join(TOOLCHAINS)}) into your home, "
+                             "at its pinned version unless one is given, may be repeated")
+    parser.add_argument("--step-timeout", action="append", metavar="[STEP=]SECONDS", default=[],
+                        help="stop the commands of a step that runs longer than this, may be repeated")
+    
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    bench_shell = commands.add_parser("bench-shell", help="measure shell startup time with the oh-my-posh prompt")
+    bench_shell.add_argument("--shell", choices=["zsh", "bash"], help="shell to measure (default: your login shell)")
+    bench_shell.add_argument("-n", "--runs", type=int, default=10, help="runs per variant (default: 10)")
+    
+    bake = commands.add_parser("bake", help="snapshot what atriumOS set up in your home directory")
+    bake.add_argument("output", type=Path, nargs="?", default=Path("atriumos-snapshot.tar.gz"),
+                      help="archive to write, .tar.gz or .tar.xz (default: atriumos-snapshot.tar.gz)")
+    restore = commands.add_parser("restore", help="replay a snapshot into your home directory")
+    restore.add_argument("archive", type=Path, help="archive written by bake")
+    
+    plan = commands.add_parser("plan", help="detect what setup would do and write it to a plan file")
+    plan.add_argument("-o", "--output", type=Path, help="plan file (always cached in ~/.config/atriumos/plan.json)")
+    apply = commands.add_parser("apply", help="run the steps of a plan without detecting again")
+    apply.add_argument("plan_file", nargs="?", type=Path, metavar="PLAN",
+                       help="plan file (default: ~/.config/atriumos/plan.json)")
+    
+    theme = commands.add_parser("theme", help="profile or trim the oh-my-posh prompt")
+    theme_commands = theme.add_subparsers(dest="theme_command", metavar="ACTION")
+    theme_commands.required = True
+    profile = theme_commands.add_parser("profile", help="measure the render cost of each prompt segment")
+    profile.add_argument("-n", "--runs", type=int, default=5, help="renders to measure (default: 5)")
+    profile.add_argument("--cwd", type=Path, help="directory to render the prompt in, e.g. a large repo (default: current)")
+    profile.add_argument("--omp", metavar="PATH", help="oh-my-posh binary to use (default: the one on PATH)")
+    profile.add_argument("--lean", action="store_true", help="save a theme that drops or reconfigures segments over the budget")
+    profile.add_argument("--budget", type=float, default=50.0, metavar="MS",
+                         help="target prompt render time for --lean (default: 50)")
+    theme_commands.add_parser("reset", help="go back to the full theme after --lean")
+    
+    wallpapers = commands.add_parser("wallpapers", help="manage the wallpapers checkout")
+    wallpapers_commands = wallpapers.add_subparsers(dest="wallpapers_command", metavar="ACTION")
+    wallpapers_commands.required = True
+    sync = wallpapers_commands.add_parser("sync", help="fetch and fast-forward ~/Wallpapers, cloning it if needed")
+    sync.add_argument("url", nargs="?", help="repository URL (default: the one chosen during setup)")
+    
+    repos = commands.add_parser("repos", help="manage the checkouts in ~/Repos")
+    repos_commands = repos.add_subparsers(dest="repos_command", metavar="ACTION")
+    repos_commands.required = True
+    clone = repos_commands.add_parser("clone", help="clone many repositories into ~/Repos concurrently")
+    clone.add_argument("manifest", nargs="?", type=Path,
+                       help="JSON list or text file of repository URLs, one per line")
+    clone.add_argument("--org", help="also clone the repositories of this GitHub org or user (uses gh)")
+    clone.add_argument("--limit", type=int, default=1000, help="maximum repositories from --org (default: 1000)")
+    clone.add_argument("--mode", choices=["full", "shallow", "blobless"], default="full",
+                       help="full history, --depth 1, or --filter=blob:none (default: full)")
+    clone.add_argument("--jobs", dest="repo_jobs", type=int, default=8, help="concurrent clones (default: 8)")
+    clone.add_argument("--retries", type=int, default=2, help="retries per repository (default: 2)")
+    clone.add_argument("--store", type=Path,
+                       help="shared object store for full clones (default: ~/Repos/.objects)")
+    status = repos_commands.add_parser("status", help="show what is dirty, ahead or behind in ~/Repos")
+    status.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    status.add_argument("--refresh", action="store_true", help="query every repository, not just changed ones")
+    status.add_argument("--jobs", dest="repo_jobs", type=int, default=8, help="concurrent git queries (default: 8)")
+    
+    fleet = commands.add_parser("fleet", help="provision many homes, container roots or machines from a manifest")
+    fleet.add_argument("manifest", type=Path, help="YAML or JSON list of targets")
+    fleet.add_argument("--jobs", dest="fleet_jobs", type=int, default=4, help="targets provisioned at once (default: 4)")
+    return parser.parse_args(argv)
 
 
-def main():
+def main(argv: Optional[List[str]] = None):
     """Entry point"""
+    args = parse_args(argv)
+    console.configure(args.plain, args.log_format, args.refresh_rate)
     try:
-        atrium = AtriumOS()
-        atrium.run()
+        atrium = AtriumOS(jobs=args.jobs, cache_dir=args.cache_dir, offline=args.offline, force=args.force,
+                          log_dir=args.log_dir, assume_yes=args.yes,
+                          wallpapers_folders=args.wallpapers_folder, index_max_age=args.index_max_age * 3600, home=args.home,
+                          timeouts=parse_overrides(args.timeout, float), attempts=parse_overrides(args.attempts, int),
+                          step_timeouts=parse_overrides(args.step_timeout, float), toolchains=args.toolchain)
+        signal.signal(signal.SIGINT, atrium.interrupt)
+        signal.signal(signal.SIGTERM, atrium.interrupt)
+        if args.inventory:
+            atrium.show_inventory()
+            return
+        if args.command == "bake":
+            atrium.bake(args.output)
+            return
+        if args.command == "restore":
+            atrium.restore(args.archive)
+            return
+        if args.command == "plan":
+            atrium.plan(args.output)
+            return
+        if args.command == "apply":
+            plan_file = args.plan_file or atrium.config_path / "plan.json"
+            try:
+                plan = json.loads(plan_file.read_text())
+            except (OSError, ValueError) as e:
+                raise ValueError(f"Cannot read plan {plan_file}: {e}")
+            try:
+                ok = atrium.apply(plan)
+            finally:
+                if args.trace:
+                    atrium.tracer.write(args.trace)
+            if not ok:
+                sys.exit(1)
+            return
+        if args.command == "bench-shell":
+            atrium.bench_shell(args.shell, args.runs)
+            return
+        if args.command == "theme":
+            if args.theme_command == "profile":
+                atrium.theme_profile(args.runs, args.cwd, args.omp, args.lean, args.budget)
+            else:
+                atrium.theme_reset()
+            return
+        if args.command == "repos":
+            if args.repos_command == "status":
+                atrium.repos_status(args.json, args.refresh, args.repo_jobs)
+            elif not atrium.repos_clone(args.manifest, args.org, args.limit, args.mode,
+                                        args.repo_jobs, args.retries, args.store):
+                sys.exit(1)
+            return
+        if args.command == "fleet":
+            try:
+                ok = atrium.fleet(args.manifest, args.fleet_jobs)
+            finally:
+                if args.trace:
+                    atrium.tracer.write(args.trace)
+            if not ok:
+                sys.exit(1)
+            return
+        if args.command == "wallpapers":
+            if not atrium.wallpapers_sync(args.url):
+                sys.exit(1)
+            return
+        try:
+            ok = atrium.run()
+        finally:
+            if args.trace:
+                atrium.tracer.write(args.trace)
+        if not ok:
+            sys.exit(1)
     except KeyboardInterrupt:
         console.print("\n[yellow]Setup interrupted by user.[/yellow]")
         sys.exit(1)
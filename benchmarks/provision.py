@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+atriumOS provisioning benchmark
+Runs the full setup non-interactively against a temporary HOME, with stub
+brew, apt, gh, oh-my-posh, git and curl executables on PATH, and reports
+wall time, subprocess count and peak RSS. The apt-get stub fails when another
+apt-get stub is running, as dpkg's lock does. Nothing on the real system is
+touched and no network access is needed, so scheduling, batching and caching
+changes can be compared on any Linux box.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import atriumos  # noqa: E402
+
+RESULTS_PATH = REPO_ROOT / ".benchmarks" / "provision.jsonl"
+
+# Package managers and tools present before the run
+MANAGERS = ["brew", "apt", "apt-get", "git", "curl", "sudo", "dpkg", "tee", "install", "chmod"]
+
+# Tools that only appear once a package manager or installer has "installed" them
+INSTALLABLE = {
+    "gh": 'echo "gh version 2.50.0 (2024-05-29)"',
+    "oh-my-posh": 'echo "19.0.0"',
+}
+
+# Extra behaviour of a stub after its latency and failure roll
+BEHAVIOUR = {
+    # Installing packages copies the matching stubs onto PATH
+    "apt-get": 'for pkg in "$@"; do [ -f "{templates}/$pkg" ] && cp "{templates}/$pkg" "{bin}/$pkg"; done',
+    "brew": 'for pkg in "$@"; do pkg="${{pkg##*/}}"; [ -f "{templates}/$pkg" ] && cp "{templates}/$pkg" "{bin}/$pkg"; done',
+    "apt": 'echo "apt 2.6.1 (amd64)"',
+    "git": 'echo "git version 2.40.0"',
+    "dpkg": "echo amd64",
+    # sudo runs the real command, which is a stub too
+    "sudo": 'while [ "${{1#-}}" != "$1" ]; do shift; done; exec "$@"',
+    # Privileged file writes are swallowed
+    "tee": "cat > /dev/null",
+}
+
+# Stubs that hold a machine-wide lock while they run, like dpkg's, and fail when it is taken
+LOCKED = {"apt-get"}
+
+LOCK = """if ! mkdir "{lock}" 2>/dev/null; then
+    echo "E: Could not get lock /var/lib/dpkg/lock-frontend. It is held by another process" >&2
+    exit 100
+fi
+trap 'rmdir "{lock}"' EXIT
+"""
+
+STUB = """#!/bin/sh
+echo "{name} $*" >> "{calls}"
+{lock}sleep {latency}
+if [ "{failure_rate}" != "0" ]; then
+    n=$(cat "{counter}" 2>/dev/null || echo 0)
+    echo $((n + 1)) > "{counter}"
+    if awk -v seed="$(({seed} * 100003 + n))" -v rate="{failure_rate}" \\
+        'BEGIN {{ srand(seed); exit !(rand() < rate) }}'; then
+        echo "E: simulated {name} failure" >&2
+        exit 1
+    fi
+fi
+{behaviour}
+exit 0
+"""
+
+
+def parse_overrides(values, default: float) -> dict:
+    """Turn ['0.2', 'apt-get=1.5'] into a default plus per-tool values"""
+    overrides = {"*": default}
+    for value in values or []:
+        if "=" in value:
+            name, number = value.split("=", 1)
+            overrides[name] = float(number)
+        else:
+            overrides["*"] = float(value)
+    return overrides
+
+
+class Sandbox:
+    """Temporary HOME, stub PATH and pre-seeded download cache for one run"""
+
+    def __init__(self, root: Path, latency: dict, failure_rate: dict, seed: int):
+        self.root = root
+        self.home = root / "home"
+        self.bin = root / "bin"
+        self.templates = root / "templates"
+        self.cache = root / "cache"
+        self.calls = root / "calls.log"
+        for path in (self.home, self.bin, self.templates, root / "counters"):
+            path.mkdir(parents=True, exist_ok=True)
+
+        for name in MANAGERS:
+            self._write_stub(self.bin / name, name, BEHAVIOUR.get(name, ""), latency, failure_rate, seed)
+        for name, behaviour in INSTALLABLE.items():
+            self._write_stub(self.templates / name, name, behaviour, latency, failure_rate, seed)
+
+        # Installers come from a warm cache, as on a re-provisioned fleet machine
+        cache = atriumos.DownloadCache(self.cache)
+        cache.put(atriumos.GH_KEYRING_URL, b"stub keyring")
+        cache.put(atriumos.HOMEBREW_INSTALL_URL, b"#!/bin/sh\nexit 0\n")
+        # The oh-my-posh release binary is the stub itself, installed into HOME/.local/bin
+        arch = atriumos.RELEASE_ARCHITECTURES.get(platform.machine().lower(), "amd64")
+        release = atriumos.OH_MY_POSH_RELEASE_URL.format(arch=arch)
+        binary = cache.put(release, (self.templates / "oh-my-posh").read_bytes())
+        cache.put(release + ".sha256", f"{binary.name}  posh-linux-{arch}\n".encode())
+
+    def _write_stub(self, path: Path, name: str, behaviour: str, latency: dict, failure_rate: dict, seed: int):
+        script = STUB.format(
+            name=name,
+            calls=self.calls,
+            counter=self.root / "counters" / name,
+            latency=latency.get(name, latency["*"]),
+            failure_rate=failure_rate.get(name, failure_rate["*"]),
+            seed=seed,
+            lock=LOCK.format(lock=self.root / "dpkg.lock") if name in LOCKED else "",
+            behaviour=behaviour.format(templates=self.templates, bin=self.bin),
+        )
+        path.write_text(script)
+        path.chmod(0o755)
+
+    def run(self, jobs: int, targets: int = 1) -> dict:
+        """Run atriumos once and return its metrics
+
+        With more than one target, atriumos provisions that many homes in
+        fleet mode instead, and commands counts the target processes.
+        """
+        trace = self.root / "trace.json"
+        calls_before = self._calls()
+        env = {
+            "HOME": str(self.home),
+            "PATH": os.pathsep.join([str(self.bin), "/usr/bin", "/bin"]),
+            "SHELL": "/bin/bash",
+            "LANG": os.environ.get("LANG", "C.UTF-8"),
+        }
+        options = [
+            "--offline", "--jobs", str(jobs),
+            # The host's own package lists must not decide whether apt-get update runs
+            "--index-max-age", "0",
+        ]
+        command = [sys.executable, str(REPO_ROOT / "atriumos.py"), "--yes", "--plain",
+                   "--cache-dir", str(self.cache), "--trace", str(trace)]
+        if targets > 1:
+            manifest = self.root / "fleet.json"
+            homes = [{"home": str(self.root / "targets" / f"home{index}")} for index in range(targets)]
+            manifest.write_text(json.dumps({"args": options, "targets": homes}))
+            command += ["fleet", str(manifest), "--jobs", str(targets)]
+        else:
+            command += options
+        start = time.perf_counter()
+        process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        returncode, _, max_rss = atriumos.wait_with_usage(process)
+        wall = time.perf_counter() - start
+
+        events = json.loads(trace.read_text())["traceEvents"] if trace.exists() else []
+        return {
+            "returncode": returncode,
+            "wall_s": wall,
+            "commands": sum(1 for event in events if event.get("cat") == "command"),
+            "tool_calls": self._calls() - calls_before,
+            "peak_rss_kb": max_rss,
+        }
+
+    def _calls(self) -> int:
+        try:
+            return len(self.calls.read_text().splitlines())
+        except OSError:
+            return 0
+
+
+def git_commit() -> str:
+    """Current commit, marked dirty when the tree has local changes"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def summarize(runs: list) -> dict:
+    """Median of every metric over a list of runs"""
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0] if key != "returncode"}
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description="Benchmark atriumos provisioning against stub tools")
+    parser.add_argument("-n", "--runs", type=int, default=3, help="runs per scenario (default: 3)")
+    parser.add_argument("-j", "--jobs", type=int, default=4, help="atriumos --jobs value (default: 4)")
+    parser.add_argument("--latency", action="append", metavar="[TOOL=]SECONDS",
+                        help="stub latency, for all tools or one tool (default: 0.2)")
+    parser.add_argument("--failure-rate", action="append", metavar="[TOOL=]RATE",
+                        help="probability that a stub call fails, for all tools or one tool (default: 0)")
+    parser.add_argument("--seed", type=int, default=1, help="seed for simulated failures (default: 1)")
+    parser.add_argument("--targets", type=int, default=1,
+                        help="provision this many homes at once in fleet mode (default: 1, a normal run)")
+    parser.add_argument("--no-save", action="store_true", help=f"do not append results to {RESULTS_PATH}")
+    args = parser.parse_args()
+
+    if platform.system() != "Linux":
+        sys.exit("The provisioning benchmark runs the Linux code path and needs a Linux box")
+
+    latency = parse_overrides(args.latency, 0.2)
+    failure_rate = parse_overrides(args.failure_rate, 0.0)
+    scenarios = {"cold": [], "warm": []}
+    for _ in range(args.runs):
+        root = Path(tempfile.mkdtemp(prefix="atriumos-bench-"))
+        try:
+            sandbox = Sandbox(root, latency, failure_rate, args.seed)
+            scenarios["cold"].append(sandbox.run(args.jobs, args.targets))
+            # Same HOME again: everything should be up to date
+            scenarios["warm"].append(sandbox.run(args.jobs, args.targets))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    result = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"jobs": args.jobs, "latency": latency, "failure_rate": failure_rate, "runs": args.runs},
+        "scenarios": {name: summarize(runs) for name, runs in scenarios.items()},
+    }
+
+    if args.targets > 1:
+        result["config"]["targets"] = args.targets
+
+    previous = None
+    if RESULTS_PATH.exists():
+        for line in RESULTS_PATH.read_text().splitlines():
+            entry = json.loads(line)
+            if entry["commit"] != result["commit"] and entry["config"] == result["config"]:
+                previous = entry
+
+    print(f"{'scenario':<8} {'wall':>9} {'commands':>9} {'tool calls':>11} {'peak RSS':>11}")
+    for name, metrics in result["scenarios"].items():
+        line = (f"{name:<8} {metrics['wall_s']:8.2f}s {metrics['commands']:9.0f} "
+                f"{metrics['tool_calls']:11.0f} {metrics['peak_rss_kb'] / 1024:9.1f} MB")
+        if previous and name in previous["scenarios"]:
+            before = previous["scenarios"][name]["wall_s"]
+            line += f"   {(metrics['wall_s'] - before) / before * 100:+.1f}% vs {previous['commit']}"
+        print(line)
+    failures = sum(1 for runs in scenarios.values() for run in runs if run["returncode"] != 0)
+    if failures:
+        print(f"{failures} run(s) exited with an error")
+
+    if not args.no_save:
+        RESULTS_PATH.parent.mkdir(exist_ok=True)
+        with open(RESULTS_PATH, "a") as f:
+            f.write(json.dumps(result, sort_keys=True) + "\n")
+
+
+if __name__ == "__main__":
+    main()
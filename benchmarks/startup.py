@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+atriumOS startup benchmark
+Measures how long the atriumos entry point takes to start and fails when it
+goes over budget or imports rich for non-interactive output.
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# name -> (arguments passed to atriumos.main, whether rich may be imported)
+SCENARIOS = {
+    "help": (["--help"], False),
+    "plain-inventory": (["--plain", "--inventory"], False),
+}
+
+
+def run_scenario(argv, home: Path) -> tuple:
+    """Start atriumos once and return (seconds, whether rich was imported)"""
+    code = (
+        "import sys, atriumos\n"
+        f"try:\n    atriumos.main({argv!r})\n"
+        "except SystemExit:\n    pass\n"
+        "sys.stderr.write('RICH=%d' % ('rich' in sys.modules))\n"
+    )
+    env = {**os.environ, "HOME": str(home), "PYTHONPATH": str(REPO_ROOT)}
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    return elapsed, "RICH=1" in result.stderr
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description="Benchmark atriumos startup time")
+    parser.add_argument("-n", "--runs", type=int, default=10, help="runs per scenario (default: 10)")
+    parser.add_argument("--budget-ms", type=float, default=250,
+                        help="fail when the median of a scenario exceeds this (default: 250)")
+    args = parser.parse_args()
+
+    baseline = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        baseline.append(time.perf_counter() - start)
+    print(f"{'python -c pass':<20} {statistics.median(baseline) * 1000:8.1f} ms")
+
+    failed = False
+    with tempfile.TemporaryDirectory() as home:
+        for name, (argv, rich_allowed) in SCENARIOS.items():
+            # First run warms the inventory cache and the bytecode cache
+            run_scenario(argv, Path(home))
+            timings, rich_imported = [], False
+            for _ in range(args.runs):
+                elapsed, imported = run_scenario(argv, Path(home))
+                timings.append(elapsed)
+                rich_imported = rich_imported or imported
+
+            median_ms = statistics.median(timings) * 1000
+            notes = []
+            if median_ms > args.budget_ms:
+                notes.append(f"over budget ({args.budget_ms:.0f} ms)")
+            if rich_imported and not rich_allowed:
+                notes.append("imported rich")
+            failed = failed or bool(notes)
+            print(f"{name:<20} {median_ms:8.1f} ms  {'; '.join(notes) or 'ok'}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
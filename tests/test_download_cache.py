@@ -0,0 +1,159 @@
+"""DownloadCache against a local HTTP server"""
+
+import hashlib
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from atriumos import CommandCancelled, DownloadCache, DownloadError  # noqa: E402
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            number = server.requests
+        body = server.content
+        # A server behind an inconsistent load balancer hands out a new ETag with every response
+        etag = f'"{number}"' if server.changing_etag else f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        ranged = self.headers.get("Range")
+        if self.headers.get("If-Range") not in (None, etag):
+            ranged = None
+        if ranged and server.honor_ranges:
+            start, end = ranged.split("=", 1)[1].split("-")
+            start, end = int(start), int(end) if end else len(body) - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+            body = body[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.end_headers()
+        if server.cut_short and "Range" not in self.headers:
+            # Drop the connection halfway through the body
+            server.cut_short -= 1
+            self.wfile.write(body[:len(body) // 2])
+            return
+        self.wfile.write(body)
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.lock = threading.Lock()
+        self.server.requests = 0
+        self.server.content = b"version one\n"
+        self.server.honor_ranges = True
+        self.server.changing_etag = False
+        self.server.cut_short = 0
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/file"
+
+    def cache(self, **options) -> DownloadCache:
+        return DownloadCache(self.root / "cache", timeout=5, **options)
+
+    @staticmethod
+    def sha256(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def test_fresh_entry_is_served_without_a_request(self):
+        cache = self.cache()
+        self.assertEqual(cache.fetch(self.url).read_bytes(), b"version one\n")
+        cache.fetch(self.url)
+        self.assertEqual(self.server.requests, 1)
+
+    def test_new_pinned_hash_is_downloaded_within_max_age(self):
+        cache = self.cache()
+        cache.fetch(self.url, self.sha256(b"version one\n"))
+        self.server.content = b"version two\n"
+        path = cache.fetch(self.url, self.sha256(b"version two\n"))
+        self.assertEqual(path.read_bytes(), b"version two\n")
+
+    def test_new_pinned_hash_is_an_error_offline(self):
+        self.cache().fetch(self.url, self.sha256(b"version one\n"))
+        with self.assertRaises(DownloadError):
+            self.cache(offline=True).fetch(self.url, self.sha256(b"version two\n"))
+
+    def test_stale_content_with_an_old_hash_is_not_a_fallback(self):
+        self.cache().fetch(self.url)
+        self.server.shutdown()
+        self.server.server_close()
+        with self.assertRaises(DownloadError):
+            self.cache(max_age=0).fetch(self.url, self.sha256(b"version two\n"))
+
+    def test_checksum_mismatch_is_rejected(self):
+        with self.assertRaises(DownloadError):
+            self.cache().fetch(self.url, self.sha256(b"something else\n"))
+
+    def test_large_file_is_split_into_ranges(self):
+        self.server.content = bytes(range(256)) * 64
+        path = self.cache(split_size=2048).fetch(self.url, self.sha256(self.server.content))
+        self.assertEqual(path.read_bytes(), self.server.content)
+        self.assertEqual(self.server.requests, 4)
+
+    def test_server_ignoring_ranges_falls_back_to_one_stream(self):
+        self.server.content = bytes(range(256)) * 64
+        self.server.honor_ranges = False
+        path = self.cache(split_size=2048).fetch(self.url, self.sha256(self.server.content))
+        self.assertEqual(path.read_bytes(), self.server.content)
+        self.assertLessEqual(self.server.requests, 5)
+
+    def test_server_changing_etag_falls_back_to_one_stream(self):
+        self.server.content = bytes(range(256)) * 64
+        self.server.changing_etag = True
+        path = self.cache(split_size=2048).fetch(self.url, self.sha256(self.server.content))
+        self.assertEqual(path.read_bytes(), self.server.content)
+        self.assertLessEqual(self.server.requests, 5)
+
+    def test_file_that_keeps_changing_is_an_error(self):
+        self.server.content = bytes(range(256)) * 64
+        self.server.changing_etag = True
+        # The single stream breaks once, and the restart sees yet another ETag
+        self.server.cut_short = 2
+        with self.assertRaises(DownloadError):
+            self.cache(split_size=2048, attempts=2).fetch(self.url)
+        self.assertLessEqual(self.server.requests, 6)
+
+    def test_cancelled_download_stops_and_resumes_later(self):
+        self.server.content = bytes(range(256)) * 64
+        cache = self.cache(split_size=2048)
+        cache.cancelled.set()
+        with self.assertRaises(CommandCancelled):
+            cache.fetch(self.url)
+        self.assertIsNone(cache.lookup(self.url))
+        path = self.cache(split_size=2048).fetch(self.url, self.sha256(self.server.content))
+        self.assertEqual(path.read_bytes(), self.server.content)
+
+    def test_eviction_tolerates_blobs_that_are_already_gone(self):
+        cache = self.cache()
+        blob = cache.put("https://example.invalid/a", b"a" * 10)
+        cache.put("https://example.invalid/b", b"b" * 10)
+        blob.unlink()
+        cache.max_bytes = 5
+        cache.evict()
+        self.assertEqual(list((self.root / "cache" / "index").glob("*.json")), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
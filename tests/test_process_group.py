@@ -0,0 +1,76 @@
+"""Commands run in their own process group and are stopped together with their children"""
+
+import os
+import subprocess
+import sys
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import atriumos  # noqa: E402
+
+
+def start(args, shell=False):
+    args, shell, options = atriumos.in_process_group(args, shell)
+    return subprocess.Popen(args, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **options)
+
+
+def group_alive(pgid: int) -> bool:
+    try:
+        os.killpg(pgid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+@unittest.skipIf(os.name == "nt", "process groups are POSIX")
+class ProcessGroupTest(unittest.TestCase):
+    # Every test runs with Popen's process_group argument and with the launcher used before Python 3.11
+    def run(self, result=None):
+        for native in (True, False):
+            if native and not atriumos.POPEN_PROCESS_GROUP:
+                continue
+            with mock.patch.object(atriumos, "POPEN_PROCESS_GROUP", native):
+                super().run(result)
+
+    def test_command_leads_its_own_group_in_our_session(self):
+        process = start([sys.executable, "-c", "import os; print(os.getpid(), os.getpgid(0), os.getsid(0))"])
+        output, _ = process.communicate(timeout=30)
+        pid, pgid, sid = map(int, output.split())
+        self.assertEqual(pid, process.pid)
+        self.assertEqual(pgid, process.pid)
+        self.assertEqual(sid, os.getsid(0))
+
+    def test_shell_command_runs(self):
+        process = start("echo $((1 + 2))", shell=True)
+        output, _ = process.communicate(timeout=30)
+        self.assertEqual(output.strip(), b"3")
+
+    def test_missing_command_is_reported_before_starting(self):
+        with self.assertRaises(FileNotFoundError):
+            start(["atriumos-no-such-command"])
+
+    def test_kill_stops_children(self):
+        process = start("sleep 30 & sleep 30", shell=True)
+        time.sleep(0.5)
+        atriumos.kill_process_group(process, grace=1)
+        process.wait(timeout=10)
+        deadline = time.monotonic() + 5
+        while group_alive(process.pid) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(group_alive(process.pid))
+
+    def test_kill_escalates_when_terminate_is_ignored(self):
+        process = start("trap '' TERM; sleep 30 & wait", shell=True)
+        time.sleep(0.5)
+        started = time.monotonic()
+        atriumos.kill_process_group(process, grace=0.5)
+        process.wait(timeout=10)
+        self.assertLess(time.monotonic() - started, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
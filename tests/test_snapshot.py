@@ -0,0 +1,84 @@
+"""Snapshot restore must never write outside the home directory"""
+
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from atriumos import Snapshot  # noqa: E402
+
+
+class RestoreTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.source = self.root / "source"
+        self.home = self.root / "home"
+        self.outside = self.root / "outside"
+        for path in (self.source, self.home, self.outside):
+            path.mkdir()
+        config = self.source / ".config" / "atriumos"
+        config.mkdir(parents=True)
+        (config / "theme.json").write_text('{"theme": 1}\n')
+        self.archive = self.root / "snapshot.tar.gz"
+        Snapshot(self.source).bake(self.archive, [self.source / ".config"], [],
+                                   {".bashrc": {"oh-my-posh": "eval \"$(oh-my-posh init bash)\""}})
+
+    def test_restores_into_home(self):
+        stats = Snapshot(self.home).restore(self.archive)
+        self.assertEqual(stats["written"], 1)
+        self.assertEqual((self.home / ".config/atriumos/theme.json").read_text(), '{"theme": 1}\n')
+        self.assertIn("oh-my-posh init bash", (self.home / ".bashrc").read_text())
+
+    def test_planted_temp_file_link_is_not_followed(self):
+        victim = self.outside / "victim"
+        victim.write_text("untouched\n")
+        config = self.home / ".config" / "atriumos"
+        config.mkdir(parents=True)
+        # The name the temporary file had before restore used unique temporary files
+        os.symlink(str(victim), str(config / ".theme.json.tmp"))
+        Snapshot(self.home).restore(self.archive)
+        self.assertEqual(victim.read_text(), "untouched\n")
+        self.assertEqual((config / "theme.json").read_text(), '{"theme": 1}\n')
+
+    def test_rc_file_linking_outside_home_is_refused(self):
+        victim = self.outside / "bashrc"
+        victim.write_text("untouched\n")
+        os.symlink(str(victim), str(self.home / ".bashrc"))
+        with self.assertRaises(ValueError):
+            Snapshot(self.home).restore(self.archive)
+        self.assertEqual(victim.read_text(), "untouched\n")
+        self.assertFalse((self.home / ".config").exists())
+
+    def test_rc_file_linking_inside_home_is_written_through(self):
+        dotfiles = self.home / "dotfiles"
+        dotfiles.mkdir()
+        (dotfiles / "bashrc").write_text("export EDITOR=vim\n")
+        os.symlink(str(dotfiles / "bashrc"), str(self.home / ".bashrc"))
+        Snapshot(self.home).restore(self.archive)
+        self.assertTrue((self.home / ".bashrc").is_symlink())
+        self.assertIn("oh-my-posh init bash", (dotfiles / "bashrc").read_text())
+
+    def test_file_linking_outside_home_is_refused(self):
+        victim = self.outside / "theme.json"
+        victim.write_text("untouched\n")
+        config = self.home / ".config" / "atriumos"
+        config.mkdir(parents=True)
+        os.symlink(str(victim), str(config / "theme.json"))
+        with self.assertRaises(ValueError):
+            Snapshot(self.home).restore(self.archive)
+        self.assertEqual(victim.read_text(), "untouched\n")
+
+    def test_parent_linking_outside_home_is_refused(self):
+        os.symlink(str(self.outside), str(self.home / ".config"))
+        with self.assertRaises(ValueError):
+            Snapshot(self.home).restore(self.archive)
+        self.assertEqual(list(self.outside.iterdir()), [])
+
+
+if __name__ == "__main__":
+    unittest.main()